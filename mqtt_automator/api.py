@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import secrets
+from datetime import datetime
+from typing import TYPE_CHECKING, AsyncGenerator, Optional
+
+from mqtt_automator import metrics
+from mqtt_automator.devices.base import BaseClient
+from mqtt_automator.devices.table import FIELDS
+from mqtt_automator.web import Request, Response
+
+if TYPE_CHECKING:
+    from mqtt_automator.automator import Automator
+
+log = logging.getLogger(__name__)
+
+BOOT_ID = secrets.token_hex(4)  # versions restart with the process, ETags of the previous one must not match
+
+
+def event(name: str, version: int, data) -> bytes:
+    """
+    >>> event('state', 7, {'device': 'cabinet', 'sub_topic': 'speed', 'value': 3})
+    b'id: 7\\nevent: state\\ndata: {"device": "cabinet", "sub_topic": "speed", "value": 3}\\n\\n'
+    """
+    return f'id: {version}\nevent: {name}\ndata: {json.dumps(data, default=str)}\n\n'.encode()
+
+
+class Subscriber:
+    __slots__ = ('queue',)
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize)
+
+
+class ControlApi:
+    """
+    HTTP API of Automator, served on app.api_host:app.api_port:
+    - GET /state - state, blocks, desired state and availability of all devices, `?device=name` limits devices.
+      ETag is the boot id and version of StateTable, polling with If-None-Match gets 304 until something changes.
+    - POST /command - JSON {"device": name, "sub_topic": ..., "payload": ...} is published like a manual change
+      on the device: the schedule doesn't override the sub-topic for the override duration. It goes through
+      the outbox of the device, so it's coalesced, rate limited and capped like the scheduled writes.
+    - GET /events - Server-Sent Events: `snapshot` of /state first, then `state`, `block`, `desired` and
+      `availability` changes as {"device", "sub_topic", "value"}, `id` is the version.
+    Events are formatted once and put into bounded queues of subscribers without waiting,
+    a subscriber whose queue is full is disconnected, so slow consumers never delay feedback handling.
+    """
+    queue_size = 256
+    keepalive = 15
+
+    def __init__(self, automator: 'Automator'):
+        self.automator = automator
+        self.table = BaseClient.table
+        self.subscribers: set[Subscriber] = set()
+        self.cached: tuple[int, bytes] = (-1, b'')  # version and body of the last full /state
+
+    def routes(self) -> dict:
+        return {
+            ('GET', '/state'): self.serve_state,
+            ('POST', '/command'): self.serve_command,
+            ('GET', '/events'): self.serve_events,
+        }
+
+    def state(self, names: Optional[list[str]] = None) -> dict:
+        devices = self.automator.devices
+        rows = {client.row: name for name, client in devices.items() if names is None or name in names}
+        fields = {field: self.table.snapshot(field, rows) for field in FIELDS}
+        return {
+            'version': self.table.version,
+            'devices': {
+                name: {
+                    **{field: values.get(name, dict()) for field, values in fields.items()},
+                    'online': devices[name].availability.online,
+                }
+                for name in rows.values()
+            },
+        }
+
+    async def serve_state(self, request: Request) -> Response:
+        version = self.table.version
+        headers = {'ETag': f'"{BOOT_ID}-{version}"', 'Cache-Control': 'no-cache'}
+        if request.headers.get('if-none-match') == headers['ETag']:
+            return Response(304, headers=headers)
+        names = request.query.get('device')
+        if names is None and self.cached[0] == version:
+            body = self.cached[1]
+        else:
+            body = json.dumps(self.state(names), default=str).encode()
+            if names is None:
+                self.cached = version, body
+        return Response(body=body, content_type='application/json', headers=headers)
+
+    async def serve_command(self, request: Request) -> Response:
+        try:
+            command = json.loads(request.body)
+            name, sub_topic, payload = command['device'], command['sub_topic'], command['payload']
+        except (ValueError, KeyError, TypeError):
+            return Response(400, b'JSON with device, sub_topic and payload is expected\n')
+        client = self.automator.devices.get(name)
+        if client is None:
+            return Response(404, b'Unknown device\n')
+        if not client.availability.allows():
+            return Response(503, b'Device is offline\n')
+
+        client.set_block(sub_topic, datetime.now())  # a manual change even if it's skipped or still queued
+        try:
+            async with asyncio.timeout(self.automator.config.settings.publish_timeout):
+                published = await self.automator.dispatcher.send(client, sub_topic, payload)
+        except TimeoutError:
+            return Response(504, b'Publish timed out\n')
+        log.info('Command %s %s %s: %s', name, sub_topic, payload, 'published' if published else 'skipped')
+        body = json.dumps({'published': published, 'version': self.table.version}).encode()
+        return Response(body=body, content_type='application/json')
+
+    async def serve_events(self, _: Request) -> Response:
+        return Response(content_type='text/event-stream', headers={'Cache-Control': 'no-cache'},
+                        stream=self.events(Subscriber(self.queue_size)))
+
+    async def events(self, subscriber: Subscriber) -> AsyncGenerator[bytes, None]:
+        if not self.subscribers:
+            self.table.listeners.append(self.publish)
+        self.subscribers.add(subscriber)
+        try:
+            yield event('snapshot', self.table.version, self.state())
+            while True:
+                try:
+                    async with asyncio.timeout(self.keepalive):
+                        chunk = await subscriber.queue.get()
+                except TimeoutError:
+                    yield b': keepalive\n\n'
+                    continue
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.unsubscribe(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.publish in self.table.listeners:
+            self.table.listeners.remove(self.publish)
+
+    def publish(self, version: int, field: str, device: str, sub_topic: str, value):
+        """StateTable listener, it's called synchronously on every change"""
+        if device not in self.automator.devices:
+            return
+        chunk = event(field, version, {'device': device, 'sub_topic': sub_topic, 'value': value})
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(chunk)
+            except asyncio.QueueFull:
+                log.warning('Dropping events subscriber, %d events are not consumed', subscriber.queue.qsize())
+                metrics.api_subscribers_dropped.inc()
+                self.unsubscribe(subscriber)
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
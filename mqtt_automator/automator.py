@@ -1,93 +1,518 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
 import logging
+import signal
+import time
 
-from datetime import datetime
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, Union
 
+from mqtt_automator import metrics
+from mqtt_automator.api import ControlApi
+from mqtt_automator.broker import Broker
 from mqtt_automator.config.parser import ConfigParser
-from mqtt_automator.devices import base, vakio, lytko, yeelink
+from mqtt_automator.devices import base
+from mqtt_automator.devices.overrides import Overrides
+from mqtt_automator.devices.registry import ClientRegistry
+from mqtt_automator.dispatcher import Dispatcher
+from mqtt_automator.ingest import Ingest
+from mqtt_automator.journal import KIND_IDS, Journal, shard_paths
+from mqtt_automator.readiness import Readiness
+from mqtt_automator.store import BaseStore, SQLiteStore
+from mqtt_automator.topics import TopicTrie
+from mqtt_automator.watchdog import Watchdog, run_loop
+from mqtt_automator.web import Request, Response, WebServer
 
 log = logging.getLogger(__name__)
 
+LOG_FORMAT = '%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s:%(lineno)d: %(message)s'
+
 
 class Automator:
-    client_map = {
-        'lytko': lytko.LytkoClient,
-        'vakio': vakio.VakioClient,
-        'yeelink': yeelink.YeelinkClient,
-    }
-
-    def __init__(self):
-        self.config = ConfigParser()
+    client_map = ClientRegistry()  # vendor modules are imported on first use
+    restart_settings = (  # app settings applied at start only, the other ones are applied by reload()
+        'state_file', 'state_flush_interval', 'metrics_port', 'metrics_host', 'api_port', 'api_host', 'shards',
+        'shard_by', 'shard_report_interval', 'journal_file', 'journal_max_size', 'journal_keep',
+        'journal_flush_interval', 'event_loop', 'watchdog_threshold', 'watchdog_interval',
+    )
+
+    def __init__(self, config: Union[str, ConfigParser] = 'config.yml', shard: Optional[int] = None,
+                 cache: Optional[str] = None):
+        """
+        `config` is a path to config.yml or a parsed one, then `shard` and `cache` are taken from it.
+        `shard` is set in worker processes of Supervisor, such automator handles only devices of this shard.
+        `cache` is a path to compiled config cache, see ConfigParser.
+        """
+        if isinstance(config, str):
+            if cache and shard is not None:
+                cache = f'{cache}.shard{shard}'
+            config = ConfigParser(config, shard=shard, cache=cache)
+        self.config = config
+        shard = config.shard
         logging.basicConfig(
             level=logging.getLevelName(self.config.settings.log_level),
-            format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s:%(lineno)d: %(message)s'
+            format=('' if shard is None else f'[shard {shard}] ') + LOG_FORMAT
         )
+        self.resources: dict[str, object] = {'publish_timeout': self.config.settings.publish_timeout}  # see share()
+        self.overrides = Overrides(self.config.settings.override_duration, self.config.settings.override_durations)
+        self.store: Optional[BaseStore] = None
+        if self.config.settings.state_file:
+            self.store = SQLiteStore(self.config.settings.state_file, self.config.settings.state_flush_interval)
+        self.journal: Optional[Journal] = None
         self.devices: dict[str, base.BaseClient] = {
-            device.name: self.client_map[device.vendor](device, self.config.broker)
-            for device in self.config.get_devices()
+            device.name: self.create_client(device) for device in self.config.get_devices()
         }
+        if self.store:
+            snapshot = self.store.load()
+            log.info('Restored state of %d devices from %s', len(snapshot), self.config.settings.state_file)
+            for name, client in self.devices.items():
+                client.restore(snapshot.get(name, dict()))
+        settings = self.config.settings
+        if settings.journal_file:
+            self.journal = Journal(settings.journal_file + ('' if shard is None else f'.shard{shard}'),
+                                   settings.journal_max_size, settings.journal_keep, settings.journal_flush_interval)
+            self.journal.listen(base.BaseClient.table)
+            for client in self.devices.values():
+                client.journal = self.journal
+        self.watchdog = Watchdog(settings.watchdog_threshold, settings.watchdog_interval)
+        self.dispatcher = Dispatcher(settings.concurrency, settings.publish_timeout, self.watchdog,
+                                     settings.publish_interval)
+        self.routes: defaultdict[str, TopicTrie] = defaultdict(TopicTrie)  # broker name -> routes
+        self.filters = Counter()  # (broker name, topic filter) -> number of devices
+        self.readiness = Readiness()
+        self.wakeup = asyncio.Event()
+        self.planned: Optional[datetime] = None
+        self.feedback_counters: dict[tuple[str, str], metrics.CounterValue] = dict()  # by (broker, topic)
+        self.ingests = {name: Ingest(partial(self.handle, broker=name)) for name in self.config.brokers}
+        self.recovered: set[base.BaseClient] = set()
+        self.availability_changed = asyncio.Event()
+        for client in self.devices.values():
+            client.broker.connection.subscriptions.update(self.register(client))
+
+    def create_client(self, device: base.Device) -> base.BaseClient:
+        client = self.client_map[device.vendor](device, self.config.broker_for(device), self.store)
+        client.overrides = self.overrides
+        client.journal = self.journal
+        client.share(self.resources)
+        return client
+
+    def register(self, device_client: base.BaseClient) -> list[str]:
+        """Returns topic filters that are not subscribed yet on the broker of the device"""
+        device_client.on_recovery = self.recover
+        broker, routes = device_client.broker.name, self.routes[device_client.broker.name]
+        for topic in device_client.subscriptions():
+            routes.insert(topic, device_client)
+            self.readiness.expect(topic, device_client, broker)
+        topic_filters = list(device_client.subscription_filters())
+        if device_client.device.availability:
+            routes.insert(device_client.device.availability, device_client)
+            topic_filters.append(device_client.device.availability)
+        new_filters = [topic_filter for topic_filter in topic_filters if not self.filters[broker, topic_filter]]
+        self.filters.update((broker, topic_filter) for topic_filter in topic_filters)
+        return new_filters
+
+    def unregister(self, device_client: base.BaseClient) -> list[str]:
+        """Returns topic filters that are not used by any device of its broker anymore"""
+        broker, routes = device_client.broker.name, self.routes[device_client.broker.name]
+        topic_filters = list(device_client.subscription_filters())
+        for topic in device_client.subscriptions():
+            routes.remove(topic, device_client)
+        if device_client.device.availability:
+            routes.remove(device_client.device.availability, device_client)
+            topic_filters.append(device_client.device.availability)
+        self.filters.subtract((broker, topic_filter) for topic_filter in topic_filters)
+        keys = {(broker, topic_filter) for topic_filter in topic_filters}
+        unused = [key for key in keys if self.filters[key] <= 0]
+        for key in unused:
+            del self.filters[key]
+        return [topic_filter for _, topic_filter in unused]
+
+    async def reload(self):
+        """
+        Applies config.yml changes without restart: only added/removed devices are (un)subscribed,
+        clients of unchanged devices keep their state, rules of unchanged devices are not recompiled.
+        """
+        started_at = datetime.now()
+        try:
+            config = ConfigParser(self.config.file_name, previous=self.config, shard=self.config.shard,
+                                  cache=self.config.cache)
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.exception('Failed to reload %s, keeping the running config', self.config.file_name)
+            self.config.mtime = self.config.current_mtime()
+            return
+
+        if new_brokers := config.brokers.keys() - self.config.brokers.keys():
+            log.error('New brokers %s require restart, keeping the running config', ', '.join(sorted(new_brokers)))
+            self.config.mtime = self.config.current_mtime()
+            return
+        for name, broker in config.brokers.items():
+            running = self.config.brokers[name]
+            if broker.model_dump(exclude={'vendors'}) != running.model_dump(exclude={'vendors'}):
+                log.warning('Broker changes require restart, keeping connection to %s', running.ip)
+            running.vendors = broker.vendors
+        config.vendor_brokers = {
+            vendor: self.config.brokers[broker.name] for vendor, broker in config.vendor_brokers.items()
+        }
+        config.brokers, config.broker = self.config.brokers, self.config.broker
+        added, removed, changed = config.diff_devices(self.config)
+        removed_names = {device.name for device in removed}
+        for device in config.get_devices():  # `vendors` of brokers changed, clients are recreated on the new broker
+            client = self.devices.get(device.name)
+            if client and device.name not in removed_names and config.broker_for(device) is not client.broker:
+                log.info('%s moves to broker %s', client, config.broker_for(device).name)
+                removed.append(client.device)
+                added.append(device)
+        changed = [device for device in changed if device not in added]
+        new_filters, unused_filters = defaultdict(list), defaultdict(list)
+        for device in removed:
+            device_client = self.devices.pop(device.name)
+            unused_filters[device_client.broker.name].extend(self.unregister(device_client))
+            self.dispatcher.forget(device_client)
+            self.overrides.forget(device_client)
+            device_client.close()
+        for device in changed:
+            self.devices[device.name].device = device
+        previous, self.config = self.config.settings, config
+        self.apply_settings(previous)
+        for device in added:
+            device_client = self.devices[device.name] = self.create_client(device)
+            new_filters[device_client.broker.name].extend(self.register(device_client))
+
+        for name, broker in self.config.brokers.items():
+            await broker.connection.unsubscribe(
+                topic_filter for topic_filter in unused_filters[name] if topic_filter not in new_filters[name])
+            await broker.connection.subscribe(new_filters[name])
+        self.wakeup.set()
+        log.info('Reloaded %s in %.1f ms: %d devices added, %d removed, %d changed', self.config.file_name,
+                 (datetime.now() - started_at).total_seconds() * 1000, len(added), len(removed), len(changed))
+
+    def apply_settings(self, previous):
+        settings = self.config.settings
+        if changed := [name for name in self.restart_settings if getattr(settings, name) != getattr(previous, name)]:
+            log.warning('Changes of app settings %s require restart', ', '.join(changed))
+        if settings.log_level != previous.log_level:
+            logging.getLogger().setLevel(logging.getLevelName(settings.log_level))
+        self.overrides.duration = settings.override_duration
+        self.overrides.vendor_durations = settings.override_durations
+        self.dispatcher.timeout = self.resources['publish_timeout'] = settings.publish_timeout
+        if settings.publish_timeout != previous.publish_timeout:
+            for client in self.devices.values():
+                client.share(self.resources)
+        self.dispatcher.intervals = settings.publish_interval
+        if settings.concurrency != previous.concurrency:
+            self.dispatcher.resize(settings.concurrency)
+
+    async def watch_config(self):
+        """Reloads config on SIGHUP or when config.yml is modified"""
+        reload_requested = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_requested.set)
+        while True:
+            interval = self.config.settings.config_watch_interval or None
+            try:
+                async with asyncio.timeout(interval):
+                    await reload_requested.wait()
+            except TimeoutError:
+                if not self.config.is_modified():
+                    continue
+            reload_requested.clear()
+            await self.reload()
 
     async def run(self):
         log.info('main')
-        await asyncio.wait([
+        tasks = [
             asyncio.create_task(self.feedback()),
-            asyncio.create_task(self.scheduler())
-        ])
+            asyncio.create_task(self.scheduler()),
+            asyncio.create_task(self.watch_config()),
+            asyncio.create_task(self.availability()),
+            asyncio.create_task(self.expire_overrides()),
+        ]
+        if self.store:
+            tasks.append(asyncio.create_task(self.store.run()))
+        if self.journal:
+            tasks.append(asyncio.create_task(self.journal.run()))
+        if self.watchdog.threshold:
+            tasks.append(asyncio.create_task(self.watchdog.run()))
+        settings, servers = self.config.settings, defaultdict(dict)  # (host, port) -> routes
+        if settings.metrics_port and self.config.shard is None:  # shards are served by Supervisor
+            servers[settings.metrics_host, settings.metrics_port][('GET', '/metrics')] = self.serve_metrics
+        if settings.api_port and self.config.shard is None:
+            servers[settings.api_host, settings.api_port].update(ControlApi(self).routes())
+        for (host, port), routes in servers.items():
+            tasks.append(asyncio.create_task(WebServer(routes).serve(host, port)))
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()  # tasks are eternal, a crashed one stops the daemon instead of failing silently
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def serve_metrics(_: Request) -> Response:
+        return Response(body=metrics.registry.render().encode(), content_type='text/plain; version=0.0.4')
 
     async def feedback(self):
-        """mqtt_client is transport to a broker, device_client is a specific for device management"""
-        subscriptions = dict()
-        async with self.config.broker.get_client() as mqtt_client:
-            for device_client in self.devices.values():
-                for topic in device_client.subscriptions():
-                    log.info('Subscribing to %s', topic)
-                    subscriptions[topic] = device_client
-                    await mqtt_client.subscribe(topic=topic)  # noqa
+        """Connection and subscription loops of all brokers"""
+        await asyncio.gather(*(self.broker_feedback(broker) for broker in self.config.brokers.values()))
+
+    async def broker_feedback(self, broker: Broker):
+        """connection is a shared transport to a broker, device_client is a specific for device management"""
+        connection, ingest = broker.connection, self.ingests[broker.name]
+        log.info('Routing %d topics, subscribing to %d topic filters on %s',
+                 len(self.routes[broker.name]), len(connection.subscriptions), broker.name)
+
+        try:
+            async with asyncio.TaskGroup() as group:  # a crashed ingest stops the connection instead of buffering
+                group.create_task(ingest.run())
+                group.create_task(connection.run(lambda message: ingest.put(message.topic.value, message.payload)))
+        except asyncio.CancelledError:
+            log.info('Received cancel, published %d messages to %s, average latency %.3f ms, reconnects: %d',
+                     connection.published, broker.name, connection.publish_latency_avg * 1000, connection.reconnects)
+            raise
 
+    def handle(self, topic: str, payload: bytes, broker: Optional[str] = None):
+        """`broker` is the name of broker the message came from, the default one if omitted"""
+        broker = broker or self.config.broker.name
+        self.readiness.seen(topic, broker)
+        device_clients = self.routes[broker].match(topic)
+        if not device_clients:
+            log.debug('Device client not found for %s', topic)
+            return
+        if (counter := self.feedback_counters.get((broker, topic))) is None:
+            counter = metrics.feedback_messages.labels(device_clients[0].device.vendor, topic)
+            self.feedback_counters[broker, topic] = counter
+        counter.inc()
+        log.debug('Received %s: %s', topic, payload)
+        if self.journal:  # once per message, the first routed device is its device in the journal
+            self.journal.received(device_clients[0].device.name, topic, payload)
+        watchdog = self.watchdog
+        for device_client in device_clients:
+            started_at = watchdog.start('receive', device_client.device.name)
             try:
-                async for message in mqtt_client.messages:
-                    device_client = subscriptions.get(message.topic.value)
-                    if not device_client:
-                        log.warning('Device client not found for %s', message.topic)
-                        continue
-                    log.debug('Received %s: %s', message.topic, message.payload)
-                    device_client.receive(message.topic.value, message.payload.decode())
-                    log.debug('State of %s: %s', device_client.device.id, device_client.state)
-
-            except asyncio.CancelledError:
-                log.info('Received cancel')
-                for topic in subscriptions:
-                    log.info('Unsubscribing from %s', topic)
-                    await mqtt_client.unsubscribe(topic=topic)  # noqa
-                raise
+                if not device_client.feed(topic, payload):
+                    continue
+            except (ValueError, KeyError, TypeError):
+                device_client.decode_failures.inc()
+                log.warning('%s failed to parse %s: %s', device_client, topic, payload, exc_info=True)
+                continue
+            finally:
+                watchdog.finish(started_at)
+            log.debug('State of %s: %s', device_client.device.id, device_client.state)
+
+    def snapshot(self) -> dict[str, dict]:
+        """BaseClient.snapshot() of all devices, fields are read from StateTable column by column"""
+        rows = {client.row: name for name, client in self.devices.items()}
+        fields = {field: base.BaseClient.table.snapshot(field, rows) for field in ('state', 'block', 'desired')}
+        return {
+            name: {
+                **{field: values.get(name, dict()) for field, values in fields.items()},
+                'availability': client.availability.as_dict(),
+            }
+            for name, client in self.devices.items()
+        }
+
+    def recover(self, device_client: base.BaseClient):
+        self.recovered.add(device_client)
+        self.availability_changed.set()
+
+    async def availability(self):
+        """
+        Sends desired state to devices that are back online, lets a single attempt through to offline devices
+        after their backoff and marks devices silent for availability_timeout seconds as offline.
+        """
+        while True:
+            now, timeout = time.monotonic(), self.config.settings.availability_timeout
+            wake_at = now + (timeout or self.config.settings.scheduler_resync)
+            for client in list(self.devices.values()):
+                availability = client.availability
+                if availability.online:
+                    if timeout and now - client.last_seen > timeout and next(iter(client.subscriptions()), None):
+                        client.mark_offline(f'no feedback for {timeout:.0f} seconds')
+                elif availability.allows():
+                    self.recovered.add(client)
+                else:
+                    wake_at = min(wake_at, availability.retry_at)
+
+            recovered, self.recovered = self.recovered, set()
+            for client in recovered:
+                if self.devices.get(client.device.name) is not client:
+                    continue  # removed by reload
+                await self.dispatcher.dispatch({client: list(client.desired.items())})
+                if not client.availability.online:
+                    client.availability.attempt()
+                    wake_at = min(wake_at, client.availability.retry_at)
+            if self.recovered:
+                continue
+
+            try:
+                async with asyncio.timeout(max(0.0, wake_at - time.monotonic())):
+                    await self.availability_changed.wait()
+            except TimeoutError:
+                pass
+            self.availability_changed.clear()
+
+    async def expire_overrides(self):
+        """Sub-topics are set by active rules right when their manual-override block expires"""
+        await self.readiness.wait(self.config.settings.startup_timeout)
+        while True:
+            if expired := self.overrides.expire():
+                log.info('Manual-override of %d sub-topics expired', len(expired))
+                sub_topics = defaultdict(set)
+                for client, sub_topic in expired:
+                    sub_topics[client.device.name].add(sub_topic)
+                actions, _, _ = self.collect(datetime.now(), sub_topics.keys())
+                await self.dispatcher.dispatch({
+                    client: [item for item in items if item[0] in sub_topics[client.device.name]]
+                    for client, items in actions.items()
+                })
+            await self.overrides.wait()
 
     async def scheduler(self):
-        noop = dict()
-        log.info('Waiting 5 seconds to init state from subscriptions')
-        await asyncio.sleep(5)
+        await self.readiness.wait(self.config.settings.startup_timeout)
 
         while True:
-            for device, name, rule in self.config.get_active_rules():
-                client: base.BaseClient = self.devices[device]
-                await self.apply_actions(client, device, name, rule.get('action', noop))
-                for sub_name, sub_rule in self.config.get_active_sub_rules(rule.get('sub_rules', noop)):
-                    await self.apply_actions(client, device, sub_name, sub_rule['action'])
+            now = datetime.now()
+            if self.planned and now >= self.planned:
+                metrics.tick_lag.observe((now - self.planned).total_seconds())
+            await self.tick(now)
+
+            if self.config.settings.scheduler == 'event':
+                self.planned = self.config.schedule.next_transition(now)
+                await self.sleep_until(self.planned)
+                continue
 
             until_start_of_next_minute = 60 - datetime.now().time().second
+            self.planned = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
             log.debug("Sleep for %d seconds until start of next minute", until_start_of_next_minute)
-            await asyncio.sleep(until_start_of_next_minute)
+            await self.sleep(until_start_of_next_minute)
+
+    async def sleep(self, delay: float) -> bool:
+        """Returns True if sleep was interrupted by config reload"""
+        try:
+            async with asyncio.timeout(delay):
+                await self.wakeup.wait()
+        except TimeoutError:
+            return False
+        self.wakeup.clear()
+        return True
+
+    async def sleep_until(self, target: datetime):
+        """
+        Sleeps on the event loop monotonic clock, but the remaining delay is recalculated from the wall clock
+        after every wake-up, so NTP corrections and DST shifts re-arm the timer instead of shifting rule edges.
+        Sleep is never longer than scheduler_resync seconds, so rules are re-evaluated after big clock jumps too.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.settings.scheduler_resync
+        while (delay := min((target - datetime.now()).total_seconds(), deadline - loop.time())) > 0:
+            log.debug('Sleep for %.3f seconds until %s', delay, target)
+            if await self.sleep(delay):
+                return
+
+    async def tick(self, now: datetime):
+        started_at = self.watchdog.start('tick', 'scheduler')
+        actions, evaluated, matched = self.collect(now)
+        self.watchdog.finish(started_at)
+        await self.dispatcher.dispatch(actions)
+        metrics.rules_evaluated.inc(evaluated)
+        metrics.rules_matched.inc(matched)
+        metrics.tick_duration.observe(time.perf_counter() - started_at)
+
+    def collect(self, now: datetime, devices=None) -> tuple[dict[base.BaseClient, list], int, int]:
+        """Actions of active rules of all or given `devices`, returns tuple(actions, evaluated, matched)"""
+        actions: dict[base.BaseClient, list] = dict()
+        evaluated = matched = 0
+        for rule in self.config.schedule.active(now):
+            if rule.device not in self.devices or devices is not None and rule.device not in devices:
+                continue
+            evaluated, matched = evaluated + 1, matched + 1
+            client = self.devices[rule.device]
+            items = actions.setdefault(client, [])
+            override = rule.rule.get('override')
+            self.collect_actions(items, client, rule.name, rule.action, override)
+            evaluated += len(rule.sub_rules) + bool(rule.fallback)
+            for sub_name, sub_rule in rule.get_active_sub_rules(now.hour, now.minute):
+                matched += 1
+                self.collect_actions(items, client, sub_name, sub_rule['action'], override)
+        return actions, evaluated, matched
 
     @staticmethod
-    async def apply_actions(client, device, name, actions: dict):
+    def collect_actions(items: list, client: base.BaseClient, name, actions: dict, override: Optional[float] = None):
         for sub_topic, payload in actions.items():
-            log.debug('Applying %s %s %s %s', device, name, sub_topic, payload)
-            await client.publish(sub_topic, payload)
+            log.debug('Applying %s %s %s %s', client.device.name, name, sub_topic, payload)
+            items.append((sub_topic, payload))
+            if override:
+                client.rule_overrides[sub_topic] = override
+            else:
+                client.rule_overrides.pop(sub_topic, None)
 
 
 def main_cli():
+    parser = argparse.ArgumentParser(prog='mqtt-automator')
+    parser.add_argument('--config', default='config.yml')
+    parser.add_argument('--config-cache', help='path to compiled config cache, disabled by default, '
+                                               'it must be owned by the daemon user')
+    commands = parser.add_subparsers(dest='command')
+    bench = commands.add_parser('bench', help='run Automator against in-process fake broker and devices')
+    bench.add_argument('--devices', type=int, default=300)
+    bench.add_argument('--rules', type=int, default=4, help='rules per device')
+    bench.add_argument('--messages', type=int, default=10000, help='feedback messages to ingest')
+    bench.add_argument('--ticks', type=int, default=8)
+    simulate = commands.add_parser('simulate', help='print publish timeline of the config in virtual time')
+    simulate.add_argument('--start', help='ISO date or datetime, default is today 00:00')
+    simulate.add_argument('--days', type=float, default=7)
+    simulate.add_argument('--device', action='append', help='show only this device, may be repeated')
+    simulate.add_argument('--parents-offline', action='store_true', help='`icmp` payloads resolve to off')
+    journal = commands.add_parser('journal', help='print or replay entries of app.journal_file')
+    journal.add_argument('journal', nargs='?', help='journal path, default is app.journal_file of the config '
+                                                    'and journals of its shards')
+    journal.add_argument('--device', action='append', help='show only this device, may be repeated')
+    journal.add_argument('--since', help='ISO datetime')
+    journal.add_argument('--until', help='ISO datetime')
+    journal.add_argument('--kind', action='append', choices=sorted(KIND_IDS), help='may be repeated')
+    journal.add_argument('--replay', choices=('simulate', 'bench'),
+                         help='simulate - show rules behind journaled publishes, bench - feed received messages '
+                              'to Automator as fast as possible')
+    profile = commands.add_parser('profile-imports', help='print import times of startup with the config')
+    profile.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'profile-imports':
+        from mqtt_automator.bench.imports import main  # pylint: disable=import-outside-toplevel
+        main(args)
+        return
+    if args.command == 'bench':
+        from mqtt_automator.bench.runner import main  # pylint: disable=import-outside-toplevel
+        main(args)
+        return
+    cache = args.config_cache or None
+    if args.command == 'journal':
+        from mqtt_automator.journal import main  # pylint: disable=import-outside-toplevel
+        config = ConfigParser(args.config, cache=cache)
+        if args.journal:
+            args.journal = [args.journal]
+        elif config.settings.journal_file:
+            args.journal = shard_paths(config.settings.journal_file)
+        else:
+            parser.error('journal path is required when app.journal_file is not set')
+        main(args, config, Automator.client_map)
+        return
+    if args.command == 'simulate':
+        from mqtt_automator.simulator import main  # pylint: disable=import-outside-toplevel
+        main(args, Automator.client_map)
+        return
+
     try:
-        asyncio.run(Automator().run())
+        config = ConfigParser(args.config, cache=cache)
+        if config.settings.shards > 1:
+            from mqtt_automator.supervisor import Supervisor  # pylint: disable=import-outside-toplevel
+            run_loop(Supervisor(config).run(), config.settings.event_loop)
+        else:
+            run_loop(Automator(config).run(), config.settings.event_loop)
     except KeyboardInterrupt:
         log.info('Finished')
 
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from mqtt_automator.topics import TopicTrie
+
+log = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = (
+    1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 14
+)
+
+
+def encode_length(length: int) -> bytes:
+    """
+    >>> encode_length(321)
+    b'\\xc1\\x02'
+    """
+    encoded = bytearray()
+    while True:
+        length, byte = divmod(length, 128)
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: str) -> bytes:
+    value = value.encode()
+    return len(value).to_bytes(2, 'big') + value
+
+
+def packet(packet_type: int, body: bytes, flags: int = 0) -> bytes:
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+class Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.filters: set[str] = set()
+
+    def send(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class FakeBroker:
+    """
+    In-process MQTT 3.1.1 broker stand-in for benchmarks: QoS 0 (QoS 1 is acknowledged but not retried),
+    retained messages, `+` and `#` wildcards. Every publish of clients is recorded in `received`
+    with a monotonic timestamp and passed to `on_publish`, that's how fake devices react to commands.
+    """
+
+    def __init__(self, on_publish: Optional[Callable[[str, bytes], None]] = None):
+        self.on_publish = on_publish
+        self.retained: dict[str, bytes] = dict()
+        self.subscriptions = TopicTrie()
+        self.sessions: set[Session] = set()
+        self.received: list[tuple[float, str, bytes]] = []
+        self.subscribe_packets = 0
+        self.server: Optional[asyncio.Server] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for session in list(self.sessions):
+            session.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def publish(self, topic: str, payload: bytes | str, retain: bool = False):
+        """Publishes a message as if it came from a device"""
+        payload = payload.encode() if isinstance(payload, str) else payload
+        if retain:
+            self.retained[topic] = payload
+        data = packet(PUBLISH, encode_string(topic) + payload)
+        for session in set(self.subscriptions.match(topic)):
+            session.send(data)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                if not self.dispatch(session, header >> 4, header & 0x0f, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for topic_filter in session.filters:
+                self.subscriptions.remove(topic_filter, session)
+            self.sessions.discard(session)
+            writer.close()
+
+    def dispatch(self, session: Session, packet_type: int, flags: int, body: bytes) -> bool:
+        if packet_type == CONNECT:
+            session.send(packet(CONNACK, b'\x00\x00'))
+        elif packet_type == PUBLISH:
+            topic_length = int.from_bytes(body[:2], 'big')
+            topic, offset = body[2:2 + topic_length].decode(), 2 + topic_length
+            qos = (flags >> 1) & 3
+            if qos:
+                session.send(packet(PUBACK, body[offset:offset + 2]))
+                offset += 2
+            payload = body[offset:]
+            self.received.append((time.monotonic(), topic, payload))
+            if self.on_publish:
+                self.on_publish(topic, payload)
+            self.publish(topic, payload, retain=bool(flags & 1))
+        elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+            packet_id, offset, topic_filters = body[:2], 2, []
+            while offset < len(body):
+                topic_length = int.from_bytes(body[offset:offset + 2], 'big')
+                topic_filters.append(body[offset + 2:offset + 2 + topic_length].decode())
+                offset += 2 + topic_length + (packet_type == SUBSCRIBE)
+            if packet_type == SUBSCRIBE:
+                self.subscribe(session, packet_id, topic_filters)
+            else:
+                for topic_filter in topic_filters:
+                    session.filters.discard(topic_filter)
+                    self.subscriptions.remove(topic_filter, session)
+                session.send(packet(UNSUBACK, packet_id))
+        elif packet_type == PINGREQ:
+            session.send(packet(PINGRESP, b''))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def subscribe(self, session: Session, packet_id: bytes, topic_filters: list[str]):
+        self.subscribe_packets += 1
+        for topic_filter in topic_filters:
+            if topic_filter not in session.filters:
+                session.filters.add(topic_filter)
+                self.subscriptions.insert(topic_filter, session)
+        session.send(packet(SUBACK, packet_id + bytes(len(topic_filters))))
+        matcher = TopicTrie()
+        for topic_filter in topic_filters:
+            matcher.insert(topic_filter, topic_filter)
+        for topic, payload in self.retained.items():
+            if matcher.match(topic):
+                session.send(packet(PUBLISH, encode_string(topic) + payload, flags=1))
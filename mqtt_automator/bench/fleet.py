@@ -0,0 +1,116 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import yaml
+
+from mqtt_automator.bench.broker import FakeBroker
+
+VENDORS = ('vakio', 'lytko', 'yeelink')
+
+
+class Fleet:
+    """
+    Synthetic installation: `devices` devices round-robin across vendors, every device has `rules` rules
+    splitting the day into equal windows, every third Vakio device uses sub-rules in its first window.
+    Fake Vakio and Lytko devices live in FakeBroker and react to commands like the real ones.
+    """
+
+    def __init__(self, devices: int, rules: int):
+        self.devices = [(VENDORS[i % len(VENDORS)], f'{VENDORS[i % len(VENDORS)]}{i}') for i in range(devices)]
+        self.rules = rules
+        self.thermostats: dict[str, dict] = dict()
+
+    def windows(self):
+        step = 24 * 60 // self.rules
+        for k in range(self.rules):
+            end = 24 * 60 - 1 if k == self.rules - 1 else (k + 1) * step - 1
+            yield k, f'{k * step // 60:02}:{k * step % 60:02}-{end // 60:02}:{end % 60:02}'
+
+    def device_rules(self, vendor: str, index: int) -> dict:
+        rules = dict()
+        for k, window in self.windows():
+            if vendor == 'vakio' and k == 0 and index % 3 == 0:
+                rules[f'rule{k}'] = {'time': window, 'sub_rules': {
+                    'fast': {'minutes': '0-30', 'action': {'speed': 7}},
+                    'fallback': {'action': {'speed': 2}},
+                }}
+            elif vendor == 'vakio':
+                rules[f'rule{k}'] = {'time': window, 'action': {'state': 'on', 'speed': k % 7 + 1}}
+            elif vendor == 'lytko':
+                rules[f'rule{k}'] = {'time': window, 'action': {'mode': 'on', 'temperature': 18 + k % 5}}
+            else:
+                rules[f'rule{k}'] = {'time': window, 'action': {'set_power': k % 2 == 0}}
+        return rules
+
+    def config(self, broker_port: int) -> dict:
+        config = {
+            'app': {'log_level': 'WARNING', 'startup_timeout': 30, 'publish_interval': {'vakio': 0}},
+            'broker': {'ip': '127.0.0.1', 'port': broker_port, 'protocol': 4},
+        }
+        for index, (vendor, name) in enumerate(self.devices):
+            device = {'device': '127.0.0.1'} if vendor == 'yeelink' else dict()
+            config.setdefault(vendor, dict())[name] = device | self.device_rules(vendor, index)
+        return config
+
+    def write_config(self, directory: str, broker_port: int) -> str:
+        path = Path(directory) / 'config.yml'
+        path.write_text(yaml.dump(self.config(broker_port), sort_keys=False), 'utf-8')
+        return str(path)
+
+    def attach(self, broker: FakeBroker):
+        """Publishes retained state of every MQTT device and makes them react to commands"""
+        broker.on_publish = lambda topic, payload: self.on_command(broker, topic, payload)
+        for vendor, name in self.devices:
+            if vendor == 'vakio':
+                for sub_topic, value in (('state', 'off'), ('workmode', 'inflow'), ('speed', '1')):
+                    broker.publish(f'{name}/{sub_topic}', value, retain=True)
+            elif vendor == 'lytko':
+                self.thermostats[name] = {'heating': 'off', 'target_temp': 20.0}
+                broker.publish(f'climate/lytko/{name}/state', json.dumps(self.thermostats[name]), retain=True)
+
+    def on_command(self, broker: FakeBroker, topic: str, payload: bytes):
+        levels = topic.split('/')
+        if len(levels) != 5 or levels[:2] != ['climate', 'lytko'] or levels[-1] != 'set':
+            return
+        thermostat = self.thermostats.get(levels[2])
+        if thermostat is None:
+            return
+        if levels[3] == 'mode':
+            thermostat['heating'] = 'off' if payload == b'off' else 'heat'
+        elif levels[3] == 'temperature':
+            thermostat['target_temp'] = float(payload)
+        broker.publish(f'climate/lytko/{levels[2]}/state', json.dumps(thermostat), retain=True)
+
+
+class FakeLamps:
+    """Yeelink TCP endpoint on localhost accepting JSON commands, records arrival time of every command"""
+
+    def __init__(self):
+        self.received: list[tuple[float, str]] = []
+        self.server = None
+        self.connections: dict[asyncio.Task, asyncio.StreamWriter] = dict()
+
+    async def start(self, host: str = '127.0.0.1') -> int:
+        self.server = await asyncio.start_server(self.handle, host, 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Connections are persistent, clients send many commands over one of them"""
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while line := await reader.readline():
+                command = json.loads(line)
+                self.received.append((time.monotonic(), command['method']))
+                writer.write(json.dumps({'id': command['id'], 'result': ['ok']}).encode() + b'\r\n')
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+STARTUP = '''
+import time
+started_at = time.perf_counter()
+from mqtt_automator.automator import Automator
+Automator({config!r}, cache={cache!r})
+print(time.perf_counter() - started_at)
+print(*sorted(Automator.client_map.loaded))
+'''
+
+
+class Startup(NamedTuple):
+    duration: float
+    vendors: list[str]  # imported lazily by ClientRegistry, importlib.import_module is not seen by -X importtime
+    imports: list['ImportTime']
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(lines: Iterable[str]) -> list[ImportTime]:
+    """
+    Parses stderr of `python -X importtime`
+    >>> parse_importtime(['import time: self [us] | cumulative | imported package',
+    ...                   'import time:       311 |      48285 |   asyncio'])
+    [ImportTime(module='asyncio', self_us=311, cumulative_us=48285, depth=1)]
+    """
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.lstrip()
+        imports.append(ImportTime(module, int(self_us), int(cumulative_us), (len(name) - len(module) - 1) // 2))
+    return imports
+
+
+def profile_startup(config: str, cache: str | None = None) -> Startup:
+    """Fresh interpreter creating Automator from config, nothing is connected or scheduled"""
+    root = str(Path(__file__).parents[2])
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP.format(config=config, cache=cache)],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))},
+    )
+    duration, vendors = result.stdout.splitlines()[-2:]
+    return Startup(float(duration), vendors.split(), parse_importtime(result.stderr.splitlines()))
+
+
+def main(args):
+    startup = profile_startup(args.config, args.config_cache or None)
+    total = sum(item.self_us for item in startup.imports)
+    print(f'Automator created in {startup.duration * 1000:.1f} ms, '
+          f'{len(startup.imports)} modules imported in {total / 1000:.1f} ms')
+    print('Vendor clients loaded:', ', '.join(startup.vendors))
+    print('Slowest imports (top-level and mqtt_automator modules):')
+    shown = [item for item in startup.imports if item.depth <= 1 or item.module.startswith('mqtt_automator')]
+    for item in sorted(shown, key=lambda item: -item.cumulative_us)[:args.top]:
+        print(f'  {item.cumulative_us / 1000:8.1f} ms  {item.module}')
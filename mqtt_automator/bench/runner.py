@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import resource
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Union
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.bench.broker import FakeBroker
+from mqtt_automator.bench.fleet import Fleet, FakeLamps
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.devices.yeelink import YeelinkClient
+from mqtt_automator.journal import Entry
+
+log = logging.getLogger(__name__)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """
+    >>> percentiles([0.001 * i for i in range(1, 101)])
+    {'p50': 50.5, 'p90': 90.1, 'p99': 99.01, 'max': 100.0}
+    """
+    if len(values) < 2:
+        return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': round(cuts[49] * 1000, 3),
+        'p90': round(cuts[89] * 1000, 3),
+        'p99': round(cuts[98] * 1000, 3),
+        'max': round(max(values) * 1000, 3),
+    }
+
+
+async def wait_for(condition, timeout: float = 30):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+async def run_benchmark(devices: int = 300, rules: int = 4, messages: int = 10000, ticks: int = 8) -> dict:
+    """
+    Runs Automator against FakeBroker and FakeLamps, returns a report, durations are in milliseconds.
+    RSS includes fake broker and devices, they share the process.
+    """
+    fleet, broker, lamps = Fleet(devices, rules), FakeBroker(), FakeLamps()
+    broker_port, lamps_port = await broker.start(), await lamps.start()
+    fleet.attach(broker)
+    report = {'devices': devices, 'rules': devices * rules}
+
+    with tempfile.TemporaryDirectory() as directory:
+        started_at = time.perf_counter()
+        automator = Automator(fleet.write_config(directory, broker_port))
+        for client in automator.devices.values():
+            if client.device.vendor == 'yeelink':
+                client.port = lamps_port
+        feedback = asyncio.create_task(automator.feedback())
+        await automator.readiness.wait(timeout=30)
+        report['startup_ms'] = round((time.perf_counter() - started_at) * 1000, 3)
+
+    tick_durations, latencies = [], []
+    monday = datetime(2024, 5, 13)
+    for i in range(ticks):
+        received_before, lamps_before = len(broker.received), len(lamps.received)
+        started_at = time.perf_counter()
+        tick_started_at = time.monotonic()
+        await automator.tick(monday + timedelta(minutes=i * 24 * 60 // ticks))
+        tick_durations.append(time.perf_counter() - started_at)
+        await automator.dispatcher.join()
+        arrivals = broker.received[received_before:] + lamps.received[lamps_before:]
+        latencies.extend(arrived_at - tick_started_at for arrived_at, *_ in arrivals)
+    report['tick_ms'] = percentiles(tick_durations)
+    report['publishes'] = len(latencies)
+    report['publish_latency_ms'] = percentiles(latencies)
+
+    vakio = [name for vendor, name in fleet.devices if vendor == 'vakio']
+    if vakio and messages:
+        sentinel = automator.devices[vakio[-1]]
+        started_at = time.perf_counter()
+        for i in range(messages):
+            broker.publish(f'{vakio[i % len(vakio)]}/speed', str(i % 7 + 1))
+        broker.publish(f'{vakio[-1]}/workmode', 'sentinel')
+        await wait_for(lambda: sentinel.state.get('workmode') == 'sentinel')
+        report['feedback_msg_per_s'] = round(messages / (time.perf_counter() - started_at))
+
+    report['rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    feedback.cancel()
+    await asyncio.gather(feedback, return_exceptions=True)
+    for worker in automator.dispatcher.workers.values():
+        worker.cancel()
+    for client in automator.devices.values():
+        if isinstance(client, YeelinkClient):
+            client.transport.close_all()
+        client.close()
+    await broker.stop()
+    await lamps.stop()
+    return report
+
+
+def main(args):
+    report = asyncio.run(run_benchmark(args.devices, args.rules, args.messages, args.ticks))
+    for key, value in report.items():
+        print(f'{key}: {value}')
+
+
+def replay(config: Union[str, ConfigParser], entries: Iterable[Entry]) -> dict:
+    """Feeds messages received in a journal to Automator.handle as fast as it can, durations are in milliseconds"""
+    messages = [(entry.key, bytes(entry.value)) for entry in entries if entry.kind == 'received']
+    automator = Automator(config)
+    if automator.journal:  # replayed messages must not be journaled again
+        automator.journal.close()
+        automator.journal = None
+        for client in automator.devices.values():
+            client.journal = None
+    started_at = time.perf_counter()
+    for topic, payload in messages:
+        automator.handle(topic, payload)
+    duration = time.perf_counter() - started_at
+    report = {
+        'messages': len(messages),
+        'duration_ms': round(duration * 1000, 3),
+        'msg_per_s': round(len(messages) / duration) if duration else 0,
+        'devices_with_state': sum(1 for client in automator.devices.values() if client.state),
+    }
+    for client in automator.devices.values():
+        client.close()
+    return report
@@ -1,10 +1,152 @@
-from aiomqtt import ProtocolVersion, Client
-from pydantic import BaseModel
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Literal, Optional
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from mqtt_automator import metrics
+
+if TYPE_CHECKING:
+    from aiomqtt import Client, Message
+
+log = logging.getLogger(__name__)
+
+
+class Connection:
+    """
+    Long-lived connection to a broker shared by Automator.feedback and all device clients.
+    Reconnects with exponential backoff, subscriptions are restored and publishes are queued while it's down.
+    """
+    min_backoff = 1
+    max_backoff = 60
+    max_queued = 1000
+    subscribe_batch = 256  # topic filters per SUBSCRIBE packet
+    pending_calls_threshold = 100  # aiomqtt warns above it, Dispatcher keeps up to app.concurrency publishes in flight
+
+    def __init__(self, broker: 'Broker'):
+        self.broker = broker
+        self.client: Optional['Client'] = None
+        self.connected = asyncio.Event()
+        self.subscriptions: set[str] = set()
+        self.queue: deque[tuple[str, object]] = deque(maxlen=self.max_queued)
+        self.reconnects = 0
+        self.published = 0
+        self.publish_latency_total = 0.0
+        self.publish_latency_max = 0.0
+
+    @property
+    def publish_latency_avg(self) -> float:
+        return self.publish_latency_total / self.published if self.published else 0.0
+
+    async def run(self, handler: Callable[['Message'], None]):
+        """Eternal task, `handler` is called for every received message"""
+        from aiomqtt import MqttError  # pylint: disable=import-outside-toplevel
+        backoff = self.min_backoff
+        while True:
+            try:
+                client = self.broker.get_client()
+                client.pending_calls_threshold = self.pending_calls_threshold
+                async with client:
+                    log.info('Connected to %s', self.broker.ip)
+                    self.client, backoff = client, self.min_backoff
+                    await self.subscribe(self.subscriptions)
+                    self.connected.set()
+                    await self.flush()
+                    try:
+                        async for message in client.messages:
+                            handler(message)
+                    except asyncio.CancelledError:
+                        await self.release()
+                        raise
+            except MqttError as err:
+                log.warning('Connection to %s failed: %s, reconnecting in %d seconds', self.broker.ip, err, backoff)
+            finally:
+                self.client = None
+                self.connected.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.reconnects += 1
+            metrics.mqtt_reconnects.labels(self.broker.name).inc()
+
+    async def subscribe(self, topic_filters):
+        """Remembers filters to restore them after reconnect, subscribes in as few SUBSCRIBE packets as possible"""
+        topic_filters = sorted(set(topic_filters))
+        self.subscriptions.update(topic_filters)
+        if self.client is None or not topic_filters:
+            return
+        for i in range(0, len(topic_filters), self.subscribe_batch):
+            batch = topic_filters[i:i + self.subscribe_batch]
+            log.info('Subscribing to %d topic filters on %s', len(batch), self.broker.ip)
+            await self.client.subscribe([(topic_filter, 0) for topic_filter in batch])  # noqa
+
+    async def unsubscribe(self, topic_filters):
+        topic_filters = sorted(set(topic_filters))
+        self.subscriptions.difference_update(topic_filters)
+        if self.client is None or not topic_filters:
+            return
+        log.info('Unsubscribing from %d topic filters on %s', len(topic_filters), self.broker.ip)
+        await self.client.unsubscribe(topic_filters)  # noqa
+
+    async def release(self):
+        """Unsubscribes on shutdown, filters are kept in `subscriptions`"""
+        from aiomqtt import MqttError  # pylint: disable=import-outside-toplevel
+        topic_filters = sorted(self.subscriptions)
+        log.info('Received cancel, unsubscribing from %d topic filters on %s', len(topic_filters), self.broker.ip)
+        try:
+            for i in range(0, len(topic_filters), self.subscribe_batch):
+                await self.client.unsubscribe(topic_filters[i:i + self.subscribe_batch])  # noqa
+        except MqttError as err:
+            log.warning('Failed to unsubscribe from %s: %s', self.broker.ip, err)
+
+    async def flush(self):
+        """Sends queued messages in order, stops at the first failure, the next reconnect flushes again"""
+        while self.queue and self.client:
+            topic, payload = self.queue.popleft()
+            if not await self.send(topic, payload):
+                self.queue.appendleft((topic, payload))
+                return
+
+    async def publish(self, topic: str, payload) -> bool:
+        """Returns False if the message is only queued until reconnect"""
+        if self.client is not None and await self.send(topic, payload):
+            return True
+        if len(self.queue) == self.queue.maxlen:
+            log.warning('Publish queue of %s is full, dropping %s', self.broker.ip, self.queue[0])
+        self.queue.append((topic, payload))
+        return False
+
+    async def send(self, topic: str, payload) -> bool:
+        from aiomqtt import MqttError  # pylint: disable=import-outside-toplevel
+
+        started_at = time.monotonic()
+        try:
+            await self.client.publish(topic=topic, payload=payload)  # noqa
+        except MqttError as err:
+            log.warning('Failed to publish %s to %s: %s, queued until reconnect', topic, self.broker.ip, err)
+            return False
+        latency = time.monotonic() - started_at
+        self.published += 1
+        self.publish_latency_total += latency
+        self.publish_latency_max = max(self.publish_latency_max, latency)
+        return True
 
 
 class Broker(BaseModel):
+    name: str = Field(default='default')
     ip: str
-    protocol: ProtocolVersion
+    protocol: Literal[3, 4, 5]  # aiomqtt.ProtocolVersion, aiomqtt is imported on connect only
+    port: int = Field(default=1883)
+    vendors: list[str] = Field(default_factory=list)  # devices of these vendors use the broker by default
+    _connection: Optional[Connection] = PrivateAttr(default=None)
+
+    def get_client(self) -> 'Client':
+        from aiomqtt import Client, ProtocolVersion  # pylint: disable=import-outside-toplevel
+        return Client(self.ip, self.port, protocol=ProtocolVersion(self.protocol))
 
-    def get_client(self):
-        return Client(self.ip, protocol=self.protocol)
+    @property
+    def connection(self) -> Connection:
+        if self._connection is None:
+            self._connection = Connection(self)
+        return self._connection
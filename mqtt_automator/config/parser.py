@@ -1,20 +1,54 @@
+import hashlib
 import logging
+import os
+import pickle
+import zlib
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Self
+from typing import Literal, Optional, Self
 
 from pydantic import BaseModel, Field, model_validator, ValidationError
 import yaml
 
-from mqtt_automator.config.time_parser import match_time_range, match_range
+from mqtt_automator.config.schedule import CompiledRule, CompiledSubRule, Schedule, weekly_windows
+from mqtt_automator.config.time_parser import parse_range
 from mqtt_automator.broker import Broker
 from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.overrides import DEFAULT_DURATION
 
 log = logging.getLogger(__name__)
 
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)  # libyaml is much faster, but optional
+
 
 class Settings(BaseModel):
     log_level: str = Field(default='INFO')
+    scheduler: Literal['poll', 'event'] = Field(default='poll')
+    startup_timeout: float = Field(default=15, ge=0)
+    scheduler_resync: int = Field(default=900, gt=0)
+    concurrency: int = Field(default=32, gt=0)
+    publish_timeout: float = Field(default=5, gt=0)
+    publish_interval: dict[str, float] = Field(default_factory=dict)
+    state_file: Optional[str] = Field(default=None)
+    state_flush_interval: float = Field(default=5, gt=0)
+    config_watch_interval: float = Field(default=5, ge=0)
+    metrics_port: Optional[int] = Field(default=None)
+    metrics_host: str = Field(default='127.0.0.1')
+    api_port: Optional[int] = Field(default=None)
+    api_host: str = Field(default='127.0.0.1')
+    availability_timeout: Optional[float] = Field(default=None, gt=0)
+    shards: int = Field(default=1, ge=1)
+    shard_by: Literal['hash', 'vendor'] = Field(default='hash')
+    shard_report_interval: float = Field(default=5, gt=0)
+    override_duration: float = Field(default=DEFAULT_DURATION, gt=0)
+    override_durations: dict[str, float] = Field(default_factory=dict)
+    journal_file: Optional[str] = Field(default=None)
+    journal_max_size: int = Field(default=64 * 1024 * 1024, gt=0)
+    journal_keep: int = Field(default=5, ge=1)
+    journal_flush_interval: float = Field(default=1, gt=0)
+    event_loop: Literal['asyncio', 'uvloop'] = Field(default='asyncio')
+    watchdog_threshold: float = Field(default=0, ge=0)
+    watchdog_interval: float = Field(default=0.5, gt=0)
 
 
 class Rule(BaseModel):
@@ -25,12 +59,14 @@ class Rule(BaseModel):
     - time - time range when rule will be active independently of the day of the week
     - action - dictionary of topic=payload that will be passed to the device when rule is active (optional)
     - sub_rules - alternative to action if device should repeatedly change workmode.
+    - override - seconds manual changes of sub-topics set by this rule win over the schedule (optional)
     """
     workday: Optional[str] = Field(pattern=r'\d{2}:\d{2}-\d{2}:\d{2}', default=None)
     weekend: Optional[str] = Field(pattern=r'\d{2}:\d{2}-\d{2}:\d{2}', default=None)
     time: Optional[str] = Field(pattern=r'\d{2}:\d{2}-\d{2}:\d{2}', default=None)
     action: Optional[dict] = Field(default=None)
     sub_rules: Optional[dict] = Field(default=None)
+    override: Optional[float] = Field(default=None, gt=0)
 
     @model_validator(mode='after')
     def at_least_one_time_defined(self) -> Self:
@@ -65,25 +101,165 @@ class SubRule(BaseModel):
     action: dict
 
 
+def compile_sub_rules(sub_rules: dict) -> tuple[tuple[CompiledSubRule, ...], Optional[CompiledSubRule]]:
+    compiled, fallback = [], None
+    for name, rule_ in sub_rules.items():
+        try:
+            rule = SubRule(**rule_)
+        except ValidationError:
+            log.info("Bad rule %s", rule_, exc_info=True)
+            continue
+
+        if name == 'fallback':
+            fallback = CompiledSubRule(name, None, None, rule_)
+            continue
+        compiled.append(CompiledSubRule(
+            name=name,
+            hours=parse_range(rule.hours) if rule.hours else None,
+            minutes=parse_range(rule.minutes) if rule.minutes else None,
+            rule=rule.model_dump(exclude_unset=True),
+        ))
+    return tuple(compiled), fallback
+
+
 class ConfigParser:
-    system_keys = {'app', 'broker'}
+    system_keys = {'app', 'broker', 'brokers'}
+    device_keys = {'device', 'parent', 'availability', 'broker'}
 
-    def __init__(self, file_name: str = 'config.yml'):
+    cache_version = 6  # bump when compiled structures change
+    cached_attributes = ('config', 'brokers', 'broker', 'vendor_brokers', 'settings', 'devices', 'compiled', 'schedule')
+
+    def __init__(self, file_name: str = 'config.yml', previous: Optional['ConfigParser'] = None,
+                 shard: Optional[int] = None, cache: Optional[str] = None):
         """
+        `previous` is a running config, rules of devices that are not changed since it was loaded are not recompiled.
+        `shard` limits devices and rules to the ones handled by this shard, see owns().
+        `cache` is an optional path to pickle with compiled config, it's used instead of parsing and validation
+        while hash of config.yml is the same. Unpickling runs code, so the cache is loaded only when it's owned
+        by the user of the process and isn't writable by group or others.
+
         config.yml should have a root-members:
         broker:
             ip: IPv4 of MQTT-broker
             protocol: version of MQTT proto used by broker (default 5)
+            port: TCP port of MQTT-broker (default 1883)
+        brokers: optional named brokers with the same members, broker above is named `default`
+            building2: {ip: 192.168.2.2, protocol: 5, vendors: [vakio]}
+            Devices use broker given by `broker: name`, otherwise the one listing their vendor, otherwise the first one.
         app:
             log_level: DEBUG (default INFO)
+            startup_timeout: max seconds to wait for retained state of all devices before scheduling (default 15)
+            scheduler: poll (default) - evaluate rules every minute,
+                event - sleep until the next rule or sub-rule transition
+            scheduler_resync: in event mode rules are evaluated at least every N seconds (default 900)
+            concurrency: max number of publishes in flight across all devices (default 32)
+            publish_timeout: deadline of a single publish in seconds (default 5)
+            publish_interval: per-vendor minimal seconds between writes to a device, example: {vakio: 1}
+            state_file: path to SQLite database to keep state and manual-override blocks between restarts
+            state_flush_interval: seconds between batched writes of state changes to state_file (default 5)
+            config_watch_interval: seconds between checks of config.yml modification time, 0 disables (default 5)
+            metrics_port: serve Prometheus metrics on http://metrics_host:metrics_port/metrics (disabled by default)
+            metrics_host: address to listen for metrics requests (default 127.0.0.1), 0.0.0.0 for Prometheus elsewhere
+            api_port: serve HTTP control API on http://api_host:api_port, see ControlApi (disabled by default),
+                it isn't served when shards > 1
+            api_host: address to listen for API requests (default 127.0.0.1), it may be the same as metrics one
+            availability_timeout: devices silent for N seconds are offline until the next feedback (disabled by default)
+            shards: number of worker processes, each with own broker connection and scheduler (default 1)
+            shard_by: hash (default) - crc32 of device name, vendor - all devices of a vendor are in the same shard
+            shard_report_interval: seconds between metrics and state reports of shards to supervisor (default 5)
+            override_duration: seconds manual changes on a device win over the schedule (default 14400)
+            override_durations: per-vendor override_duration, example: {yeelink: 3600}
+            journal_file: path to binary journal of received messages, publishes and state changes, see Journal
+            journal_max_size: bytes of journal_file before it's rotated (default 64 MiB)
+            journal_keep: number of rotated journal files to keep (default 5)
+            journal_flush_interval: seconds between batched writes of the journal (default 1)
+            event_loop: asyncio (default) or uvloop, it's used only if installed
+            watchdog_threshold: log stack when event loop is blocked longer, and handlers slower, than N seconds,
+                example 0.1, disabled by default: its thread wakes up every threshold/4 seconds, see Watchdog
+            watchdog_interval: seconds between event loop lag measurements (default 0.5)
+
+        Devices may have `availability: topic` with online/offline payloads (LWT), writes to offline devices are skipped
+        with exponential backoff and the desired state is sent again when device is back online.
+        Rules may have `override: seconds`, it's used instead of override_duration for sub-topics set by the rule.
         """
-        self.config = yaml.load(Path(file_name).read_text('utf-8'), yaml.SafeLoader)
-        self.broker = Broker(**self.config['broker'])
+        self.file_name = file_name
+        self.shard = shard
+        self.cache = cache
+        self.mtime = Path(file_name).stat().st_mtime
+        content = Path(file_name).read_bytes()
+        key = self.cache_key(content)
+        if cache and self.load_cache(cache, key):
+            return
+
+        self.config = yaml.load(content, YAML_LOADER)
+        self.brokers = self.load_brokers()
+        self.broker = next(iter(self.brokers.values()))
+        self.vendor_brokers = {vendor: broker for broker in self.brokers.values() for vendor in broker.vendors}
         self.settings = Settings(**(self.config.get('app') or {}))
+        self.devices: list[Device] = list(self.parse_devices())
+        self.compiled: dict[str, tuple[dict, list]] = dict()
+        self.schedule = Schedule(list(self.compile_rules(previous)))
+        log.debug('Compiled %d rules into %d segments', len(self.schedule), len(self.schedule.starts))
+        for device in self.devices:
+            if device.broker and device.broker not in self.brokers:
+                raise ValueError(f'Unknown broker {device.broker} of device {device.name}')
+        if cache:
+            self.save_cache(cache, key)
+
+    def cache_key(self, content: bytes) -> str:
+        return hashlib.sha256(content + f'\0{self.cache_version}\0{self.shard}'.encode()).hexdigest()
+
+    def load_cache(self, path: str, key: str) -> bool:
+        try:
+            with open(path, 'rb') as cache:
+                stat = os.fstat(cache.fileno())
+                if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                    log.warning('Ignoring config cache %s, it must be owned by uid %d and not writable by others',
+                                path, os.getuid())
+                    return False
+                cached = pickle.load(cache)
+        except FileNotFoundError:
+            return False
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.warning('Failed to load config cache %s', path, exc_info=True)
+            return False
+        if cached.get('key') != key:
+            return False
+        self.__dict__.update(cached['attributes'])
+        log.debug('Loaded compiled %s from %s', self.file_name, path)
+        return True
+
+    def save_cache(self, path: str, key: str):
+        attributes = {name: getattr(self, name) for name in self.cached_attributes}
+        try:
+            with open(os.open(f'{path}.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as cache:
+                pickle.dump({'key': key, 'attributes': attributes}, cache, pickle.HIGHEST_PROTOCOL)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            log.warning('Failed to save config cache %s: %s', path, e)
+
+    def load_brokers(self) -> dict[str, Broker]:
+        brokers = {'default': Broker(**self.config['broker'])} if 'broker' in self.config else dict()
+        for name, broker in (self.config.get('brokers') or dict()).items():
+            if name in brokers:
+                raise ValueError(f'Broker {name} is defined twice')
+            brokers[name] = Broker(name=name, **broker)
+        if not brokers:
+            raise ValueError('broker or brokers section is required')
+        return brokers
+
+    def broker_for(self, device: Device) -> Broker:
+        if device.broker:
+            return self.brokers[device.broker]
+        return self.vendor_brokers.get(device.vendor, self.broker)
 
     def get_devices(self):
+        """Devices are validated once at load time, see parse_devices()"""
+        yield from self.devices
+
+    def parse_devices(self):
         """
-        Generator that yields: tuple(vendor: str, device_name: str, device_id: str)
+        Generator that yields: Device(vendor: str, name: str, id: str, ...)
 
         vendors are living in the root of config to prevent highly nested structure
 
@@ -105,15 +281,17 @@ class ConfigParser:
             if vendor in self.system_keys:
                 continue
             for device_name, device in devices.items():
-                if device_name == 'common':
+                if device_name == 'common' or not self.owns(vendor, device_name):
                     continue
-                device_id = device.pop('device', device_name)
+                device_id = device.get('device', device_name)
                 yield Device(vendor=vendor, name=device_name, id=device_id, **device)
 
-    def get_active_rules(self):
-        """For rule structure see class Rule"""
-        now = datetime.now()
-        is_workday, now_time = now.isoweekday() <= 5, now.time()
+    def compile_rules(self, previous: Optional['ConfigParser'] = None):
+        """
+        Validates rules and merges `common` once at load time.
+        Yields tuple(rule: CompiledRule, windows: tuple of [start, end) minutes of the week) in the config order.
+        """
+        reused = 0
         for vendor, devices in self.config.items():
             if vendor in self.system_keys:
                 continue
@@ -121,44 +299,88 @@ class ConfigParser:
             common = devices['common'] if 'common' in devices else dict()
 
             for device, rules in devices.items():
-                if device == 'common':
+                if device == 'common' or not self.owns(vendor, device):
                     continue
 
-                log.debug('Looking for device %s', device)
-                for name, rule_ in (rules | common).items():
-                    if name in ('device', 'parent'):
-                        continue
-                    if not isinstance(rule_, dict):
-                        log.error("Bad rule %s %s %s", device, name, rule_)
-                    rule = Rule(**rule_)
-                    schedule = (rule.workday if is_workday else rule.weekend) or rule.time
-                    log.debug('Checking rule %s schedule %s', name, schedule)
-                    if schedule and match_time_range(schedule, now_time):
-                        log.debug('rule %s schedule %s matched! yielding %s', name, schedule, rule)
-                        yield device, name, rule.model_dump(exclude_unset=True)
+                merged = rules | common
+                cached = previous.compiled.get(device) if previous else None
+                if cached and cached[0] == merged:
+                    compiled, reused = cached[1], reused + 1
+                else:
+                    compiled = list(self.compile_device_rules(device, merged))
+                self.compiled[device] = merged, compiled
+                yield from compiled
+        if previous:
+            log.info('Recompiled rules of %d devices, reused %d', len(self.compiled) - reused, reused)
 
-    @staticmethod
-    def get_active_sub_rules(sub_rules: dict):
-        """For sub-rule structure see class SubRule"""
-        found, has_fallback = False, False
-        now = datetime.now().time()
-
-        for name, rule_ in sub_rules.items():
-            try:
-                rule = SubRule(**rule_)
-            except ValidationError:
-                log.info("Bad rule %s", rule_, exc_info=True)
+    def owns(self, vendor: str, device: str) -> bool:
+        """Shard of a device is stable across restarts and reloads: it depends on its name or vendor only"""
+        if self.shard is None or self.settings.shards == 1:
+            return True
+        key = device if self.settings.shard_by == 'hash' else vendor
+        return zlib.crc32(key.encode()) % self.settings.shards == self.shard
+
+    def compile_device_rules(self, device: str, rules: dict):
+        for name, rule_ in rules.items():
+            if name in self.device_keys:
                 continue
+            if not isinstance(rule_, dict):
+                log.error("Bad rule %s %s %s", device, name, rule_)
+                continue
+            rule = Rule(**rule_)
+            sub_rules, fallback = compile_sub_rules(rule.sub_rules or dict())
+            compiled = CompiledRule(
+                device=device,
+                name=name,
+                rule=rule.model_dump(exclude_unset=True),
+                action=rule.action or dict(),
+                sub_rules=sub_rules,
+                fallback=fallback,
+            )
+            yield compiled, weekly_windows(rule.workday, rule.weekend, rule.time)
+
+    def current_mtime(self) -> Optional[float]:
+        try:
+            return Path(self.file_name).stat().st_mtime
+        except OSError:
+            return None
+
+    def is_modified(self) -> bool:
+        return (mtime := self.current_mtime()) is not None and mtime != self.mtime
+
+    @staticmethod
+    def identity(device: Device) -> tuple:
+        """Fields defining MQTT topics and broker of the device"""
+        return device.vendor, device.id, device.availability, device.broker
+
+    def diff_devices(self, previous: 'ConfigParser') -> tuple[list[Device], list[Device], list[Device]]:
+        """
+        Returns tuple(added, removed, changed) devices compared to the `previous` config.
+        Changed devices keep MQTT identity (vendor, id, availability topic and broker),
+        other fields like parent are changed, devices with changed identity are reported as removed and added.
+        """
+        old = {device.name: device for device in previous.get_devices()}
+        new = {device.name: device for device in self.get_devices()}
+        added, removed, changed = [], [], []
+        for name, device in new.items():
+            if name not in old:
+                added.append(device)
+            elif self.identity(old[name]) != self.identity(device):
+                removed.append(old[name])
+                added.append(device)
+            elif old[name] != device:
+                changed.append(device)
+        removed.extend(device for name, device in old.items() if name not in new)
+        return added, removed, changed
 
-            if name == 'fallback':
-                has_fallback = True
-            elif rule.hours and not match_range(rule.hours, now.hour):
-                pass
-            elif rule.minutes and not match_range(rule.minutes, now.minute):
-                pass
-            else:
-                found = True
-                yield name, rule.model_dump(exclude_unset=True)
-
-        if not found and has_fallback:
-            yield 'fallback', sub_rules['fallback']
+    def get_active_rules(self, now: Optional[datetime] = None):
+        """For rule structure see class Rule"""
+        for rule in self.schedule.active(now or datetime.now()):
+            yield rule.device, rule.name, rule.rule
+
+    @staticmethod
+    def get_active_sub_rules(sub_rules: dict, now: Optional[datetime] = None):
+        """For sub-rule structure see class SubRule"""
+        now = now or datetime.now()
+        rule = CompiledRule('', '', dict(), dict(), *compile_sub_rules(sub_rules))
+        yield from rule.get_active_sub_rules(now.hour, now.minute)
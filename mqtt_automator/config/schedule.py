@@ -0,0 +1,165 @@
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+from mqtt_automator.config.time_parser import MINUTES_PER_DAY, time_range_minutes
+
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(now: datetime) -> int:
+    """
+    Monday 00:00 is 0, Sunday 23:59 is 10079
+    >>> minute_of_week(datetime(2024, 5, 17, 20, 0))
+    6960
+    """
+    return (now.isoweekday() - 1) * MINUTES_PER_DAY + now.hour * 60 + now.minute
+
+
+@lru_cache(maxsize=4096)
+def weekly_windows(workday: Optional[str], weekend: Optional[str], time: Optional[str]) -> tuple[tuple[int, int], ...]:
+    """
+    Half-open [start, end) intervals of minutes of the week when the rule is active.
+    Each day is matched independently, overnight ranges wrap inside the same day like match_time_range does.
+    Cached, many rules of large configs share the same time ranges.
+    >>> weekly_windows('09:00-18:00', None, None)[:2]
+    ((540, 1081), (1980, 2521))
+    >>> weekly_windows(None, None, '23:00-01:00')[:2]
+    ((0, 61), (1380, 1440))
+    """
+    windows = []
+    for day in range(7):
+        schedule = (workday if day < 5 else weekend) or time
+        if not schedule:
+            continue
+        offset = day * MINUTES_PER_DAY
+        windows.extend((offset + start, offset + end + 1) for start, end in time_range_minutes(schedule))
+    return tuple(windows)
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledSubRule:
+    name: str
+    hours: Optional[range]
+    minutes: Optional[range]
+    rule: dict
+
+    def match(self, hour: int, minute: int) -> bool:
+        return (not self.hours or hour in self.hours) and (not self.minutes or minute in self.minutes)
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRule:
+    """Validated rule with `common` already merged, `rule` is what ConfigParser.get_active_rules yields"""
+    device: str
+    name: str
+    rule: dict
+    action: dict
+    sub_rules: tuple[CompiledSubRule, ...] = ()
+    fallback: Optional[CompiledSubRule] = None
+    sub_rule_edges: tuple[int, ...] = field(init=False, default=(), compare=False)
+
+    def __post_init__(self):
+        """Minutes of the day when the set of active sub-rules changes, only hour/minute boundaries are checked"""
+        if not self.sub_rules:
+            return
+        boundaries = {0}
+        for sub_rule in self.sub_rules:
+            if sub_rule.minutes:
+                boundaries.update((sub_rule.minutes.start % 60, sub_rule.minutes.stop % 60))
+        candidates = sorted({hour * 60 + minute for hour in range(24) for minute in boundaries})
+        edges = tuple(
+            minute for minute in candidates
+            if self.selection((minute - 1) % MINUTES_PER_DAY) != self.selection(minute)
+        )
+        object.__setattr__(self, 'sub_rule_edges', edges)
+
+    def selection(self, minute_of_day: int) -> tuple[str, ...]:
+        return tuple(name for name, _ in self.get_active_sub_rules(*divmod(minute_of_day, 60)))
+
+    def next_sub_rule_edge(self, minute_of_day: int) -> Optional[int]:
+        """
+        First minute after `minute_of_day` when sub-rules selection changes, may belong to the next day (>= 1440)
+        """
+        if not self.sub_rule_edges:
+            return None
+        index = bisect_right(self.sub_rule_edges, minute_of_day)
+        if index < len(self.sub_rule_edges):
+            return self.sub_rule_edges[index]
+        return self.sub_rule_edges[0] + MINUTES_PER_DAY
+
+    def get_active_sub_rules(self, hour: int, minute: int):
+        """Same semantic as ConfigParser.get_active_sub_rules"""
+        found = False
+        for sub_rule in self.sub_rules:
+            if sub_rule.match(hour, minute):
+                found = True
+                yield sub_rule.name, sub_rule.rule
+        if not found and self.fallback:
+            yield self.fallback.name, self.fallback.rule
+
+
+class Schedule:
+    """
+    Interval table over the week: `starts[i]` is the first minute of the week of segment `i`,
+    `segments[i]` is the tuple of rules active during the whole segment, in the config order,
+    `indexes[i]` is the same as positions in `rules`, `with_sub_rules[i]` are active rules having sub-rules.
+    """
+
+    def __init__(self, rules: list[tuple[CompiledRule, tuple[tuple[int, int], ...]]]):
+        self.rules = [rule for rule, _ in rules]
+        events: dict[int, list[tuple[int, int]]] = dict()
+        for index, (_, windows) in enumerate(rules):
+            for start, end in windows:
+                events.setdefault(start, []).append((index, 1))
+                events.setdefault(end, []).append((index, -1))
+
+        self.starts: list[int] = [0]
+        self.segments: list[tuple[CompiledRule, ...]] = [()]
+        self.indexes: list[tuple[int, ...]] = [()]
+        self.with_sub_rules: list[tuple[CompiledRule, ...]] = [()]
+        active, previous = Counter(), ()
+        for minute in sorted(events):
+            if minute >= MINUTES_PER_WEEK:
+                break
+            for index, delta in events[minute]:
+                active[index] += delta
+                if not active[index]:
+                    del active[index]
+            indexes = tuple(sorted(active))
+            if indexes == previous:
+                continue
+            if minute != self.starts[-1]:
+                self.starts.append(minute)
+                self.segments.append(())
+                self.indexes.append(())
+                self.with_sub_rules.append(())
+            self.segments[-1] = tuple(map(self.rules.__getitem__, indexes))
+            self.indexes[-1] = indexes
+            self.with_sub_rules[-1] = tuple(rule for rule in self.segments[-1] if rule.sub_rule_edges)
+            previous = indexes
+
+    def __len__(self):
+        return len(self.rules)
+
+    def position(self, now: datetime) -> int:
+        """Index of the segment `now` belongs to"""
+        return bisect_right(self.starts, minute_of_week(now)) - 1
+
+    def active(self, now: datetime) -> tuple[CompiledRule, ...]:
+        return self.segments[self.position(now)]
+
+    def next_transition(self, now: datetime) -> datetime:
+        """Start of the first minute after `now` when any rule or sub-rule of an active rule changes state"""
+        minute = minute_of_week(now)
+        index = bisect_right(self.starts, minute)
+        transition = self.starts[index] if index < len(self.starts) else MINUTES_PER_WEEK
+        start_of_day = minute - minute % MINUTES_PER_DAY
+        for rule in self.with_sub_rules[index - 1]:
+            edge = rule.next_sub_rule_edge(minute % MINUTES_PER_DAY)
+            if edge is not None:
+                transition = min(transition, start_of_day + edge)
+        return now.replace(second=0, microsecond=0) + timedelta(minutes=transition - minute)
@@ -1,5 +1,7 @@
 from datetime import time
 
+MINUTES_PER_DAY = 24 * 60
+
 
 def parse_time(time_s: str) -> time:
     return time(*map(int, time_s.split(':')))
@@ -13,6 +15,14 @@ def parse_time_range(time_range: str) -> list[time, time]:
     return [parse_time(t) for t in time_range.split('-', 1)]
 
 
+def parse_range(range_: str) -> range:
+    """
+    >>> parse_range('11-15')
+    range(11, 15)
+    """
+    return range(*map(int, range_.split('-')))
+
+
 def match_range(range_: str, value: int) -> bool:
     """
     No overflow required, so naive realisation is enough for both hours and minutes
@@ -26,7 +36,7 @@ def match_range(range_: str, value: int) -> bool:
     >>> match_range('3-10', 10)
     False
     """
-    return value in range(*map(int, range_.split('-')))
+    return value in parse_range(range_)
 
 
 def match_time_range(time_range: str, current_time: time) -> bool:
@@ -44,3 +54,18 @@ def match_time_range(time_range: str, current_time: time) -> bool:
     if from_t < to_t:
         return from_t <= current_time <= to_t
     return time(0, 0) <= current_time <= to_t or from_t <= current_time <= time(23, 59)
+
+
+def time_range_minutes(time_range: str) -> list[tuple[int, int]]:
+    """
+    Same as match_time_range, but with minute precision: inclusive intervals of minutes of the day.
+    Unlike match_time_range the last minute of the day (23:59:xx) is matched completely.
+    >>> time_range_minutes('09:00-23:00')
+    [(540, 1380)]
+    >>> time_range_minutes('23:00-09:00')
+    [(0, 540), (1380, 1439)]
+    """
+    from_m, to_m = (t.hour * 60 + t.minute for t in parse_time_range(time_range))
+    if from_m < to_m:
+        return [(from_m, to_m)]
+    return [(0, to_m), (from_m, MINUTES_PER_DAY - 1)]
@@ -0,0 +1,77 @@
+import json
+import math
+import time
+from typing import Optional
+
+ONLINE_PAYLOADS = {'online', 'true', '1', 'on', 'connected'}
+OFFLINE_PAYLOADS = {'offline', 'false', '0', 'off', 'disconnected', 'lost'}
+
+
+def parse_availability(payload: str) -> Optional[bool]:
+    """
+    Payload of availability/LWT topic, plain (Tasmota, ESPHome) or JSON with `state` (zigbee2mqtt)
+    >>> parse_availability('Online'), parse_availability('{"state": "offline"}'), parse_availability('booting')
+    (True, False, None)
+    """
+    value = payload.strip()
+    if value.startswith('{'):
+        value = str(json.loads(value).get('state', ''))
+    value = value.lower()
+    if value in ONLINE_PAYLOADS:
+        return True
+    if value in OFFLINE_PAYLOADS:
+        return False
+    return None
+
+
+class Availability:
+    """
+    Circuit breaker of a single device. While it's open (device is offline) writes are skipped,
+    after an exponential backoff a single attempt is allowed, its failure opens the circuit for longer.
+    >>> availability = Availability()
+    >>> availability.failure('connect failed'), availability.allows(), availability.backoff()
+    (True, False, 60)
+    >>> availability.success(), availability.allows()
+    (True, True)
+    """
+    __slots__ = ('online', 'failures', 'retry_at', 'reason')
+    min_backoff = 30
+    max_backoff = 3600
+
+    def __init__(self):
+        self.online = True
+        self.failures = 0
+        self.retry_at = 0.0
+        self.reason: Optional[str] = None
+
+    def allows(self) -> bool:
+        return self.online or time.monotonic() >= self.retry_at
+
+    def backoff(self) -> float:
+        return min(self.max_backoff, self.min_backoff * 2 ** self.failures)
+
+    def failure(self, reason: str, retry: bool = True) -> bool:
+        """
+        Opens the circuit, returns True if device was online. Failures while the circuit is already open are
+        not counted, `retry=False` keeps it open until success() (device told it's offline itself).
+        """
+        if not self.online and time.monotonic() < self.retry_at and retry:
+            return False
+        was_online, self.online, self.reason = self.online, False, reason
+        self.retry_at = time.monotonic() + self.backoff() if retry else math.inf
+        self.failures += 1
+        return was_online
+
+    def attempt(self):
+        """Half-open attempt is counted as a failure until the device proves it's alive"""
+        self.failure(self.reason or 'unknown')
+
+    def success(self) -> bool:
+        """Closes the circuit, returns True if device was offline"""
+        was_offline, self.online = not self.online, True
+        self.failures, self.retry_at, self.reason = 0, 0.0, None
+        return was_offline
+
+    def as_dict(self) -> dict:
+        retry_in = None if self.online or math.isinf(self.retry_at) else max(0.0, self.retry_at - time.monotonic())
+        return {'online': self.online, 'reason': self.reason, 'failures': self.failures, 'retry_in': retry_in}
@@ -1,55 +1,188 @@
 import abc
+import functools
+import importlib
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Generator, Optional
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Generator, Optional
 
 from pydantic import BaseModel, Field
 
+from mqtt_automator import metrics
 from mqtt_automator.broker import Broker
+from mqtt_automator.devices.availability import Availability, parse_availability
+from mqtt_automator.devices.outbox import Outbox
+from mqtt_automator.devices.overrides import DEFAULT_DURATION, Overrides
+from mqtt_automator.devices.table import StateTable
+from mqtt_automator.store import BaseStore
 
-CLIENT_BLOCK_SECONDS = timedelta(hours=4).seconds
+if TYPE_CHECKING:
+    from mqtt_automator.journal import Journal
 
 log = logging.getLogger(__name__)
 
 
+@functools.cache
+def get_json_loads(backend: Optional[str]):
+    """
+    Returns `loads` of optional faster JSON module (orjson, ujson...), falls back to stdlib if it's not installed
+    >>> get_json_loads('surely_not_installed_json') is json.loads
+    True
+    """
+    if backend:
+        try:
+            return importlib.import_module(backend).loads
+        except ImportError:
+            log.debug('JSON backend %s is not installed, using json', backend)
+    return json.loads
+
+
 class Device(BaseModel):
     vendor: str
     id: str
     name: str
     parent: Optional[str] = Field(default=None)
+    availability: Optional[str] = Field(default=None)  # availability/LWT topic of device
+    broker: Optional[str] = Field(default=None)  # name of broker in `brokers` section
 
 
 class BaseClient(abc.ABC):
-    topic_template: str
+    """
+    Clients have __slots__ and keep state, blocks and desired state in the shared StateTable,
+    so thousands of them cost a few megabytes. Subclasses should declare __slots__ too.
+    Rows of the table are freed by close().
+    """
+    __slots__ = (
+        'broker', 'device', 'store', 'row', 'state', 'block', 'desired', 'rule_overrides', 'outbox', 'last_payload',
+        'availability', 'last_seen', 'on_recovery', 'online_gauge', 'skipped_by_state', 'skipped_by_block',
+        'skipped_by_offline', 'decode_failures', 'publish_latency', 'feedback_unchanged',
+        'overrides', 'json_loads', 'journal', 'echoes',
+    )
+    json_backend: Optional[str] = None  # module with faster `loads`, available as self.json_loads
+    publish_interval = 0.0  # minimal seconds between two writes to the device, app.publish_interval overrides it
+    table = StateTable()
 
-    def __init__(self, device: Device, broker: Broker = None):
+    def __init__(self, device: Device, broker: Broker = None, store: BaseStore = None):
+        self.row: Optional[int] = self.table.add_row(device.name)
+        self.overrides: Optional[Overrides] = None  # shared by clients of Automator, see app.override_duration
+        self.journal: Optional['Journal'] = None  # publishes are journaled by clients, received messages by Automator
+        self.json_loads = get_json_loads(self.json_backend)
         self.broker = broker
         self.device = device
-        self.state = dict()
-        self.started_at = datetime.now()
-        self.block = dict()
+        self.store = store
+        self.state = self.table.view('state', self.row)
+        self.block = self.table.view('block', self.row)  # sub_topic -> blocked_at, expiration is in self.overrides
+        self.desired = self.table.view('desired', self.row)  # sent again when device is back online
+        self.rule_overrides: dict[str, float] = dict()  # sub_topic -> `override` of the rule setting it
+        self.outbox = Outbox()
+        self.skipped_by_state = metrics.publish_skipped.labels(device.vendor, 'state')
+        self.skipped_by_block = metrics.publish_skipped.labels(device.vendor, 'block')
+        self.decode_failures = metrics.decode_failures.labels(device.vendor)
+        self.publish_latency = metrics.publish_latency.labels(device.vendor)
+        self.feedback_unchanged = metrics.feedback_unchanged.labels(device.vendor)
+        self.skipped_by_offline = metrics.publish_skipped.labels(device.vendor, 'offline')
+        self.online_gauge = metrics.device_online.labels(device.vendor, device.name)
+        self.online_gauge.set(1)
+        self.last_payload: dict[str, bytes] = dict()
+        self.echoes: dict[str, bytes] = dict()  # topic -> payload we published, it may come back on subscriptions
+        self.availability = Availability()
+        self.last_seen = time.monotonic()
+        self.on_recovery: Optional[Callable[['BaseClient'], None]] = None
+
+    def close(self):
+        """Frees the row of the client, its state is gone and the client must not be used after that"""
+        if self.row is not None:
+            self.table.remove_row(self.row)
+            self.row = None
+            for view in (self.state, self.block, self.desired):
+                view.close()
+
+    def share(self, resources: dict):
+        """
+        Called by Automator with a dict shared by all its clients, subclasses may replace their own helpers
+        (connection pools, caches) with the ones kept there. It also has app settings the helpers depend on,
+        e.g. publish_timeout, and is shared again when they change on reload
+        """
 
     def __str__(self):
         return f'{type(self).__name__.replace("Client", "")} {self.device.name} ({self.device.id})'
 
-    async def publish(self, sub_topic: str, payload):
-        if isinstance(payload, bool):
-            payload = 'on' if payload else 'off'
+    async def publish(self, sub_topic: str, payload, manual: bool = False) -> bool:
+        """Returns False if publish was skipped, `manual` writes (control API) are not skipped by blocks"""
+        payload = self.normalize(payload)
 
         if self.state.get(sub_topic) == payload:
             log.debug('Skipped %s %s because state-match %s', self, sub_topic, self.state)
-            return
+            self.skipped_by_state.inc()
+            return False
 
-        if sub_topic in self.block:
-            if (datetime.now() - self.block[sub_topic]).seconds < CLIENT_BLOCK_SECONDS:
+        if sub_topic in self.block and not manual:
+            if self.blocked(sub_topic):
                 log.info('Skipped %s %s update, it was blocked at %s', self, sub_topic, self.block[sub_topic])
-                return
-            self.block.pop(sub_topic)
+                self.skipped_by_block.inc()
+                return False
+            self.set_block(sub_topic, None)
+
+        topic = self.build_topic_name(sub_topic)
+        if not await self.broker.connection.publish(topic, payload):
+            log.info('Queued %s %s %s until reconnect to %s', self, sub_topic, payload, self.broker.ip)
+            return False
+        self.set_state(sub_topic, payload)
+        self.last_payload.clear()  # the device may confirm or reject the command with the previous payload
+        self.echoes[topic] = payload if isinstance(payload, bytes) else str(payload).encode()
+        if self.journal:
+            self.journal.published(self.device.name, sub_topic, payload)
+        log.info('Published %s %s %s', self, sub_topic, payload)
+        return True
+
+    def normalize(self, payload):
+        """Payload as it's kept in state"""
+        if isinstance(payload, bool):
+            return 'on' if payload else 'off'
+        return payload
 
-        async with self.broker.get_client() as client:
-            await client.publish(topic=self.build_topic_name(sub_topic), payload=payload)  # noqa
-            self.state[sub_topic] = payload
-            log.info('Published %s %s %s', self, sub_topic, payload)
+    def feed(self, topic: str, payload: bytes) -> bool:
+        """Calls receive() unless payload is the same as the previous one on this topic, returns False if skipped"""
+        if topic == self.device.availability:
+            self.receive_availability(payload.decode())
+            return True
+        if self.echoes.pop(topic, None) != payload:  # our own publish coming back is not a proof of life
+            self.last_seen = time.monotonic()
+            if not self.device.availability:
+                self.mark_online()
+        if self.last_payload.get(topic) == payload:
+            self.feedback_unchanged.inc()
+            return False
+        self.receive(topic, payload.decode())
+        self.last_payload[topic] = payload
+        return True
+
+    def receive_availability(self, payload: str):
+        online = parse_availability(payload)
+        if online:
+            self.mark_online()
+        elif online is False:
+            self.mark_offline('availability topic', retry=False)
+
+    def mark_offline(self, reason: str, retry: bool = True):
+        """State of offline device is unknown, it's rebuilt from feedback or publishes after recovery"""
+        if self.availability.failure(reason, retry):
+            log.warning('%s is offline: %s', self, reason)
+            self.online_gauge.set(0)
+            self.table.changed('availability', self.row, 'online', False)
+            if self.store:  # otherwise the stale state is restored after restart
+                self.store.clear_state(self.device.name, self.state)
+            self.state.clear()
+            self.last_payload.clear()
+
+    def mark_online(self):
+        if self.availability.success():
+            log.info('%s is back online', self)
+            self.online_gauge.set(1)
+            self.table.changed('availability', self.row, 'online', True)
+            if self.on_recovery:
+                self.on_recovery(self)
 
     def update_state(self, sub_topic: str, value):
         """_Required_ to use inside subclass.receive()"""
@@ -58,11 +191,51 @@ class BaseClient(abc.ABC):
             return
 
         if sub_topic in self.state:
-            self.block[sub_topic] = datetime.now()
+            self.set_block(sub_topic, datetime.now())
             log.info('%s blocked %s because of update', self, sub_topic)
 
         log.info('Updating %s state: %s %s -> %s', self, sub_topic, self.state.get(sub_topic), value)
+        self.set_state(sub_topic, value)
+
+    def set_state(self, sub_topic: str, value):
         self.state[sub_topic] = value
+        if self.store:
+            self.store.put_state(self.device.name, sub_topic, value)
+
+    def blocked(self, sub_topic: str) -> bool:
+        """Clients without Overrides (not created by Automator) keep blocks for the default duration"""
+        if self.overrides is None:
+            return (datetime.now() - self.block[sub_topic]).total_seconds() < DEFAULT_DURATION
+        return self.overrides.blocked(self, sub_topic)
+
+    def set_block(self, sub_topic: str, blocked_at: Optional[datetime]):
+        """None means unblock"""
+        if blocked_at is None:
+            self.block.pop(sub_topic, None)
+            if self.overrides is not None:
+                self.overrides.unblock(self, sub_topic)
+        else:
+            self.block[sub_topic] = blocked_at
+            if self.overrides is not None:
+                self.overrides.block(self, sub_topic, blocked_at)
+        if self.store:
+            self.store.put_block(self.device.name, sub_topic, blocked_at)
+
+    def snapshot(self) -> dict:
+        return {
+            'state': self.state.copy(),
+            'block': self.block.copy(),
+            'desired': self.desired.copy(),
+            'availability': self.availability.as_dict(),
+        }
+
+    def restore(self, snapshot: dict):
+        """Restores state and blocks loaded by BaseStore.load()"""
+        self.state.update(snapshot.get('state', dict()))
+        for sub_topic, blocked_at in snapshot.get('block', dict()).items():
+            self.block[sub_topic] = blocked_at
+            if self.overrides is not None:
+                self.overrides.block(self, sub_topic, blocked_at)
 
     @abc.abstractmethod
     def receive(self, topic, payload):
@@ -75,6 +248,13 @@ class BaseClient(abc.ABC):
     def subscriptions(self) -> Generator:
         """Method should return list of read-topics of device to subscribe."""
 
+    def subscription_filters(self) -> Generator:
+        """
+        Topic filters actually sent in SUBSCRIBE, may contain wildcards shared by all devices of a vendor.
+        Messages are still routed to the device by subscriptions().
+        """
+        yield from self.subscriptions()
+
     @abc.abstractmethod
     def build_topic_name(self, sub_topic) -> str:
         """
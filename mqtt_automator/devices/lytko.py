@@ -1,5 +1,4 @@
 import logging
-import json
 
 from mqtt_automator.devices.base import BaseClient, Device
 
@@ -7,8 +6,11 @@ log = logging.getLogger(__name__)
 
 
 class LytkoClient(BaseClient):
+    __slots__ = ()
+    json_backend = 'orjson'
+
     def receive(self, topic: str, payload: str):
-        payload = json.loads(payload)
+        payload = self.json_loads(payload)
         state = {
             'mode': 'off' if payload['heating'] == 'off' else 'on',
             'temperature': int(float(payload['target_temp']))
@@ -25,6 +27,9 @@ class LytkoClient(BaseClient):
         """
         yield f'climate/lytko/{self.device.id}/state'
 
+    def subscription_filters(self):
+        yield 'climate/lytko/+/state'
+
     def build_topic_name(self, sub_topic) -> str:
         """
         >>> device = Device(vendor='lytko', id='12345', name='floor_pretty_name')
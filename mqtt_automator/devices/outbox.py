@@ -0,0 +1,57 @@
+import asyncio
+from typing import Optional
+
+
+class Outbox:
+    """
+    Pending writes of a single device: sub_topic -> payload.
+    Writes to the same sub-topic are coalesced (the last value wins, the position of the first one is kept).
+    put() waits while `maxsize` sub-topics are pending, that's a backpressure for the scheduler.
+    """
+    __slots__ = ('maxsize', 'pending', 'in_flight', 'coalesced', 'sent', '_condition')
+
+    def __init__(self, maxsize: int = 16):
+        self.maxsize = maxsize
+        self.pending: dict[str, object] = dict()
+        self.in_flight = False
+        self.coalesced = 0
+        self.sent = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        """Created on the first write, most devices of a big fleet are written rarely"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def put(self, sub_topic: str, payload):
+        async with self.condition:
+            if sub_topic not in self.pending:
+                await self.condition.wait_for(lambda: len(self.pending) < self.maxsize)
+            if sub_topic in self.pending:
+                self.coalesced += 1
+            self.pending[sub_topic] = payload
+            self.condition.notify_all()
+
+    async def get(self) -> tuple[str, object]:
+        """Caller must call done() after the write is handled"""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.pending)
+            sub_topic = next(iter(self.pending))
+            self.in_flight = True
+            self.condition.notify_all()
+            return sub_topic, self.pending.pop(sub_topic)
+
+    async def done(self):
+        async with self.condition:
+            self.in_flight = False
+            self.sent += 1
+            self.condition.notify_all()
+
+    async def join(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.pending and not self.in_flight)
@@ -0,0 +1,128 @@
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Hashable, Optional
+
+if TYPE_CHECKING:
+    from mqtt_automator.devices.base import BaseClient
+
+DEFAULT_DURATION = 4 * 60 * 60
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: a timer is kept in the slot of the tick its deadline falls into, so add() and cancel()
+    are dict operations and advance() visits only slots of elapsed ticks. Timers further than a turn of the wheel
+    (resolution * size seconds) stay in their slot for more turns.
+    >>> wheel = TimerWheel(resolution=1, size=8)
+    >>> wheel.add('a', 3, now=0), wheel.add('b', 20, now=0), wheel.next_expiry()
+    (None, None, 3)
+    >>> wheel.advance(5), wheel.advance(19), wheel.next_expiry(), wheel.advance(20), wheel.timers
+    (['a'], [], 20, ['b'], {})
+    >>> wheel.add('c', -5, now=21), wheel.deadline('c'), wheel.next_expiry(), wheel.advance(21.5)
+    (None, 16, 21, ['c'])
+    """
+
+    def __init__(self, resolution: float = 1, size: int = 4096):
+        self.resolution = resolution
+        self.size = size
+        self.slots: list[dict[Hashable, float]] = [dict() for _ in range(size)]
+        self.timers: dict[Hashable, tuple[float, int]] = dict()  # key -> (deadline, tick)
+        self.tick: Optional[int] = None  # the last advanced tick
+
+    def add(self, key: Hashable, delay: float, now: float):
+        """Re-adding a key moves its deadline, timers already expired are put into the next tick"""
+        self.cancel(key)
+        if self.tick is None:
+            self.tick = math.floor(now / self.resolution)
+        deadline = now + delay
+        tick = max(math.ceil(deadline / self.resolution), self.tick + 1)
+        self.timers[key] = deadline, tick
+        self.slots[tick % self.size][key] = deadline
+
+    def cancel(self, key: Hashable):
+        if (timer := self.timers.pop(key, None)) is not None:
+            del self.slots[timer[1] % self.size][key]
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        timer = self.timers.get(key)
+        return None if timer is None else timer[0]
+
+    def advance(self, now: float) -> list[Hashable]:
+        """Removes and returns keys of timers expired by `now`"""
+        current = math.floor(now / self.resolution)
+        if self.tick is None or current <= self.tick:
+            return []
+        expired = []
+        for tick in range(max(self.tick + 1, current - self.size + 1), current + 1):
+            slot = self.slots[tick % self.size]
+            for key in [key for key, deadline in slot.items() if deadline <= now]:
+                del slot[key], self.timers[key]
+                expired.append(key)
+        self.tick = current
+        return expired
+
+    def next_expiry(self) -> Optional[float]:
+        """Time of the next tick with expiring timers within a turn of the wheel, the end of the turn otherwise"""
+        if not self.timers:
+            return None
+        for tick in range(self.tick + 1, self.tick + self.size + 1):
+            if any(deadline <= tick * self.resolution for deadline in self.slots[tick % self.size].values()):
+                return tick * self.resolution
+        return (self.tick + self.size) * self.resolution
+
+
+class Overrides:
+    """
+    Manual-override blocks of all devices. A sub-topic changed on the device (buttons, remote, vendor app)
+    is not written by the schedule for `duration` seconds: the duration of the rule which sets the sub-topic,
+    otherwise the duration of the vendor, otherwise the default one. Blocks are timers on a monotonic clock,
+    expired ones are removed by expire() without waiting for the next publish to the sub-topic.
+    """
+
+    def __init__(self, duration: float = DEFAULT_DURATION, vendor_durations: Optional[dict[str, float]] = None):
+        self.duration = duration
+        self.vendor_durations = vendor_durations or dict()
+        self.wheel = TimerWheel()
+        self.changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.wheel.timers)
+
+    def duration_for(self, client: 'BaseClient', sub_topic: str) -> float:
+        return client.rule_overrides.get(sub_topic) or self.vendor_durations.get(client.device.vendor, self.duration)
+
+    def block(self, client: 'BaseClient', sub_topic: str, blocked_at: datetime):
+        """`blocked_at` is a wall-clock time, blocks restored after restart are shortened by the downtime"""
+        elapsed = max(0.0, (datetime.now() - blocked_at).total_seconds())
+        self.wheel.add((client, sub_topic), self.duration_for(client, sub_topic) - elapsed, time.monotonic())
+        self.changed.set()
+
+    def unblock(self, client: 'BaseClient', sub_topic: str):
+        self.wheel.cancel((client, sub_topic))
+
+    def blocked(self, client: 'BaseClient', sub_topic: str) -> bool:
+        deadline = self.wheel.deadline((client, sub_topic))
+        return deadline is not None and deadline > time.monotonic()
+
+    def forget(self, client: 'BaseClient'):
+        for sub_topic in client.block:
+            self.unblock(client, sub_topic)
+
+    def expire(self) -> list[tuple['BaseClient', str]]:
+        """Unblocks and returns (client, sub_topic) of expired blocks"""
+        expired = self.wheel.advance(time.monotonic())
+        for client, sub_topic in expired:
+            client.set_block(sub_topic, None)
+        return expired
+
+    async def wait(self):
+        """Sleeps until the next block expires or a new one is added"""
+        expiry = self.wheel.next_expiry()
+        try:
+            async with asyncio.timeout(None if expiry is None else max(0.0, expiry - time.monotonic())):
+                await self.changed.wait()
+        except TimeoutError:
+            pass
+        self.changed.clear()
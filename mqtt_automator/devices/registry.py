@@ -0,0 +1,69 @@
+import importlib
+import logging
+from collections.abc import MutableMapping
+from importlib.metadata import entry_points
+from typing import Iterator
+
+log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'mqtt_automator.devices'
+
+
+class ClientRegistry(MutableMapping):
+    """
+    Vendor name -> client class. Modules are imported on the first lookup of their vendor,
+    so clients and dependencies of vendors absent in config.yml are never loaded.
+    Third-party packages add vendors by entry points in `mqtt_automator.devices` group:
+
+        [project.entry-points.'mqtt_automator.devices']
+        shelly = 'mqtt_automator_shelly:ShellyClient'
+
+    Classes assigned directly (registry['vendor'] = Client) take precedence over built-ins and entry points.
+    >>> registry = ClientRegistry()
+    >>> 'vakio' in registry, registry.loaded
+    (True, {})
+    >>> registry['vakio'].__name__, list(registry.loaded)
+    ('VakioClient', ['vakio'])
+    """
+    builtin = {
+        'lytko': 'mqtt_automator.devices.lytko:LytkoClient',
+        'vakio': 'mqtt_automator.devices.vakio:VakioClient',
+        'yeelink': 'mqtt_automator.devices.yeelink:YeelinkClient',
+    }
+
+    def __init__(self):
+        self.loaded: dict[str, type] = dict()
+        self.plugins: dict[str, str] | None = None
+
+    def targets(self) -> dict[str, str]:
+        """Entry points are read only when a vendor is not built-in, reading metadata of all packages is slow"""
+        if self.plugins is None:
+            self.plugins = {point.name: point.value for point in entry_points(group=ENTRY_POINT_GROUP)}
+        return self.plugins
+
+    def target(self, vendor: str) -> str:
+        if vendor in self.builtin:
+            return self.builtin[vendor]
+        return self.targets()[vendor]
+
+    def __getitem__(self, vendor: str) -> type:
+        if (client := self.loaded.get(vendor)) is None:
+            module, _, name = self.target(vendor).partition(':')
+            log.debug('Loading client of %s from %s', vendor, module)
+            client = self.loaded[vendor] = getattr(importlib.import_module(module), name)
+        return client
+
+    def __setitem__(self, vendor: str, client: type):
+        self.loaded[vendor] = client
+
+    def __delitem__(self, vendor: str):
+        del self.loaded[vendor]
+
+    def __contains__(self, vendor) -> bool:
+        return vendor in self.loaded or vendor in self.builtin or vendor in self.targets()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter({**self.builtin, **self.targets(), **self.loaded})
+
+    def __len__(self) -> int:
+        return len({**self.builtin, **self.targets(), **self.loaded})
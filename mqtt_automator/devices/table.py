@@ -0,0 +1,164 @@
+import sys
+from collections.abc import MutableMapping
+from typing import Callable, Iterator, Optional
+
+MISSING = object()
+FIELDS = ('state', 'block', 'desired')
+
+
+class StateTable:
+    """
+    State, manual-override blocks and desired state of all devices in one table. Devices are rows,
+    sub-topic names are interned once into column indexes shared by all devices, every field keeps
+    a list of values per column, indexed by row. A device costs a row index instead of a few dicts
+    and a bulk dump walks a few dozen columns instead of thousands of dicts.
+    Every change increments `version` and is passed to `listeners` as (version, field, device, sub_topic, value),
+    value is None for removed ones.
+    >>> table = StateTable()
+    >>> cabinet, floor = table.add_row('cabinet'), table.add_row('floor')
+    >>> table.view('state', cabinet).update(speed=3, state='on')
+    >>> table.view('state', floor)['temperature'] = 23
+    >>> table.snapshot('state')
+    {'cabinet': {'speed': 3, 'state': 'on'}, 'floor': {'temperature': 23}}
+    >>> table.remove_row(cabinet), table.add_row('lamp') == cabinet, table.snapshot('state')
+    (None, True, {'floor': {'temperature': 23}})
+    """
+
+    def __init__(self, fields: tuple[str, ...] = FIELDS):
+        self.names: list[Optional[str]] = []  # row -> device name, None for free rows
+        self.free: list[int] = []
+        self.sub_topics: dict[str, int] = dict()  # sub_topic -> column index
+        self.columns: dict[str, list[list]] = {field: [] for field in fields}  # field -> column index -> values
+        self.version = 0
+        self.listeners: list[Callable[[int, str, str, str, object], None]] = []
+
+    def add_row(self, name: str) -> int:
+        if self.free:
+            row = self.free.pop()
+            self.names[row] = name
+        else:
+            row = len(self.names)
+            self.names.append(name)
+        return row
+
+    def remove_row(self, row: int):
+        for columns in self.columns.values():
+            for column in columns:
+                if row < len(column):
+                    column[row] = MISSING
+        self.names[row] = None
+        self.free.append(row)
+
+    def column(self, field: str, sub_topic: str) -> list:
+        if (index := self.sub_topics.get(sub_topic)) is None:
+            index = self.sub_topics[sys.intern(sub_topic)] = len(self.sub_topics)
+        columns = self.columns[field]
+        while len(columns) <= index:
+            columns.append([])
+        return columns[index]
+
+    def changed(self, field: str, row: int, sub_topic: str, value):
+        self.version += 1
+        for listener in self.listeners:
+            listener(self.version, field, self.names[row], sub_topic, value)
+
+    def view(self, field: str, row: int) -> 'StateView':
+        return StateView(self, field, row)
+
+    def snapshot(self, field: str, rows: Optional[dict[int, str]] = None) -> dict[str, dict]:
+        """{device: {sub_topic: value}} of all devices or of `rows` given as {row: device}"""
+        names = self.names if rows is None else rows
+        snapshot: dict[str, dict] = dict()
+        columns = self.columns[field]
+        for sub_topic, index in self.sub_topics.items():
+            if index >= len(columns):
+                continue
+            for row, value in enumerate(columns[index]):
+                if value is not MISSING and (rows is None or row in rows):
+                    snapshot.setdefault(names[row], dict())[sub_topic] = value
+        return snapshot
+
+
+class StateView(MutableMapping):
+    """
+    A row of a field of StateTable as a dict: sub_topic -> value.
+    Rows are reused, so a view of a removed row is closed and raises LookupError instead of reading another device
+    >>> table = StateTable()
+    >>> view = table.view('state', table.add_row('cabinet'))
+    >>> view['speed'] = 3
+    >>> table.remove_row(view.row), view.close()
+    (None, None)
+    >>> view.get('speed')
+    Traceback (most recent call last):
+    ...
+    LookupError: state of a removed row
+    """
+    __slots__ = ('table', 'field', 'columns', 'row')
+
+    def __init__(self, table: StateTable, field: str, row: int):
+        self.table = table
+        self.field = field
+        self.columns = table.columns[field]
+        self.row: Optional[int] = row
+
+    def close(self):
+        self.row = None
+
+    def check(self) -> int:
+        if self.row is None:
+            raise LookupError(f'{self.field} of a removed row')
+        return self.row
+
+    def get(self, sub_topic: str, default=None):
+        row = self.check()
+        index = self.table.sub_topics.get(sub_topic)
+        if index is None or index >= len(self.columns):
+            return default
+        column = self.columns[index]
+        if row >= len(column) or (value := column[row]) is MISSING:
+            return default
+        return value
+
+    def __getitem__(self, sub_topic: str):
+        if (value := self.get(sub_topic, MISSING)) is MISSING:
+            raise KeyError(sub_topic)
+        return value
+
+    def __contains__(self, sub_topic) -> bool:
+        return self.get(sub_topic, MISSING) is not MISSING
+
+    def __setitem__(self, sub_topic: str, value):
+        row = self.check()
+        column = self.table.column(self.field, sub_topic)
+        if row >= len(column):
+            column.extend([MISSING] * (row + 1 - len(column)))
+        elif column[row] == value:
+            return
+        column[row] = value
+        self.table.changed(self.field, row, sub_topic, value)
+
+    def __delitem__(self, sub_topic: str):
+        if sub_topic not in self:
+            raise KeyError(sub_topic)
+        self.columns[self.table.sub_topics[sub_topic]][self.row] = MISSING
+        self.table.changed(self.field, self.row, sub_topic, None)
+
+    def copy(self) -> dict:
+        row, columns = self.check(), self.columns
+        return {
+            sub_topic: value for sub_topic, index in self.table.sub_topics.items()
+            if index < len(columns) and row < len(column := columns[index]) and (value := column[row]) is not MISSING
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.copy())
+
+    def __len__(self) -> int:
+        return len(self.copy())
+
+    def clear(self):
+        for sub_topic in self.copy():
+            del self[sub_topic]
+
+    def __repr__(self):
+        return repr(self.copy())
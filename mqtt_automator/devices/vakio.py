@@ -1,19 +1,36 @@
 import logging
 
+from mqtt_automator.broker import Broker
 from mqtt_automator.devices.base import BaseClient, Device
+from mqtt_automator.store import BaseStore
 
 log = logging.getLogger(__name__)
 
 
 class VakioClient(BaseClient):
+    __slots__ = ('sub_topics',)
+    publish_interval = 0.5  # controller chokes on bursts
+    read_sub_topics = ('state', 'workmode', 'speed')
+
+    def __init__(self, device: Device, broker: Broker = None, store: BaseStore = None):
+        super().__init__(device, broker, store)
+        self.sub_topics = {self.build_topic_name(sub_topic): sub_topic for sub_topic in self.read_sub_topics}
+
     def receive(self, topic: str, payload: str):
-        sub_topic = topic.split('/')[-1]
+        sub_topic = self.sub_topics.get(topic) or topic.rsplit('/', 1)[-1]
         value = int(payload) if payload.isdigit() else payload
         self.update_state(sub_topic, value)
 
     def subscriptions(self):
-        for sub_topic in ('state', 'workmode', 'speed'):
-            yield self.build_topic_name(sub_topic)
+        yield from self.sub_topics
+
+    def subscription_filters(self):
+        """
+        >>> device = Device(vendor='vakio', id='cabinet_mqtt', name='cabinet_pretty_name')
+        >>> list(VakioClient(device).subscription_filters())
+        ['cabinet_mqtt/+']
+        """
+        yield self.build_topic_name('+')
 
     def build_topic_name(self, sub_topic) -> str:
         """
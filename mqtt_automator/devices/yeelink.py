@@ -1,21 +1,194 @@
 import asyncio
 import json
 import logging
+import time
+from typing import Optional
 
+from mqtt_automator import icmp
 from mqtt_automator.broker import Broker
 from mqtt_automator.devices.base import BaseClient, Device
+from mqtt_automator.store import BaseStore
 
 log = logging.getLogger(__name__)
 
 
-class YeelinkClient(BaseClient):
-    port = 55443
-    max_message_id = 65000
+class LampConnection:
+    __slots__ = ('reader', 'writer', 'last_used', 'reader_task', 'pending', 'message_id')
 
-    def __init__(self, device: Device, broker: Broker = None):
-        super().__init__(device, broker)
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader, self.writer = reader, writer
+        self.last_used = time.monotonic()
+        self.reader_task: Optional[asyncio.Task] = None
+        self.pending: dict[int, asyncio.Future] = dict()  # message id -> answer of the lamp
         self.message_id = 0
 
+
+class YeelinkTransport:
+    """
+    Persistent TCP connections to lamps shared by clients of an Automator, keyed by (host, port).
+    Connections unused for `idle_timeout` seconds are closed, broken ones are reopened once on write.
+    A write succeeds only when the lamp answers the command within `answer_timeout` seconds:
+    a lamp switched off at the wall leaves a half-open socket which accepts writes.
+    Reconnects and retries of a write fit in `timeout` seconds, Automator sets it to app.publish_timeout.
+    """
+    connect_timeout = 3
+    answer_timeout = 2
+    timeout = 5.0
+    idle_timeout = 300
+    max_message_id = 65000
+
+    def __init__(self):
+        self.connections: dict[tuple[str, int], LampConnection] = dict()
+        self.locks: dict[tuple[str, int], asyncio.Lock] = dict()
+
+    async def send(self, host: str, port: int, command: dict) -> bool:
+        """`command` is {"method": ..., "params": [...]}, id is unique per connection"""
+        self.evict_idle()
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await self.attempt(host, port, command)
+        except TimeoutError:
+            log.info('Lamp %s:%d did not answer in %s seconds', host, port, self.timeout)
+            self.close((host, port))  # a late answer must not be taken for the next command
+            return False
+
+    async def attempt(self, host: str, port: int, command: dict) -> bool:
+        for _ in range(2):
+            if (connection := await self.connect(host, port)) is None:
+                return False
+            message_id = connection.message_id = connection.message_id % self.max_message_id + 1
+            answer = connection.pending[message_id] = asyncio.get_running_loop().create_future()
+            try:
+                connection.writer.write(json.dumps({'id': message_id, **command}).encode() + b'\r\n')
+                await connection.writer.drain()
+                async with asyncio.timeout(self.answer_timeout):
+                    await answer
+            except (OSError, ConnectionError, TimeoutError):
+                log.info('Connection to %s:%d is broken, reconnecting', host, port)
+                self.close((host, port))
+                continue
+            finally:
+                connection.pending.pop(message_id, None)
+            connection.last_used = time.monotonic()
+            return True
+        return False
+
+    async def connect(self, host: str, port: int) -> Optional[LampConnection]:
+        key = (host, port)
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            connection = self.connections.get(key)
+            if connection and not connection.writer.is_closing():
+                return connection
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError):
+                return None
+            connection = self.connections[key] = LampConnection(reader, writer)
+            connection.reader_task = asyncio.create_task(self.read(key, connection))
+            return connection
+
+    async def read(self, key: tuple[str, int], connection: LampConnection):
+        """Lamps answer every command with its id and notify about property changes without it"""
+        try:
+            while line := await connection.reader.readline():
+                log.debug('Lamp %s answered %s', key[0], line)
+                try:
+                    message_id = json.loads(line).get('id')
+                except (ValueError, AttributeError):
+                    continue
+                if (answer := connection.pending.get(message_id)) and not answer.done():
+                    answer.set_result(line)
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            for answer in connection.pending.values():
+                if not answer.done():
+                    answer.set_exception(ConnectionError('Lamp closed connection'))
+            connection.writer.close()
+            if self.connections.get(key) is connection:
+                del self.connections[key]
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for key, connection in list(self.connections.items()):
+            if connection.last_used < deadline:
+                log.debug('Closing idle connection to %s:%d', *key)
+                self.close(key)
+
+    def close(self, key: tuple[str, int]):
+        if connection := self.connections.pop(key, None):
+            connection.writer.close()
+            connection.reader_task.cancel()
+
+    def close_all(self):
+        for key in list(self.connections):
+            self.close(key)
+        self.locks.clear()
+
+
+class ParentProber:
+    """
+    Parent host availability shared by all lamps: results are cached for `ttl` seconds and concurrent
+    checks of the same host wait for a single probe. ICMP socket is used when permitted, `ping` otherwise.
+    """
+    ttl = 30
+    timeout = 1
+
+    def __init__(self):
+        self.cache: dict[str, tuple[float, bool]] = dict()
+        self.probes: dict[str, asyncio.Task] = dict()
+        self.use_subprocess = False
+
+    async def is_alive(self, host: str) -> bool:
+        expires_at, alive = self.cache.get(host, (0, False))
+        if expires_at > time.monotonic():
+            return alive
+        if (probe := self.probes.get(host)) is None:
+            probe = self.probes[host] = asyncio.create_task(self.probe(host))
+            probe.add_done_callback(lambda _: self.probes.pop(host, None))
+        return await asyncio.shield(probe)
+
+    async def probe(self, host: str) -> bool:
+        alive = None
+        if not self.use_subprocess:
+            try:
+                alive = await icmp.ping(host, self.timeout)
+            except PermissionError:
+                log.info('ICMP sockets are not permitted, falling back to ping subprocess')
+                self.use_subprocess = True
+            except OSError as e:
+                log.warning('Failed to ping %s: %s', host, e)
+                alive = False
+        if alive is None:
+            alive = await self.ping_subprocess(host)
+        self.cache[host] = (time.monotonic() + self.ttl, alive)
+        return alive
+
+    async def ping_subprocess(self, host: str) -> bool:
+        proc = await asyncio.create_subprocess_exec(
+            'ping', '-qw1', '-c', '1', host,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        return not await proc.wait()
+
+
+class YeelinkClient(BaseClient):
+    __slots__ = ('port', 'transport', 'prober')
+    default_port = 55443
+
+    def __init__(self, device: Device, broker: Broker = None, store: BaseStore = None):
+        super().__init__(device, broker, store)
+        self.port = self.default_port
+        self.transport = YeelinkTransport()
+        self.prober = ParentProber()
+
+    def share(self, resources: dict):
+        """Lamps of an Automator share connections and parent probes"""
+        self.transport = resources.setdefault('yeelink.transport', self.transport)
+        self.transport.timeout = resources.get('publish_timeout', self.transport.timeout)
+        self.prober = resources.setdefault('yeelink.prober', self.prober)
+
     def subscriptions(self):
         """Not subscribing on lamps, there is no MQTT at all, it's enough to disable it at 23:00"""
         return ()
@@ -25,46 +198,35 @@ class YeelinkClient(BaseClient):
             log.warning('Define parent host in device %s to use icmp value, defaulting to `on`', self.device.name)
             return True
 
-        proc = await asyncio.create_subprocess_exec(
-            'ping', '-qw1', '-c', '1', self.device.parent,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        await proc.wait()
-        log.debug("Parent of %s (%s) availability: %s", self.device.name, self.device.parent, not proc.returncode)
-        return not proc.returncode
+        alive = await self.prober.is_alive(self.device.parent)
+        log.debug("Parent of %s (%s) availability: %s", self.device.name, self.device.parent, alive)
+        return alive
+
+    def normalize(self, payload):
+        """Lamps keep boolean power state, `icmp` is resolved by publish()"""
+        return payload
 
-    async def publish(self, sub_topic: str, payload):
+    async def publish(self, sub_topic: str, payload, manual: bool = False) -> bool:  # pylint: disable=unused-argument
+        """Lamps have no feedback, so they are never blocked and `manual` makes no difference"""
         if payload == 'icmp':
             payload = await self.is_parent_alive()
 
         if self.state.get(sub_topic) == payload:
             log.debug('Skipped because state-match %s', self.state)
-            return
+            self.skipped_by_state.inc()
+            return False
 
-        self.message_id = ((self.message_id + 1) % self.max_message_id) + 1
-        self.state[sub_topic] = payload
-        fut = asyncio.open_connection(self.device.id, self.port)
-        try:
-            _, writer = await asyncio.wait_for(fut, timeout=3)
-        except (OSError, asyncio.TimeoutError):
-            # If device is switched off, no problem, keep _desired_ state and skip further requests
-            log.warning("Can't connect to %s", self)
-            return
-        writer.write(
-            (
-                    json.dumps({
-                        'id': self.message_id,
-                        'method': sub_topic,
-                        'params': ['on', 'smooth', 500] if payload else ['off']
-                    })
-                    + '\r\n'
-            ).encode()
-        )
-        await writer.drain()
+        command = {'method': sub_topic, 'params': ['on', 'smooth', 500] if payload else ['off']}
+        if not await self.transport.send(self.device.id, self.port, command):
+            # If device is switched off, no problem, desired state is sent again when it's back
+            self.mark_offline("doesn't answer")
+            return False
+        self.mark_online()
+        self.set_state(sub_topic, payload)
+        if self.journal:
+            self.journal.published(self.device.name, sub_topic, payload)
         log.info('Published %s %s %s', self, sub_topic, payload)
-        writer.close()
-        await writer.wait_closed()
+        return True
 
     def build_topic_name(self, sub_topic) -> str:
         """No feedback is required, just turn on and turn off by schedule"""
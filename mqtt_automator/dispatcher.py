@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from mqtt_automator.devices.base import BaseClient
+from mqtt_automator.watchdog import Watchdog
+
+log = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Puts actions of a tick into outboxes of devices, every device has a worker publishing its outbox.
+    Sub-topics of a single device are published in order (e.g. `state` before `speed`),
+    total concurrency is capped and every publish has a deadline, so one offline device can't stall the tick.
+    Devices are rate limited by `intervals` of their vendors (app.publish_interval), otherwise by
+    BaseClient.publish_interval of their class, full outboxes make dispatch() wait.
+    Actions of offline devices are only remembered as desired state until their circuit allows an attempt.
+    """
+
+    def __init__(self, concurrency: int = 32, timeout: float = 5.0, watchdog: Optional[Watchdog] = None,
+                 intervals: Optional[dict[str, float]] = None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.watchdog = watchdog or Watchdog(threshold=0)
+        self.intervals = intervals or dict()  # vendor -> minimal seconds between two writes to a device
+        self.workers: dict[BaseClient, asyncio.Task] = dict()
+        self.results: dict[tuple[BaseClient, str], asyncio.Future] = dict()  # manual writes awaited by send()
+
+    async def dispatch(self, actions: dict[BaseClient, list[tuple[str, object]]]):
+        for client, items in actions.items():
+            client.desired.update(items)
+            if not client.availability.allows():
+                client.skipped_by_offline.inc(len(items))
+                continue
+            self.start(client)
+            for sub_topic, payload in items:
+                if (client, sub_topic) in self.results:
+                    continue  # a manual write of the sub-topic is pending, it wins
+                await client.outbox.put(sub_topic, payload)
+
+    async def send(self, client: BaseClient, sub_topic: str, payload) -> bool:
+        """
+        A manual write (control API) through the outbox of the device, waiting until it's published.
+        It's not skipped by blocks and scheduled writes don't replace it while it's pending.
+        Returns False if it's skipped (offline, state match, timeout)
+        """
+        if not client.availability.allows():
+            return False
+        client.desired[sub_topic] = payload
+        self.start(client)
+        await client.outbox.put(sub_topic, payload)
+        if (future := self.results.get((client, sub_topic))) is None:
+            future = self.results[client, sub_topic] = asyncio.get_running_loop().create_future()
+        return await asyncio.shield(future)
+
+    def start(self, client: BaseClient):
+        if client not in self.workers:
+            self.workers[client] = asyncio.create_task(self.worker(client))
+
+    def resize(self, concurrency: int):
+        """Publishes in flight finish under the previous limit"""
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def forget(self, client: BaseClient):
+        """Stops the worker of a device removed from config, pending writes are dropped"""
+        if worker := self.workers.pop(client, None):
+            worker.cancel()
+        for key in [key for key in self.results if key[0] is client]:
+            self.results.pop(key).cancel()
+
+    async def join(self):
+        """Waits until all outboxes are drained"""
+        await asyncio.gather(*(client.outbox.join() for client in self.workers))
+
+    async def worker(self, client: BaseClient):
+        while True:
+            sub_topic, payload = await client.outbox.get()
+            result = self.results.pop((client, sub_topic), None)
+            try:
+                published = await self.publish(client, sub_topic, payload, result is not None)
+                if result:
+                    result.set_result(published)
+                if published and (interval := self.intervals.get(client.device.vendor, client.publish_interval)):
+                    await asyncio.sleep(interval)
+            finally:
+                if result:
+                    result.cancel()  # no-op when the result is set
+                await client.outbox.done()
+
+    async def publish(self, client: BaseClient, sub_topic: str, payload, manual: bool = False) -> bool:
+        async with self.semaphore:
+            started_at = time.monotonic()
+            try:
+                async with asyncio.timeout(self.timeout):
+                    published = await self.watchdog.timed('publish', client.device.name,
+                                                           client.publish(sub_topic, payload, manual))
+                if published:
+                    client.publish_latency.observe(time.monotonic() - started_at)
+                return published
+            except TimeoutError:
+                log.warning('Publish %s %s %s timed out after %.1f seconds', client, sub_topic, payload, self.timeout)
+            except Exception:  # pylint: disable=broad-exception-caught
+                log.exception('Publish %s %s %s failed', client, sub_topic, payload)
+        return False
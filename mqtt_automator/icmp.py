@@ -0,0 +1,54 @@
+import asyncio
+import random
+import socket
+import time
+
+
+def checksum(data: bytes) -> int:
+    """
+    >>> hex(checksum(bytes.fromhex('0800000012340001')))
+    '0xe5ca'
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(int.from_bytes(data[i:i + 2], 'big') for i in range(0, len(data), 2))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def echo_request(identifier: int, sequence: int) -> bytes:
+    header = bytes([8, 0, 0, 0]) + identifier.to_bytes(2, 'big') + sequence.to_bytes(2, 'big')
+    return header[:2] + checksum(header).to_bytes(2, 'big') + header[4:]
+
+
+def open_socket() -> socket.socket:
+    """Unprivileged ICMP socket (see net.ipv4.ping_group_range) or raw one if we have CAP_NET_RAW"""
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except PermissionError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+
+
+async def ping(host: str, timeout: float = 1) -> bool:
+    """Sends a single ICMP echo request, raises PermissionError if ICMP sockets are not permitted"""
+    loop = asyncio.get_running_loop()
+    address = (await loop.getaddrinfo(host, None, family=socket.AF_INET))[0][4][0]
+    identifier, sequence = random.randrange(1 << 16), random.randrange(1 << 16)
+    with open_socket() as sock:
+        sock.setblocking(False)
+        raw = sock.type == socket.SOCK_RAW
+        await loop.sock_sendto(sock, echo_request(identifier, sequence), (address, 0))
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                data, (source, _) = await asyncio.wait_for(loop.sock_recvfrom(sock, 1024), deadline - time.monotonic())
+                if raw:
+                    data = data[(data[0] & 0x0f) * 4:]
+                if source != address or len(data) < 8 or data[0] != 0:
+                    continue
+                # identifier of unprivileged ICMP socket is replaced by kernel, replies are filtered by it
+                if data[6:8] == sequence.to_bytes(2, 'big') and (not raw or data[4:6] == identifier.to_bytes(2, 'big')):
+                    return True
+        except (TimeoutError, ValueError):
+            return False
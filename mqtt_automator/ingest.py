@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from itertools import islice
+from typing import Callable
+
+from mqtt_automator import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Ingest:
+    """
+    Buffer between the MQTT connection and device clients. Messages are merged per topic (the last value wins)
+    and handled in batches with a yield to the event loop between them, so a replay of all retained messages
+    after a broker restart or a chatty device can't delay scheduler publishes.
+    """
+    batch_size = 100
+    max_pending = 50000
+
+    def __init__(self, handler: Callable[[str, bytes], None]):
+        self.handler = handler
+        self.pending: dict[str, bytes] = dict()
+        self.ready = asyncio.Event()
+        self.coalesced = metrics.ingest_coalesced.labels()
+        self.dropped = metrics.ingest_dropped.labels()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, topic: str, payload: bytes):
+        if topic in self.pending:
+            self.coalesced.inc()
+        elif len(self.pending) >= self.max_pending:
+            self.dropped.inc()
+            log.warning('Ingest buffer is full, dropped message from %s', topic)
+            return
+        self.pending[topic] = payload
+        self.ready.set()
+
+    async def run(self):
+        """Eternal task"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.pending:
+                for topic in list(islice(self.pending, self.batch_size)):
+                    payload = self.pending.pop(topic)
+                    try:
+                        self.handler(topic, payload)
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        log.exception('Failed to handle %s: %s', topic, payload)
+                await asyncio.sleep(0)
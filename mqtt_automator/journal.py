@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from mqtt_automator.devices.table import StateTable
+
+log = logging.getLogger(__name__)
+
+NAME, RECEIVED, PUBLISH = 0, 1, 2
+KINDS = {RECEIVED: 'received', PUBLISH: 'publish', 3: 'state', 4: 'block', 5: 'desired', 6: 'availability'}
+KIND_IDS = {name: kind for kind, name in KINDS.items()}
+HEADER = struct.Struct('<dBHHI')  # time, kind, device name id, sub-topic or topic name id, length of value
+MAX_NAMES = 0xFFFF
+
+
+class Entry(NamedTuple):
+    at: float
+    kind: str
+    device: str
+    key: str  # sub-topic, topic for received messages
+    value: bytes  # raw payload for received messages, JSON otherwise
+
+    def decoded(self):
+        return self.value.decode(errors='replace') if self.kind == 'received' else json.loads(self.value)
+
+
+class Journal:
+    """
+    Append-only binary journal of received messages, publishes and changes of StateTable (state, blocks,
+    desired state, availability). A record is a 17-bytes header and a value, device names and sub-topics are
+    written once per file as NAME records and referenced by id. Records are appended to a memory buffer,
+    it's written by the run() task every `flush_interval` seconds or when it's bigger than `buffer_size`.
+    The file is rotated by size into path.1 ... path.{keep}. Shards write own journals, path.shardN.
+    """
+    buffer_size = 64 * 1024
+
+    def __init__(self, path: str, max_size: int = 64 * 1024 * 1024, keep: int = 5, flush_interval: float = 1):
+        self.path = path
+        self.max_size = max_size
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.names: dict[str, int] = dict()
+        self.file = open(path, 'ab')  # pylint: disable=consider-using-with
+        self.size = self.file.tell()
+        self.table: Optional['StateTable'] = None
+
+    def listen(self, table: 'StateTable'):
+        """Records changes of `table` until close()"""
+        self.table = table
+        table.listeners.append(self.changed)
+
+    def close(self):
+        if self.table and self.changed in self.table.listeners:
+            self.table.listeners.remove(self.changed)
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def name(self, value: str) -> int:
+        """Ids are valid within a file, a reader remembers the last definition of every id"""
+        if (name_id := self.names.get(value)) is None:
+            name_id = self.names[value] = len(self.names)
+            encoded = value.encode()
+            self.buffer += HEADER.pack(time.time(), NAME, name_id, 0, len(encoded))
+            self.buffer += encoded
+        return name_id
+
+    def record(self, kind: int, device: str, key: str, value: bytes):
+        if len(self.names) > MAX_NAMES - 2:
+            self.rotate()
+        device_id, key_id = self.name(device), self.name(key)
+        self.buffer += HEADER.pack(time.time(), kind, device_id, key_id, len(value))
+        self.buffer += value
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def received(self, device: str, topic: str, payload: bytes):
+        self.record(RECEIVED, device, topic, payload)
+
+    def published(self, device: str, sub_topic: str, payload):
+        self.record(PUBLISH, device, sub_topic, json.dumps(payload, default=str).encode())
+
+    def changed(self, _: int, field: str, device: str, sub_topic: str, value):
+        """StateTable listener"""
+        self.record(KIND_IDS[field], device, sub_topic, json.dumps(value, default=str).encode())
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.size += len(self.buffer)
+        self.buffer.clear()
+        if self.size >= self.max_size:
+            self.rotate()
+
+    def rotate(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.close()
+        for index in range(self.keep - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        os.replace(self.path, f'{self.path}.1')
+        self.file = open(self.path, 'ab')  # pylint: disable=consider-using-with
+        self.size = 0
+        self.names.clear()
+        log.info('Rotated journal %s', self.path)
+
+    async def run(self):
+        """Eternal task, the buffer is written on cancel too"""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            self.close()
+
+
+def files(path: str) -> list[str]:
+    """Rotated files from the oldest one"""
+    rotated = []
+    index = 1
+    while os.path.exists(f'{path}.{index}'):
+        rotated.append(f'{path}.{index}')
+        index += 1
+    return [*reversed(rotated), *([path] if os.path.exists(path) else [])]
+
+
+def shard_paths(path: str) -> list[str]:
+    """The journal and the journals of shards"""
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r'\.shard\d+')
+    shards = sorted(item for item in os.listdir(directory or '.') if pattern.fullmatch(item))
+    return [path, *(os.path.join(directory, item) for item in shards)]
+
+
+def read_file(path: str) -> Iterator[Entry]:
+    """Memory-mapped reader, a record truncated by a crash ends the file"""
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            names: dict[int, str] = dict()
+            offset, end = 0, len(data)
+            while offset + HEADER.size <= end:
+                at, kind, device_id, key_id, length = HEADER.unpack_from(data, offset)
+                offset += HEADER.size
+                if offset + length > end:
+                    log.warning('Truncated record at the end of %s', path)
+                    return
+                value = data[offset:offset + length]
+                offset += length
+                if kind == NAME:
+                    names[device_id] = value.decode()
+                    continue
+                yield Entry(at, KINDS[kind], names[device_id], names[key_id], value)
+
+
+def read(path: str, devices: Optional[Iterable[str]] = None, since: Optional[float] = None,
+         until: Optional[float] = None, kinds: Optional[Iterable[str]] = None) -> Iterator[Entry]:
+    """Entries of the journal and its rotated files filtered by devices, [since, until) and kinds"""
+    devices, kinds = devices and set(devices), kinds and set(kinds)
+    for file in files(path):
+        for entry in read_file(file):
+            if devices and entry.device not in devices or kinds and entry.kind not in kinds:
+                continue
+            if since is not None and entry.at < since or until is not None and entry.at >= until:
+                continue
+            yield entry
+
+
+def read_all(paths: list[str], devices: Optional[Iterable[str]] = None, since: Optional[float] = None,
+             until: Optional[float] = None, kinds: Optional[Iterable[str]] = None) -> Iterator[Entry]:
+    """Entries of several journals (shards) merged by time"""
+    devices, kinds = devices and set(devices), kinds and set(kinds)
+    return heapq.merge(*(read(path, devices, since, until, kinds) for path in paths), key=lambda entry: entry.at)
+
+
+def main(args, config, client_map):
+    """`config` is parsed ConfigParser of args.config"""
+    since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+    until = datetime.fromisoformat(args.until).timestamp() if args.until else None
+    entries = read_all(args.journal, args.device, since, until, args.kind)
+    if args.replay == 'bench':
+        from mqtt_automator.bench.runner import replay  # pylint: disable=import-outside-toplevel
+        for key, value in replay(config, entries).items():
+            print(f'{key}: {value}')
+        return
+    if args.replay == 'simulate':
+        from mqtt_automator.simulator import compare  # pylint: disable=import-outside-toplevel
+        compare(config, entries, client_map)
+        return
+    for entry in entries:
+        print(f'{datetime.fromtimestamp(entry.at):%Y-%m-%d %H:%M:%S.%f} {entry.kind:12} {entry.device} '
+              f'{entry.key} {entry.decoded()}')
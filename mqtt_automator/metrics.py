@@ -0,0 +1,192 @@
+from bisect import bisect_left
+from typing import Iterable
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def escape(value: str) -> str:
+    """
+    >>> escape('climate/lytko/"1"/state')
+    'climate/lytko/\\\\"1\\\\"/state'
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        yield f'{name}{labels} {self.value}'
+
+    def dump(self) -> float:
+        return self.value
+
+    def merge(self, dump: float):
+        self.value += dump
+
+
+class HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        cumulative, prefix = 0, labels[:-1] + ',' if labels else '{'
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{prefix}le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{labels} {self.sum}'
+        yield f'{name}_count{labels} {self.count}'
+
+    def dump(self) -> tuple[list[int], float, int]:
+        return self.counts, self.sum, self.count
+
+    def merge(self, dump: tuple[list[int], float, int]):
+        counts, total, count = dump
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+
+class Metric:
+    """
+    Prometheus metric family. Children are created once by labels() and should be kept by the caller,
+    so recording an event is an attribute update without allocations.
+    >>> published = Metric('published_total', 'Published messages', 'counter', ('vendor',))
+    >>> published.labels('vakio').inc()
+    >>> print(published.render())
+    # HELP published_total Published messages
+    # TYPE published_total counter
+    published_total{vendor="vakio"} 1.0
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.documentation, self.kind = name, documentation, kind
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.children: dict[tuple[str, ...], CounterValue | HistogramValue] = dict()
+        if not labelnames:
+            self.default = self.labels()
+
+    def labels(self, *values: str) -> CounterValue | HistogramValue:
+        if (child := self.children.get(values)) is None:
+            child = HistogramValue(self.buckets) if self.kind == 'histogram' else CounterValue()
+            self.children[values] = child
+        return child
+
+    def inc(self, amount: float = 1):
+        self.default.inc(amount)
+
+    def set(self, value: float):
+        self.default.set(value)
+
+    def observe(self, value: float):
+        self.default.observe(value)
+
+    def dump(self) -> dict:
+        return {values: child.dump() for values, child in self.children.items()}
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self.children.items()):
+            labels = ','.join(f'{key}="{escape(str(value))}"' for key, value in zip(self.labelnames, values))
+            lines.extend(child.samples(self.name, '{' + labels + '}' if labels else ''))
+        return '\n'.join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = dict()
+
+    def add(self, name: str, documentation: str, kind: str, labelnames: tuple[str, ...] = (), **kwargs) -> Metric:
+        self.metrics[name] = Metric(name, documentation, kind, labelnames, **kwargs)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+    def dump(self) -> dict[str, dict]:
+        """Picklable values of all metrics, see merged()"""
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def merged(self, dumps: Iterable[dict[str, dict]]) -> 'Registry':
+        """
+        New registry with the same metrics summing counters and histograms of dumps made in other processes,
+        gauges are states, not sums: the last dump having a label set wins
+        >>> shard = Registry()
+        >>> shard.add('messages_total', 'Received messages', 'counter').inc(2)
+        >>> shard.add('online', 'Device is online', 'gauge', ('device',)).labels('cabinet').set(1)
+        >>> lines = shard.merged([shard.dump(), shard.dump()]).render().splitlines()
+        >>> lines[2], lines[5]
+        ('messages_total 4.0', 'online{device="cabinet"} 1')
+        """
+        merged = Registry()
+        for name, metric in self.metrics.items():
+            merged.add(name, metric.documentation, metric.kind, metric.labelnames, buckets=metric.buckets)
+        for dump in dumps:
+            for name, children in dump.items():
+                if target := merged.metrics.get(name):
+                    for values, value in children.items():
+                        if target.kind == 'gauge':
+                            target.labels(*values).set(value)
+                        else:
+                            target.labels(*values).merge(value)
+        return merged
+
+
+registry = Registry()
+
+tick_duration = registry.add('mqtt_automator_tick_duration_seconds', 'Scheduler tick duration', 'histogram')
+tick_lag = registry.add('mqtt_automator_tick_lag_seconds', 'Delay of tick start after planned time', 'histogram')
+rules_evaluated = registry.add('mqtt_automator_rules_evaluated_total', 'Rules and sub-rules evaluated', 'counter')
+rules_matched = registry.add('mqtt_automator_rules_matched_total', 'Rules and sub-rules matched', 'counter')
+feedback_messages = registry.add(
+    'mqtt_automator_feedback_messages_total', 'Received messages', 'counter', ('vendor', 'topic'))
+feedback_unchanged = registry.add(
+    'mqtt_automator_feedback_unchanged_total', 'Received messages skipped because payload is not changed', 'counter',
+    ('vendor',))
+ingest_coalesced = registry.add(
+    'mqtt_automator_ingest_coalesced_total', 'Received messages replaced by a newer one before handling', 'counter')
+ingest_dropped = registry.add(
+    'mqtt_automator_ingest_dropped_total', 'Received messages dropped because ingest buffer was full', 'counter')
+decode_failures = registry.add(
+    'mqtt_automator_decode_failures_total', 'Received messages device client failed to parse', 'counter', ('vendor',))
+publish_latency = registry.add(
+    'mqtt_automator_publish_latency_seconds', 'Duration of publishes to devices', 'histogram', ('vendor',))
+publish_skipped = registry.add(
+    'mqtt_automator_publish_skipped_total', 'Publishes skipped by state-match, manual-override block or offline device',
+    'counter', ('vendor', 'reason'))
+device_online = registry.add(
+    'mqtt_automator_device_online', 'Device availability, 0 while writes are skipped', 'gauge', ('vendor', 'device'))
+shard_restarts = registry.add(
+    'mqtt_automator_shard_restarts_total', 'Restarts of crashed shard worker processes', 'counter', ('shard',))
+api_subscribers_dropped = registry.add(
+    'mqtt_automator_api_subscribers_dropped_total', 'Event stream subscribers disconnected for being slow', 'counter')
+mqtt_reconnects = registry.add(
+    'mqtt_automator_mqtt_reconnects_total', 'Reconnects to MQTT-broker', 'counter', ('broker',))
+loop_lag = registry.add(
+    'mqtt_automator_event_loop_lag_seconds', 'Delay of event loop wake-ups after planned time', 'histogram', ('loop',))
+loop_stalls = registry.add(
+    'mqtt_automator_event_loop_stalls_total', 'Event loop blocked longer than app.watchdog_threshold', 'counter')
+handler_duration = registry.add(
+    'mqtt_automator_handler_duration_seconds', 'Time handlers block event loop: receive, publish and tick',
+    'histogram', ('handler',))
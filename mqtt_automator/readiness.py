@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Startup barrier: tracks which subscribed topics have delivered their retained message.
+    Topic filters with wildcards can't be tracked and are not expected. Topics are tracked per broker.
+    """
+
+    def __init__(self):
+        self.expected: dict[tuple[str, str], object] = dict()  # (broker, topic) -> device client
+        self.ready = asyncio.Event()
+        self.created_at = time.monotonic()
+
+    def expect(self, topic: str, device_client, broker: str = 'default'):
+        if '+' in topic or '#' in topic:
+            return
+        self.expected[broker, topic] = device_client
+        self.ready.clear()
+
+    def seen(self, topic: str, broker: str = 'default'):
+        if self.expected and self.expected.pop((broker, topic), None) is not None and not self.expected:
+            self.ready.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Returns False if some devices haven't reported in `timeout` seconds"""
+        if not self.expected:
+            return True
+        log.info('Waiting up to %.1f seconds for %d topics to init state', timeout, len(self.expected))
+        try:
+            async with asyncio.timeout(timeout):
+                await self.ready.wait()
+        except TimeoutError:
+            devices = sorted({str(device_client) for device_client in self.expected.values()})
+            log.warning('%d devices never reported: %s', len(devices), ', '.join(devices))
+            return False
+        log.info('State of all devices initialized in %.1f seconds', time.monotonic() - self.created_at)
+        return True
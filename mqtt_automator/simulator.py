@@ -0,0 +1,141 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, NamedTuple, Union
+
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.config.schedule import CompiledRule
+from mqtt_automator.devices.base import BaseClient
+from mqtt_automator.journal import Entry
+
+log = logging.getLogger(__name__)
+
+
+class Publish(NamedTuple):
+    at: datetime
+    device: str
+    sub_topic: str
+    payload: object
+
+
+class Simulator:
+    """
+    Replays the schedule of a config in virtual time without broker and devices.
+    Rules are evaluated only at schedule transitions and only for devices whose rules or sub-rules changed there,
+    there is no feedback, so other devices would be skipped by state-match anyway.
+    Actions of a tick are merged per device like outboxes do and pass through the same state-match
+    as BaseClient.publish, so the timeline has only real publishes. Manual-override blocks never happen.
+    `parents_alive` is the value of `icmp` payloads.
+    """
+
+    def __init__(self, config: ConfigParser, client_map: dict[str, type[BaseClient]], parents_alive: bool = True):
+        self.config = config
+        self.clients = {device.name: client_map[device.vendor](device) for device in config.get_devices()}
+        self.order = {device: index for index, device in enumerate(self.clients)}
+        self.parents_alive = parents_alive
+        self.ticks = 0
+
+    def run(self, start: datetime, end: datetime) -> Iterator[Publish]:
+        schedule = self.config.schedule
+        active: dict[str, dict[int, CompiledRule]] = {device: dict() for device in self.clients}
+        with_sub_rules: set[int] = set()
+        previous: set[int] = set()
+        now = start
+        while now < end:
+            self.ticks += 1
+            current = set(schedule.indexes[schedule.position(now)])
+            affected = set()
+            for index in previous - current:
+                rule = schedule.rules[index]
+                active.get(rule.device, dict()).pop(index, None)
+                with_sub_rules.discard(index)
+                affected.add(rule.device)
+            for index in current - previous:
+                rule = schedule.rules[index]
+                if rule.device in active:
+                    active[rule.device][index] = rule
+                if rule.sub_rules:
+                    with_sub_rules.add(index)
+                affected.add(rule.device)
+            minute_of_day = now.hour * 60 + now.minute
+            affected.update(schedule.rules[index].device for index in with_sub_rules
+                            if minute_of_day in schedule.rules[index].sub_rule_edges)
+            previous = current
+
+            for device in sorted(affected & active.keys(), key=self.order.__getitem__):
+                yield from self.tick(now, device, [active[device][index] for index in sorted(active[device])])
+            now = schedule.next_transition(now)
+
+    def tick(self, now: datetime, device: str, rules: list[CompiledRule]) -> Iterator[Publish]:
+        items = dict()
+        for rule in rules:
+            items.update(rule.action)
+            for _, sub_rule in rule.get_active_sub_rules(now.hour, now.minute):
+                items.update(sub_rule['action'])
+
+        client = self.clients[device]
+        for sub_topic, payload in items.items():
+            payload = client.normalize(payload)
+            if payload == 'icmp':
+                payload = self.parents_alive
+            if client.state.get(sub_topic) == payload:
+                continue
+            client.state[sub_topic] = payload
+            yield Publish(now, device, sub_topic, payload)
+
+    def explain(self, now: datetime, device: str, sub_topic: str) -> list[tuple[str, object]]:
+        """Rules and sub-rules setting the sub-topic of the device at `now` with their payloads, the last one wins"""
+        client, found = self.clients[device], []
+        for rule in self.config.schedule.active(now):
+            if rule.device != device:
+                continue
+            if sub_topic in rule.action:
+                found.append((rule.name, client.normalize(rule.action[sub_topic])))
+            for name, sub_rule in rule.get_active_sub_rules(now.hour, now.minute):
+                if sub_topic in sub_rule['action']:
+                    found.append((f'{rule.name}/{name}', client.normalize(sub_rule['action'][sub_topic])))
+        return found
+
+
+def timeline(publishes: Iterator[Publish]) -> dict[str, list[Publish]]:
+    devices: dict[str, list[Publish]] = dict()
+    for publish in publishes:
+        devices.setdefault(publish.device, []).append(publish)
+    return devices
+
+
+def compare(config: Union[str, ConfigParser], entries: Iterable[Entry], client_map: dict[str, type[BaseClient]]):
+    """Prints journaled publishes with the rules which wanted them, `!` marks publishes the schedule didn't want"""
+    simulator = Simulator(ConfigParser(config) if isinstance(config, str) else config, client_map)
+    mismatches = total = 0
+    for entry in entries:
+        if entry.kind != 'publish' or entry.device not in simulator.clients:
+            continue
+        at, payload = datetime.fromtimestamp(entry.at), entry.decoded()
+        rules = simulator.explain(at, entry.device, entry.key)
+        wanted = rules[-1][1] if rules else None
+        total += 1
+        mark = wanted != simulator.clients[entry.device].normalize(payload)
+        mismatches += mark
+        reason = ', '.join(f'{name}={value}' for name, value in rules) or 'no rule'
+        print(f'{"!" if mark else " "} {at:%a %Y-%m-%d %H:%M:%S} {entry.device} {entry.key} {payload} <- {reason}')
+    print(f'{total} publishes, {mismatches} not wanted by the schedule')
+
+
+def main(args, client_map: dict[str, type[BaseClient]]):
+    logging.basicConfig(level=logging.WARNING)
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now().replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    simulator = Simulator(ConfigParser(args.config), client_map, parents_alive=not args.parents_offline)
+    started_at = time.perf_counter()
+    devices = timeline(simulator.run(start, start + timedelta(days=args.days)))
+    duration = time.perf_counter() - started_at
+
+    for device, publishes in devices.items():
+        if args.device and device not in args.device:
+            continue
+        print(f'{device}:')
+        for publish in publishes:
+            print(f'  {publish.at:%a %Y-%m-%d %H:%M} {publish.sub_topic} {publish.payload}')
+    print(f'Simulated {args.days} days of {len(simulator.clients)} devices in {simulator.ticks} ticks, '
+          f'{sum(map(len, devices.values()))} publishes, {duration * 1000:.1f} ms')
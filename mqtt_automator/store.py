@@ -0,0 +1,103 @@
+import abc
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+DELETED = object()
+
+
+class BaseStore(abc.ABC):
+    """
+    Persistent storage of BaseClient.state and BaseClient.block.
+    put() only marks the value dirty, so it's cheap enough for the message handling hot path,
+    dirty values are written in a single batch every `interval` seconds and on shutdown (write-behind).
+    """
+
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self.dirty: dict[tuple[str, str, str], object] = dict()
+        self.lock = threading.Lock()
+
+    def put_state(self, device: str, sub_topic: str, value):
+        self.dirty[(device, 'state', sub_topic)] = value
+
+    def clear_state(self, device: str, sub_topics):
+        for sub_topic in sub_topics:
+            self.dirty[(device, 'state', sub_topic)] = DELETED
+
+    def put_block(self, device: str, sub_topic: str, blocked_at: datetime | None):
+        self.dirty[(device, 'block', sub_topic)] = DELETED if blocked_at is None else blocked_at.timestamp()
+
+    def load(self) -> dict[str, dict[str, dict]]:
+        """Returns {device: {'state': {sub_topic: value}, 'block': {sub_topic: datetime}}}"""
+        snapshot = dict()
+        for device, kind, sub_topic, value in self.read():
+            if kind == 'block':
+                value = datetime.fromtimestamp(value)
+            snapshot.setdefault(device, {'state': dict(), 'block': dict()})[kind][sub_topic] = value
+        return snapshot
+
+    async def run(self):
+        """Eternal task, writes happen in a thread to keep disk I/O out of the event loop"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                items, self.dirty = self.dirty, dict()
+                if items:
+                    await asyncio.to_thread(self.flush, items)
+        finally:
+            self.flush(self.dirty)
+            with self.lock:
+                self.close()
+
+    def flush(self, items: dict):
+        with self.lock:
+            self.write(items)
+        log.debug('Flushed %d changes', len(items))
+
+    @abc.abstractmethod
+    def read(self):
+        """Yields tuple(device, kind, sub_topic, value) for every stored value"""
+
+    @abc.abstractmethod
+    def write(self, items: dict[tuple[str, str, str], object]):
+        """Writes a batch of changes, DELETED value means the key should be removed"""
+
+    def close(self):
+        pass
+
+
+class SQLiteStore(BaseStore):
+    def __init__(self, path: str, interval: float = 5):
+        import sqlite3  # pylint: disable=import-outside-toplevel  # only when state_file is set
+        super().__init__(interval)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            'device TEXT, kind TEXT, sub_topic TEXT, value TEXT, PRIMARY KEY (device, kind, sub_topic)'
+            ') WITHOUT ROWID'
+        )
+
+    def read(self):
+        for device, kind, sub_topic, value in self.db.execute('SELECT device, kind, sub_topic, value FROM state'):
+            yield device, kind, sub_topic, json.loads(value)
+
+    def write(self, items: dict[tuple[str, str, str], object]):
+        with self.db:
+            self.db.executemany(
+                'DELETE FROM state WHERE device = ? AND kind = ? AND sub_topic = ?',
+                [key for key, value in items.items() if value is DELETED]
+            )
+            self.db.executemany(
+                'INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)',
+                [(*key, json.dumps(value)) for key, value in items.items() if value is not DELETED]
+            )
+
+    def close(self):
+        self.db.close()
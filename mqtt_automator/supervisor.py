@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Optional
+
+from mqtt_automator import metrics
+from mqtt_automator.automator import LOG_FORMAT, Automator
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.watchdog import run_loop
+from mqtt_automator.web import Request, Response, WebServer
+
+log = logging.getLogger(__name__)
+
+
+async def report(automator: Automator, connection: Connection):
+    """Sends metrics and state snapshot of the shard to Supervisor"""
+    while True:
+        connection.send((metrics.registry.dump(), automator.snapshot()))
+        await asyncio.sleep(automator.config.settings.shard_report_interval)
+
+
+async def serve_shard(file_name: str, shard: int, connection: Connection, cache: Optional[str]):
+    automator = Automator(file_name, shard, cache)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    reporter = asyncio.create_task(report(automator, connection))
+    try:
+        await automator.run()
+    finally:
+        reporter.cancel()
+
+
+def run_shard(file_name: str, shard: int, connection: Connection, cache: Optional[str] = None,
+              event_loop: str = 'asyncio'):
+    """Entry point of a worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by Supervisor
+    run_loop(serve_shard(file_name, shard, connection, cache), event_loop)
+
+
+class Supervisor:
+    """
+    Splits devices into `app.shards` worker processes, each of them is an Automator with own broker connection,
+    subscriptions and scheduler (see ConfigParser.owns). Crashed workers are restarted with exponential delay,
+    metrics and state snapshots reported by workers are merged and served on metrics_port.
+    """
+    min_restart_delay = 1
+    max_restart_delay = 60
+
+    def __init__(self, config: ConfigParser):
+        self.config = config
+        self.context = multiprocessing.get_context('spawn')
+        self.processes: dict[int, BaseProcess] = dict()
+        self.reports: dict[int, tuple[dict, dict]] = dict()
+
+    async def run(self):
+        settings = self.config.settings
+        logging.basicConfig(
+            level=logging.getLevelName(settings.log_level),
+            format='[supervisor] ' + LOG_FORMAT
+        )
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.signal, signal.SIGHUP)
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        log.info('Starting %d shards by %s', settings.shards, settings.shard_by)
+        if settings.api_port:
+            log.warning('Control API is not served with %d shards, api_port is ignored', settings.shards)
+        tasks = [asyncio.create_task(self.supervise(shard)) for shard in range(settings.shards)]
+        if settings.metrics_port:
+            server = WebServer({('GET', '/metrics'): self.serve_metrics, ('GET', '/snapshot'): self.serve_snapshot})
+            tasks.append(asyncio.create_task(server.serve(settings.metrics_host, settings.metrics_port)))
+        try:
+            await asyncio.wait(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def signal(self, signum: int):
+        """Workers reload config themselves, changed number of shards requires restart"""
+        for process in self.processes.values():
+            if process.pid:
+                os.kill(process.pid, signum)
+
+    async def supervise(self, shard: int):
+        delay = self.min_restart_delay
+        while True:
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(
+                target=run_shard,
+                args=(self.config.file_name, shard, sender, self.config.cache, self.config.settings.event_loop),
+                name=f'mqtt-automator-shard{shard}', daemon=True,
+            )
+            process.start()
+            sender.close()
+            self.processes[shard] = process
+            started_at = time.monotonic()
+            try:
+                await self.follow(shard, process, receiver)
+            except asyncio.CancelledError:
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+                raise
+            finally:
+                receiver.close()
+
+            metrics.shard_restarts.labels(str(shard)).inc()
+            delay = self.min_restart_delay if time.monotonic() - started_at > self.max_restart_delay else delay
+            log.error('Shard %d exited with code %s, restarting in %d seconds', shard, process.exitcode, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    async def follow(self, shard: int, process: BaseProcess, receiver: Connection):
+        """Collects reports of the worker until it exits"""
+        loop = asyncio.get_running_loop()
+        exited = asyncio.Event()
+
+        def receive():
+            try:
+                while receiver.poll():
+                    self.reports[shard] = receiver.recv()
+            except (EOFError, OSError):
+                loop.remove_reader(receiver.fileno())
+
+        loop.add_reader(receiver.fileno(), receive)
+        loop.add_reader(process.sentinel, exited.set)
+        try:
+            await exited.wait()
+        finally:
+            loop.remove_reader(process.sentinel)
+            loop.remove_reader(receiver.fileno())
+        process.join()
+
+    def registry(self) -> metrics.Registry:
+        return metrics.registry.merged([metrics.registry.dump(), *(dump for dump, _ in self.reports.values())])
+
+    def snapshot(self) -> dict:
+        """State of devices of all shards as of their last reports"""
+        return {name: state for _, snapshot in self.reports.values() for name, state in snapshot.items()}
+
+    async def serve_metrics(self, _: Request) -> Response:
+        return Response(body=self.registry().render().encode(), content_type='text/plain; version=0.0.4')
+
+    async def serve_snapshot(self, _: Request) -> Response:
+        return Response(body=json.dumps(self.snapshot(), default=str).encode(), content_type='application/json')
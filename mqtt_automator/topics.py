@@ -0,0 +1,86 @@
+from typing import Any
+
+
+class Node:
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children: dict[str, Node] = dict()
+        self.values: list = []
+
+
+class TopicTrie:
+    """
+    Routes topic names of received messages to values registered under MQTT topic filters (`+` and `#` are supported).
+    Results are cached per topic name, so the trie is walked once per distinct topic.
+    >>> trie = TopicTrie()
+    >>> trie.insert('climate/lytko/+/state', 'lytko')
+    >>> trie.insert('cabinet/speed', 'vakio')
+    >>> trie.insert('#', 'all')
+    >>> trie.match('climate/lytko/12345/state')
+    ('lytko', 'all')
+    >>> trie.match('cabinet/state')
+    ('all',)
+    >>> trie.remove('#', 'all')
+    >>> trie.match('cabinet/speed')
+    ('vakio',)
+    """
+    max_cached = 10000
+
+    def __init__(self):
+        self.root = Node()
+        self.cache: dict[str, tuple] = dict()
+
+    def __len__(self):
+        return sum(len(node.values) for node in self.nodes())
+
+    def nodes(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def insert(self, topic_filter: str, value: Any):
+        node = self.root
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, Node())
+        node.values.append(value)
+        self.cache.clear()
+
+    def remove(self, topic_filter: str, value: Any):
+        path = [self.root]
+        for level in topic_filter.split('/'):
+            if level not in path[-1].children:
+                return
+            path.append(path[-1].children[level])
+        if value in path[-1].values:
+            path[-1].values.remove(value)
+        for level, parent, node in zip(reversed(topic_filter.split('/')), reversed(path[:-1]), reversed(path[1:])):
+            if node.values or node.children:
+                break
+            del parent.children[level]
+        self.cache.clear()
+
+    def match(self, topic: str) -> tuple:
+        if (cached := self.cache.get(topic)) is not None:
+            return cached
+        if len(self.cache) >= self.max_cached:
+            self.cache.clear()
+        matched = []
+        self._match(self.root, topic.split('/'), 0, matched)
+        self.cache[topic] = result = tuple(matched)
+        return result
+
+    def _match(self, node: Node, levels: list[str], depth: int, matched: list):
+        """Wildcards don't match topics starting with `$` like $SYS"""
+        wildcards = depth or not levels[0].startswith('$')
+        if depth == len(levels):
+            matched.extend(node.values)
+        else:
+            if (child := node.children.get(levels[depth])) is not None:
+                self._match(child, levels, depth + 1, matched)
+            if wildcards and '+' in node.children:
+                self._match(node.children['+'], levels, depth + 1, matched)
+        if wildcards and '#' in node.children:
+            matched.extend(node.children['#'].values)
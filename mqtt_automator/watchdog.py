@@ -0,0 +1,136 @@
+import asyncio
+import importlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Coroutine, Optional
+
+from mqtt_automator import metrics
+
+log = logging.getLogger(__name__)
+
+
+def loop_factory(name: str) -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+    """
+    Factory of app.event_loop, None is the default asyncio loop, uvloop is optional
+    >>> loop_factory('asyncio') is None
+    True
+    """
+    if name == 'uvloop':
+        try:
+            return importlib.import_module('uvloop').new_event_loop
+        except ImportError:
+            log.warning('uvloop is not installed, using asyncio event loop')
+    return None
+
+
+def run_loop(main: Coroutine, event_loop: str = 'asyncio'):
+    """asyncio.run() with the event loop of app.event_loop"""
+    with asyncio.Runner(loop_factory=loop_factory(event_loop)) as runner:
+        return runner.run(main)
+
+
+class Timed:
+    """Awaitable running a coroutine step by step, only time spent inside the steps blocks the event loop"""
+    __slots__ = ('watchdog', 'handler', 'name', 'coroutine')
+
+    def __init__(self, watchdog: 'Watchdog', handler: str, name: str, coroutine: Coroutine):
+        self.watchdog = watchdog
+        self.handler = handler
+        self.name = name
+        self.coroutine = coroutine
+
+    def __await__(self):
+        watchdog, value, error, blocked = self.watchdog, None, None, 0.0
+        try:
+            while True:
+                watchdog.handler = self.handler, self.name
+                started_at = time.perf_counter()
+                try:
+                    future = self.coroutine.send(value) if error is None else self.coroutine.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    blocked += time.perf_counter() - started_at
+                    watchdog.handler = None
+                try:
+                    value, error = (yield future), None
+                except BaseException as exception:  # pylint: disable=broad-exception-caught
+                    value, error = None, exception  # cancellation and timeouts are passed to the coroutine
+        finally:
+            watchdog.observe(self.handler, self.name, blocked)
+
+
+class Watchdog:
+    """
+    Everything shares one event loop thread, so a blocking call in any handler delays feedback and scheduler.
+    run() measures event loop lag: it sleeps `interval` seconds and observes how late it wakes up.
+    A thread checks the same deadline and when the loop is blocked longer than `threshold`, it logs the stack
+    of the event loop thread while it's still blocked, once per stall.
+    Handlers are timed by start()/finish() or timed() for coroutines, durations are observed per handler
+    and the ones longer than `threshold` are logged with the device, the stall log names the running handler too.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.5):
+        self.threshold = threshold
+        self.interval = interval
+        self.handler: Optional[tuple[str, str]] = None  # handler and device being run
+        self.expected = time.monotonic() + interval  # time lag probe should wake up at
+        self.durations: dict[str, metrics.HistogramValue] = dict()
+        self.stalls = 0
+
+    def start(self, handler: str, name: str) -> float:
+        self.handler = handler, name
+        return time.perf_counter()
+
+    def finish(self, started_at: float):
+        handler, name = self.handler
+        self.handler = None
+        self.observe(handler, name, time.perf_counter() - started_at)
+
+    def timed(self, handler: str, name: str, coroutine: Coroutine) -> Timed:
+        return Timed(self, handler, name, coroutine)
+
+    def observe(self, handler: str, name: str, duration: float):
+        if (histogram := self.durations.get(handler)) is None:
+            histogram = self.durations[handler] = metrics.handler_duration.labels(handler)
+        histogram.observe(duration)
+        if self.threshold and duration > self.threshold:
+            log.warning('Slow %s of %s blocked event loop for %.3f s', handler, name, duration)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        lag = metrics.loop_lag.labels(type(loop).__module__.split('.')[0])
+        log.info('Watching %s lag, threshold %.3f s', type(loop).__name__, self.threshold)
+        stopped = threading.Event()
+        self.expected = time.monotonic() + self.interval
+        thread = threading.Thread(target=self.sample, args=(threading.get_ident(), stopped), name='watchdog',
+                                  daemon=True)
+        thread.start()
+        try:
+            while True:
+                self.expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                lag.observe(max(0.0, time.monotonic() - self.expected))
+        finally:
+            stopped.set()
+
+    def sample(self, thread_id: int, stopped: threading.Event):
+        """Runs in a daemon thread"""
+        stalled = False
+        while not stopped.wait(self.threshold / 4):
+            blocked = time.monotonic() - self.expected
+            if blocked < self.threshold:
+                stalled = False
+                continue
+            if stalled:
+                continue
+            stalled = True
+            self.stalls += 1
+            metrics.loop_stalls.inc()
+            frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+            handler = ' in {} of {}'.format(*running) if (running := self.handler) else ''
+            log.warning('Event loop is blocked for %.3f s%s, stack:\n%s', blocked, handler,
+                        ''.join(traceback.format_stack(frame)) if frame else 'unknown')
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, Awaitable, Callable, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: dict[str, list[str]]
+    headers: dict[str, str]
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'text/plain; charset=utf-8'
+    headers: Optional[dict[str, str]] = None
+    stream: Optional[AsyncGenerator[bytes, None]] = None  # written chunk by chunk until exhausted instead of body
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class WebServer:
+    """Minimal HTTP/1.1 server for local endpoints: one request per connection, routes by exact path"""
+    max_body = 64 * 1024
+
+    def __init__(self, routes: dict[tuple[str, str], Handler]):
+        self.routes = routes
+
+    async def serve(self, host: str, port: int):
+        """Eternal task"""
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info('Listening on %s:%d', host, port)
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader) -> Request:
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = dict()
+        while (line := (await reader.readline()).decode('latin-1').strip()):
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = min(int(headers.get('content-length', 0)), WebServer.max_body)
+        body = await reader.readexactly(length) if length else b''
+        url = urlsplit(target)
+        return Request(method, url.path, parse_qs(url.query), headers, body)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await self.read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                response = Response(400, b'Bad request\n')
+            else:
+                response = await self.dispatch(request)
+            head = [f'HTTP/1.1 {response.status} {REASONS.get(response.status, "")}',
+                    f'Content-Type: {response.content_type}',
+                    'Connection: close']
+            if response.stream is None:
+                head.append(f'Content-Length: {len(response.body)}')
+            head.extend(f'{key}: {value}' for key, value in (response.headers or dict()).items())
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body)
+            await writer.drain()
+            if response.stream is not None:
+                await self.write_stream(response.stream, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def write_stream(stream: AsyncGenerator[bytes, None], writer: asyncio.StreamWriter):
+        try:
+            async for chunk in stream:
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            await stream.aclose()
+
+    async def dispatch(self, request: Request) -> Response:
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return Response(405, b'Method not allowed\n')
+            return Response(404, b'Not found\n')
+        try:
+            return await handler(request)
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.exception('Failed to handle %s %s', request.method, request.path)
+            return Response(500, b'Internal server error\n')
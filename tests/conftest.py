@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import pytest
+import yaml
+from aiomqtt import MqttError
+
+from mqtt_automator.config.parser import ConfigParser
+
+
+class FakeMqttClient:
+    """Connected aiomqtt client, set it as `broker.connection.client`"""
+
+    def __init__(self):
+        self.published: list[tuple[str, object]] = []
+        self.failing = False
+
+    async def publish(self, topic: str, payload):
+        if self.failing:
+            raise MqttError('Disconnected')
+        self.published.append((topic, payload))
+
+
+@pytest.fixture(autouse=True)
+def set_cwd():
+    cwd = Path('.').absolute()
+    if cwd.name == 'tests':
+        os.chdir(cwd.parent)
+
+
+@pytest.fixture
+def config():
+    return ConfigParser('examples/config_example.yml')
+
+
+@pytest.fixture
+def config_file(tmp_path) -> Path:
+    """Copy of examples/config_example.yml, see edit_config"""
+    path = tmp_path / 'config.yml'
+    path.write_text(Path('examples/config_example.yml').read_text('utf-8'), 'utf-8')
+    return path
+
+
+@pytest.fixture
+def edit_config(config_file) -> Callable[..., str]:
+    """
+    edit_config(change, **app) passes parsed config_file to `change`, updates `app` section with keyword arguments
+    and returns the path. Modification time is reset, so Automator notices the change.
+    """
+    def edit(change: Optional[Callable[[dict], None]] = None, **app) -> str:
+        config = yaml.load(config_file.read_text('utf-8'), yaml.SafeLoader)
+        if change:
+            change(config)
+        config['app'] = config.get('app', dict()) | app
+        config_file.write_text(yaml.dump(config), 'utf-8')
+        os.utime(config_file, (0, 0))
+        return str(config_file)
+    return edit
+
+
+@pytest.fixture
+def mqtt_client() -> FakeMqttClient:
+    return FakeMqttClient()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from mqtt_automator import metrics
+from mqtt_automator.api import BOOT_ID, ControlApi, Subscriber
+from mqtt_automator.automator import Automator
+from mqtt_automator.web import Request, WebServer
+
+
+async def request(address, method: str, path: str, body: bytes = b'', headers: str = '') -> tuple[int, dict, bytes]:
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(f'{method} {path} HTTP/1.1\r\n{headers}Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    head, _, body = (await reader.read()).partition(b'\r\n\r\n')
+    writer.close()
+    status, *lines = head.decode().split('\r\n')
+    return int(status.split()[1]), dict(line.split(': ', 1) for line in lines), body
+
+
+def test_state_etag_and_commands(mqtt_client):
+    async def scenario():
+        automator = Automator('examples/config_example.yml')
+        automator.config.broker.connection.client = mqtt_client
+        cabinet = automator.devices['cabinet']
+        server = await asyncio.start_server(WebServer(ControlApi(automator).routes()).handle, '127.0.0.1', 0)
+        address = server.sockets[0].getsockname()
+        async with server:
+            automator.handle('cabinet/speed', b'3')
+            status, headers, body = await request(address, 'GET', '/state')
+            assert status == 200 and json.loads(body)['devices']['cabinet']['state'] == {'speed': 3}
+            etag = headers['ETag']
+            assert etag == f'"{BOOT_ID}-{automator.devices["cabinet"].table.version}"'
+            status, _, body = await request(address, 'GET', '/state', headers=f'If-None-Match: {etag}\r\n')
+            assert status == 304 and body == b''
+
+            command = json.dumps({'device': 'cabinet', 'sub_topic': 'speed', 'payload': 5}).encode()
+            status, _, body = await request(address, 'POST', '/command', command)
+            assert status == 200 and json.loads(body)['published']
+            assert cabinet.state['speed'] == 5 and 'speed' in cabinet.block
+            assert cabinet in automator.dispatcher.workers and mqtt_client.published == [('cabinet/speed', 5)]
+            status, _, body = await request(address, 'POST', '/command', command)
+            assert status == 200 and not json.loads(body)['published'] and not automator.dispatcher.results
+            status, headers, body = await request(address, 'GET', '/state?device=cabinet',
+                                                  headers=f'If-None-Match: {etag}\r\n')
+            assert status == 200 and headers['ETag'] != etag and list(json.loads(body)['devices']) == ['cabinet']
+
+            assert (await request(address, 'POST', '/command', b'{"device": "cabinet"}'))[0] == 400
+            assert (await request(address, 'POST', '/command', command.replace(b'cabinet', b'nope')))[0] == 404
+
+    asyncio.run(scenario())
+
+
+def test_command_is_manual_change_when_skipped_or_late(mqtt_client):
+    async def scenario():
+        automator = Automator('examples/config_example.yml')
+        automator.config.broker.connection.client = mqtt_client
+        automator.config.settings.publish_timeout = 0.05
+        cabinet, api = automator.devices['cabinet'], ControlApi(automator)
+        automator.dispatcher.intervals['vakio'] = 0
+        automator.handle('cabinet/speed', b'3')
+        blocked_at = datetime.now() - timedelta(minutes=5)
+        cabinet.set_block('speed', blocked_at)
+
+        async def command(payload) -> tuple[int, bytes]:
+            body = json.dumps({'device': 'cabinet', 'sub_topic': 'speed', 'payload': payload}).encode()
+            response = await api.serve_command(Request('POST', '/command', dict(), dict(), body))
+            return response.status, response.body
+
+        status, body = await command(3)
+        assert status == 200 and not json.loads(body)['published'] and cabinet.block['speed'] > blocked_at
+        status, body = await command(5)
+        assert json.loads(body)['published'] and mqtt_client.published == [('cabinet/speed', 5)], 'block is not a skip'
+
+        cabinet.mark_offline('test')
+        blocked_at = cabinet.block['speed']
+        assert (await command(4))[0] == 503 and cabinet.block['speed'] == blocked_at
+
+        async def hanging(topic, payload):
+            await asyncio.sleep(1)
+
+        cabinet.mark_online()
+        mqtt_client.publish = hanging
+        assert (await command(4))[0] == 504 and cabinet.block['speed'] > blocked_at
+        for worker in automator.dispatcher.workers.values():
+            worker.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_events_stream_and_slow_subscriber():
+    async def scenario():
+        automator = Automator('examples/config_example.yml')
+        api = ControlApi(automator)
+        api.keepalive = 0.01
+        server = await asyncio.start_server(WebServer(api.routes()).handle, '127.0.0.1', 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(b'GET /events HTTP/1.1\r\n\r\n')
+            await reader.readuntil(b'event: snapshot\n')
+            await reader.readuntil(b'\n\n')
+            automator.handle('climate/lytko/12345/state', json.dumps({'heating': 'off', 'target_temp': 20}).encode())
+            events = [(await reader.readuntil(b'\n\n')).decode().splitlines() for _ in range(2)]
+            assert [(name, json.loads(data[len('data: '):])) for _, name, data, _ in events] == [
+                ('event: state', {'device': 'floor', 'sub_topic': 'mode', 'value': 'off'}),
+                ('event: state', {'device': 'floor', 'sub_topic': 'temperature', 'value': 20}),
+            ]
+            writer.close()
+            await asyncio.sleep(0.1)
+            assert not api.subscribers, 'disconnect is noticed by keepalive'
+
+        slow = api.events(Subscriber(2))
+        assert (await anext(slow)).startswith(b'id: ')
+        dropped = metrics.api_subscribers_dropped.default.value
+        for speed in range(1, 5):
+            automator.handle('cabinet/speed', str(speed).encode())
+        assert metrics.api_subscribers_dropped.default.value == dropped + 1
+        assert not api.subscribers and api.publish not in api.table.listeners
+        with pytest.raises(StopAsyncIteration):
+            await anext(slow)
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.bench.fleet import FakeLamps
+from mqtt_automator.broker import Broker
+from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.vakio import VakioClient
+from mqtt_automator.devices.yeelink import YeelinkClient
+from mqtt_automator.dispatcher import Dispatcher
+from mqtt_automator.store import DELETED, SQLiteStore
+
+
+def test_availability_topic(edit_config):
+    path = edit_config(lambda config: config['lytko']['floor'].update(availability='climate/lytko/12345/availability'))
+
+    async def scenario():
+        automator = Automator(path)
+        floor = automator.devices['floor']
+        assert 'climate/lytko/12345/availability' in automator.config.broker.connection.subscriptions
+        automator.handle('climate/lytko/12345/state', json.dumps({'heating': 'heat', 'target_temp': 23}).encode())
+        assert floor.state == {'mode': 'on', 'temperature': 23}
+
+        automator.handle('climate/lytko/12345/availability', b'offline')
+        assert not floor.availability.online and floor.state == dict()
+        await automator.dispatcher.dispatch({floor: [('temperature', 18)]})
+        assert floor not in automator.dispatcher.workers
+        assert floor.snapshot()['desired'] == {'temperature': 18}
+        assert floor.snapshot()['availability']['reason'] == 'availability topic'
+
+        automator.handle('climate/lytko/12345/state', json.dumps({'heating': 'heat', 'target_temp': 23}).encode())
+        assert not floor.availability.online, 'only availability topic brings the device back'
+        automator.handle('climate/lytko/12345/availability', b'{"state": "online"}')
+        assert floor.availability.online and automator.recovered == {floor}
+
+    asyncio.run(scenario())
+
+
+def test_unreachable_lamp_is_skipped_until_backoff_expires():
+    async def scenario():
+        lamps = FakeLamps()
+        port = await lamps.start()
+        await lamps.stop()
+        lamp = YeelinkClient(Device(vendor='yeelink', id='127.0.0.1', name='lamp'))
+        lamp.port = port
+        recovered = []
+        lamp.on_recovery = recovered.append
+        dispatcher = Dispatcher()
+
+        await dispatcher.dispatch({lamp: [('set_power', True)]})
+        await dispatcher.join()
+        assert not lamp.availability.online and lamp.state == dict()
+        await dispatcher.dispatch({lamp: [('set_power', False)]})
+        assert len(lamp.outbox) == 0 and lamp.desired == {'set_power': False}
+
+        lamp.port = await lamps.start()
+        lamp.availability.retry_at = 0
+        await dispatcher.dispatch({lamp: list(lamp.desired.items())})
+        await dispatcher.join()
+        assert lamp.availability.online and recovered == [lamp]
+        assert lamp.state == {'set_power': False}
+        lamp.transport.close_all()
+        await lamps.stop()
+
+    asyncio.run(scenario())
+
+
+def test_own_publish_echo_is_not_proof_of_life(tmp_path, mqtt_client):
+    store = SQLiteStore(str(tmp_path / 'state.db'))
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'), Broker(ip='127.0.0.1', protocol=5),
+                          store)
+    cabinet.broker.connection.client = mqtt_client
+    cabinet.feed('cabinet/speed', b'3')
+    cabinet.mark_offline('no feedback for 60 seconds')
+    assert store.dirty[('cabinet', 'state', 'speed')] is DELETED, 'stale state is not restored after restart'
+
+    assert asyncio.run(cabinet.publish('speed', 5))
+    last_seen = cabinet.last_seen
+    cabinet.feed('cabinet/speed', b'5')
+    assert not cabinet.availability.online and cabinet.last_seen == last_seen
+    cabinet.feed('cabinet/speed', b'5')
+    assert cabinet.availability.online
+    store.close()
@@ -0,0 +1,11 @@
+import asyncio
+
+from mqtt_automator.bench.runner import run_benchmark
+
+
+def test_benchmark_smoke():
+    report = asyncio.run(run_benchmark(devices=6, rules=2, messages=100, ticks=2))
+    assert report['devices'] == 6
+    assert report['publishes'] > 0
+    assert report['feedback_msg_per_s'] > 0
+    assert set(report['tick_ms']) == {'p50', 'p90', 'p99', 'max'}
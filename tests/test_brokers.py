@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.bench.broker import FakeBroker
+from mqtt_automator.broker import Broker
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.vakio import VakioClient
+
+
+def test_devices_are_assigned_to_brokers(edit_config):
+    def change(config):
+        config['brokers'] = {'building2': {'ip': '192.168.2.2', 'protocol': 5, 'vendors': ['lytko']}}
+        config['vakio']['restroom']['broker'] = 'building2'
+
+    config = ConfigParser(edit_config(change))
+    assert list(config.brokers) == ['default', 'building2']
+    assert {device.name: config.broker_for(device).name for device in config.get_devices()} == {
+        'cabinet': 'default', 'restroom': 'building2', 'floor': 'building2', 'light1': 'default', 'light2': 'default'
+    }
+
+    def unknown(config):
+        config['vakio']['restroom']['broker'] = 'building3'
+
+    with pytest.raises(ValueError, match='Unknown broker building3'):
+        ConfigParser(edit_config(unknown))
+
+
+def test_feedback_and_publishes_are_routed_by_broker(edit_config):
+    async def wait_for(condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        first, second = FakeBroker(), FakeBroker()
+        first_port, second_port = await first.start(), await second.start()
+
+        def change(config):
+            config['app'] = {'log_level': 'WARNING'}
+            config['broker'] = {'ip': '127.0.0.1', 'port': first_port, 'protocol': 4}
+            config['brokers'] = {'building2': {'ip': '127.0.0.1', 'port': second_port, 'protocol': 4}}
+            config['lytko']['floor']['broker'] = 'building2'
+            del config['yeelink']
+
+        automator = Automator(edit_config(change))
+        feedback = asyncio.create_task(automator.feedback())
+        try:
+            floor, cabinet = automator.devices['floor'], automator.devices['cabinet']
+            state = json.dumps({'heating': 'heat', 'target_temp': 23})
+            second.publish('climate/lytko/12345/state', state, retain=True)
+            first.publish('climate/lytko/12345/state', json.dumps({'heating': 'off', 'target_temp': 5}), retain=True)
+            first.publish('cabinet/speed', '3', retain=True)
+            await wait_for(lambda: floor.state and cabinet.state)
+            await asyncio.sleep(0.05)
+            assert floor.state == {'mode': 'on', 'temperature': 23}
+
+            await automator.tick(datetime(2024, 5, 13, 13, 0))
+            await automator.dispatcher.join()
+            assert {topic for _, topic, _ in second.received} == {'climate/lytko/12345/temperature/set'}
+            assert 'climate/lytko/12345/temperature/set' not in {topic for _, topic, _ in first.received}
+            assert 'cabinet/speed' in {topic for _, topic, _ in first.received}
+        finally:
+            feedback.cancel()
+            await asyncio.gather(feedback, return_exceptions=True)
+            await first.stop()
+            await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_order_and_state(mqtt_client):
+    async def scenario():
+        cabinet = VakioClient(Device(vendor='vakio', id='cabinet_mqtt', name='cabinet'),
+                              Broker(ip='127.0.0.1', protocol=5))
+        connection = cabinet.broker.connection
+        assert not await cabinet.publish('speed', 3), 'queued while disconnected'
+        assert not await cabinet.publish('state', 'on')
+        queued = [('cabinet_mqtt/speed', 3), ('cabinet_mqtt/state', 'on')]
+        assert cabinet.state == dict() and list(connection.queue) == queued
+
+        connection.client, mqtt_client.failing = mqtt_client, True
+        async with asyncio.timeout(1):
+            await connection.flush()  # the link dropped again, flush must not spin on the same message
+        assert list(connection.queue) == queued
+
+        mqtt_client.failing = False
+        await connection.flush()
+        assert mqtt_client.published == queued and not connection.queue
+        assert await cabinet.publish('speed', 4) and cabinet.state == {'speed': 4}
+
+    asyncio.run(scenario())
+
+
+def test_reload_moves_devices_between_brokers(edit_config):
+    def change(config):
+        config['brokers'] = {'building2': {'ip': '192.168.2.2', 'protocol': 5, 'vendors': ['lytko']}}
+
+    automator = Automator(edit_config(change))
+    cabinet, floor = automator.devices['cabinet'], automator.devices['floor']
+    assert floor.broker.name == 'building2' and cabinet.broker.name == 'default'
+    assert ('building2', 'cabinet/speed') not in automator.readiness.expected
+    automator.handle('cabinet/speed', b'3', broker='building2')
+    assert ('default', 'cabinet/speed') in automator.readiness.expected, 'topic of another broker is not seen'
+
+    edit_config(lambda config: config['brokers']['building2'].update(vendors=['lytko', 'vakio']))
+    asyncio.run(automator.reload())
+    moved = automator.devices['cabinet']
+    assert moved is not cabinet and moved.broker is automator.config.brokers['building2']
+    assert automator.devices['floor'] is floor
+    assert automator.routes['building2'].match('cabinet/speed') == (moved,)
+    assert automator.routes['default'].match('cabinet/speed') == ()
@@ -59,3 +59,39 @@ def test_get_active_sub_rules_at_work(config):
     assert list(config.get_active_sub_rules(cabinet[2]['sub_rules'])) == [
         ('before_meetings', {'hours': '11-15', 'minutes': '55-59', 'action': {'speed': 7}})
     ]
+
+
+def test_compiled_config_cache(tmp_path, monkeypatch):
+    config_file, cache = tmp_path / 'config.yml', str(tmp_path / '.config.yml.cache')
+    config_file.write_text(Path('examples/config_example.yml').read_text('utf-8'), 'utf-8')
+    parsed = ConfigParser(str(config_file), cache=cache)
+    assert Path(cache).exists()
+
+    monkeypatch.setattr('yaml.load', lambda *args, **kwargs: pytest.fail('cached config must not be parsed'))
+    cached = ConfigParser(str(config_file), cache=cache)
+    assert list(cached.get_devices()) == list(parsed.get_devices())
+    assert cached.schedule.starts == parsed.schedule.starts and len(cached.schedule) == len(parsed.schedule)
+    assert cached.settings == parsed.settings and cached.broker.model_dump() == parsed.broker.model_dump()
+    with freezegun.freeze_time('2024-05-17 14:58'):
+        assert list(cached.get_active_rules()) == list(parsed.get_active_rules())
+
+    config_file.write_text(config_file.read_text('utf-8').replace('log_level: INFO', 'log_level: DEBUG'), 'utf-8')
+    with pytest.raises(pytest.fail.Exception):
+        ConfigParser(str(config_file), cache=cache)
+
+
+def test_config_cache_of_another_user_is_ignored(tmp_path, monkeypatch):
+    config_file, cache = tmp_path / 'config.yml', tmp_path / 'config.cache'
+    config_file.write_text(Path('examples/config_example.yml').read_text('utf-8'), 'utf-8')
+    ConfigParser(str(config_file), cache=str(cache))
+    assert cache.stat().st_mode & 0o777 == 0o600
+
+    cache.chmod(0o666)
+    parsed = []
+    monkeypatch.setattr('mqtt_automator.config.parser.ConfigParser.load_brokers',
+                        lambda self, load=ConfigParser.load_brokers: parsed.append(1) or load(self))
+    ConfigParser(str(config_file), cache=str(cache))
+    assert parsed == [1], 'cache writable by others is not unpickled'
+    monkeypatch.setattr('os.getuid', lambda: cache.stat().st_uid + 1)
+    ConfigParser(str(config_file), cache=str(cache))
+    assert parsed == [1, 1], 'cache of another user is not unpickled'
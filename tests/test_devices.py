@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.bench.fleet import FakeLamps
+from mqtt_automator.bench.imports import profile_startup
+from mqtt_automator.broker import Broker
+from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.lytko import LytkoClient
+from mqtt_automator.devices.registry import ClientRegistry
+from mqtt_automator.devices.vakio import VakioClient
+from mqtt_automator.devices.yeelink import ParentProber, YeelinkClient
+
+
+def test_unchanged_payload_is_not_decoded(monkeypatch, mqtt_client):
+    floor = LytkoClient(Device(vendor='lytko', id='12345', name='floor'), Broker(ip='127.0.0.1', protocol=5))
+    floor.broker.connection.client = mqtt_client
+    topic, payload = 'climate/lytko/12345/state', json.dumps({'heating': 'heat', 'target_temp': '23.0'}).encode()
+    decoded = []
+    monkeypatch.setattr(floor, 'json_loads', lambda raw: decoded.append(raw) or json.loads(raw))
+
+    assert floor.feed(topic, payload)
+    assert not floor.feed(topic, payload)
+    assert floor.state == {'mode': 'on', 'temperature': 23}
+    assert len(decoded) == 1
+
+    asyncio.run(floor.publish('temperature', 18))
+    assert floor.feed(topic, payload), 'device rejected the command, previous payload must be handled again'
+    assert floor.state == {'mode': 'on', 'temperature': 23}
+    assert 'temperature' in floor.block
+
+
+def test_vakio_sub_topics_are_parsed_once():
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet_mqtt', name='cabinet'))
+    assert cabinet.sub_topics == {
+        'cabinet_mqtt/state': 'state', 'cabinet_mqtt/workmode': 'workmode', 'cabinet_mqtt/speed': 'speed'
+    }
+    cabinet.feed('cabinet_mqtt/speed', b'5')
+    assert cabinet.state == {'speed': 5}
+
+
+def test_yeelink_connection_is_reused_and_restored():
+    async def scenario():
+        lamps = FakeLamps()
+        port = await lamps.start()
+        lamp = YeelinkClient(Device(vendor='yeelink', id='127.0.0.1', name='lamp'))
+        lamp.port = port
+        try:
+            assert await lamp.publish('set_power', True)
+            connection = lamp.transport.connections['127.0.0.1', port]
+            assert await lamp.publish('set_power', False)
+            assert lamp.transport.connections['127.0.0.1', port] is connection
+
+            connection.writer.close()
+            await asyncio.sleep(0.01)
+            assert await lamp.publish('set_power', True)
+            assert lamp.transport.connections['127.0.0.1', port] is not connection
+            await asyncio.sleep(0.01)
+            assert [method for _, method in lamps.received] == ['set_power'] * 3
+        finally:
+            lamp.transport.close_all()
+            await lamps.stop()
+
+    asyncio.run(scenario())
+
+
+def test_silent_lamp_is_offline_and_transport_is_per_automator():
+    async def scenario():
+        server = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)  # accepts, never answers
+        lamp = YeelinkClient(Device(vendor='yeelink', id='127.0.0.1', name='lamp'))
+        lamp.port, lamp.transport.answer_timeout = server.sockets[0].getsockname()[1], 0.05
+        async with server:
+            assert not await lamp.publish('set_power', True)
+        lamp.transport.close_all()
+        assert not lamp.availability.online and lamp.state == dict()
+
+    asyncio.run(scenario())
+    first, second = Automator('examples/config_example.yml'), Automator('examples/config_example.yml')
+    assert first.devices['light1'].transport is first.devices['light2'].transport
+    assert first.devices['light1'].transport is not second.devices['light1'].transport
+    assert first.devices['light1'].prober is not YeelinkClient(Device(vendor='yeelink', id='l', name='l')).prober
+    assert first.devices['light1'].transport.timeout == first.config.settings.publish_timeout
+
+
+def test_lamp_retries_fit_in_publish_timeout():
+    async def scenario():
+        server = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)  # accepts, never answers
+        lamp = YeelinkClient(Device(vendor='yeelink', id='127.0.0.1', name='lamp'))
+        lamp.port = server.sockets[0].getsockname()[1]
+        lamp.share({'publish_timeout': 0.1})
+        started_at = time.monotonic()
+        async with server:
+            assert not await lamp.publish('set_power', True)  # answer_timeout alone is 2 seconds per attempt
+        assert time.monotonic() - started_at < 1
+        assert not lamp.transport.connections and not lamp.availability.online
+
+    asyncio.run(scenario())
+
+
+def test_parent_probe_is_shared_and_cached(monkeypatch):
+    probes = []
+
+    async def ping(host, timeout):
+        probes.append(host)
+        await asyncio.sleep(0.01)
+        return host == 'router'
+
+    async def scenario():
+        prober = ParentProber()
+        monkeypatch.setattr('mqtt_automator.icmp.ping', ping)
+        assert await asyncio.gather(*(prober.is_alive('router') for _ in range(10))) == [True] * 10
+        assert await prober.is_alive('router')
+        assert not await prober.is_alive('switch')
+        assert probes == ['router', 'switch']
+
+    asyncio.run(scenario())
+
+
+def test_registry_imports_only_used_vendors(tmp_path):
+    config = tmp_path / 'config.yml'
+    config.write_text("broker: {ip: 127.0.0.1, protocol: 5}\nvakio:\n  cabinet: {device: vakio1}\n", 'utf-8')
+    startup = profile_startup(str(config))
+    modules = {item.module for item in startup.imports}
+    assert startup.vendors == ['vakio']
+    assert not modules & {'mqtt_automator.devices.lytko', 'mqtt_automator.devices.yeelink', 'aiomqtt', 'orjson'}
+    assert 'sqlite3' not in modules, 'no state_file'
+
+
+def test_registry_entry_points():
+    registry = ClientRegistry()
+    registry.plugins = {'shelly': 'mqtt_automator.devices.vakio:VakioClient'}
+    assert 'shelly' in registry and 'tuya' not in registry
+    assert registry['shelly'] is VakioClient
+    registry['vakio'] = LytkoClient
+    assert registry['vakio'] is LytkoClient and registry['yeelink'] is YeelinkClient
+    assert sorted(registry) == ['lytko', 'shelly', 'vakio', 'yeelink']
+    with pytest.raises(KeyError):
+        registry['tuya']  # pylint: disable=pointless-statement
+
+
+def test_state_is_kept_in_shared_table():
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet_mqtt', name='cabinet'))
+    floor = LytkoClient(Device(vendor='lytko', id='12345', name='floor'))
+    assert not hasattr(cabinet, '__dict__') and not hasattr(floor, '__dict__')
+    cabinet.feed('cabinet_mqtt/speed', b'5')
+    floor.feed('climate/lytko/12345/state', json.dumps({'heating': 'off', 'target_temp': 20}).encode())
+    floor.desired['temperature'] = 23
+    rows = {cabinet.row: 'cabinet', floor.row: 'floor'}
+    assert cabinet.table.snapshot('state', rows) == {
+        'cabinet': {'speed': 5}, 'floor': {'mode': 'off', 'temperature': 20},
+    }
+    assert cabinet.table.snapshot('desired', rows) == {'floor': {'temperature': 23}}
+    assert floor.snapshot()['desired'] == {'temperature': 23}
+
+    row = floor.row
+    floor.close()
+    assert floor.row is None and cabinet.table.snapshot('state', rows) == {'cabinet': {'speed': 5}}
+    lamp = YeelinkClient(Device(vendor='yeelink', id='127.0.0.1', name='lamp'))
+    assert lamp.row == row and lamp.state == dict() and lamp.desired == dict()
+
+
+def test_closed_client_does_not_touch_reused_row():
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'))
+    assert VakioClient.publish_interval == 0.5 and LytkoClient.publish_interval == 0
+    cabinet.close()
+    hall = VakioClient(Device(vendor='vakio', id='hall', name='hall'))
+    with pytest.raises(LookupError):
+        cabinet.state['speed'] = 3
+    with pytest.raises(LookupError):
+        cabinet.feed('cabinet/speed', b'3')
+    assert hall.state == dict()
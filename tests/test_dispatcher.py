@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from mqtt_automator.devices.base import BaseClient, Device
+from mqtt_automator.dispatcher import Dispatcher
+
+
+class SlowClient(BaseClient):
+    def __init__(self, name, delay, journal):
+        super().__init__(Device(vendor='slow', id=name, name=name))
+        self.delay, self.journal = delay, journal
+
+    async def publish(self, sub_topic: str, payload, manual: bool = False):
+        await asyncio.sleep(self.delay)
+        self.journal.append((self.device.name, sub_topic, payload))
+        return True
+
+    def receive(self, topic, payload):
+        raise NotImplementedError
+
+    def subscriptions(self):
+        return ()
+
+    def build_topic_name(self, sub_topic) -> str:
+        return sub_topic
+
+
+async def dispatch_and_join(dispatcher, *ticks):
+    for actions in ticks:
+        await dispatcher.dispatch(actions)
+    await dispatcher.join()
+
+
+def test_devices_are_published_concurrently_in_order():
+    journal = []
+    fast, slow = SlowClient('fast', 0.01, journal), SlowClient('slow', 0.1, journal)
+    started_at = time.monotonic()
+    asyncio.run(dispatch_and_join(Dispatcher(), {
+        slow: [('state', 'on'), ('speed', 4)],
+        fast: [('state', 'on'), ('speed', 4)],
+    }))
+    assert time.monotonic() - started_at < 0.3
+    assert [item for item in journal if item[0] == 'slow'] == [('slow', 'state', 'on'), ('slow', 'speed', 4)]
+    assert journal[:2] == [('fast', 'state', 'on'), ('fast', 'speed', 4)]
+
+
+def test_publish_deadline():
+    journal = []
+    stuck, fast = SlowClient('stuck', 10, journal), SlowClient('fast', 0, journal)
+    started_at = time.monotonic()
+    asyncio.run(dispatch_and_join(Dispatcher(timeout=0.1), {stuck: [('state', 'on')], fast: [('state', 'on')]}))
+    assert time.monotonic() - started_at < 1
+    assert journal == [('fast', 'state', 'on')]
+
+
+def test_pending_writes_are_coalesced():
+    journal = []
+    client = SlowClient('vakio', 0.05, journal)
+    asyncio.run(dispatch_and_join(
+        Dispatcher(),
+        {client: [('state', 'on'), ('speed', 3)]},
+        {client: [('speed', 5), ('speed', 7), ('workmode', 'recuperator')]},
+    ))
+    assert journal == [
+        ('vakio', 'state', 'on'),
+        ('vakio', 'speed', 7),
+        ('vakio', 'workmode', 'recuperator'),
+    ]
+    assert client.outbox.coalesced == 2
+    assert client.outbox.sent == 3
+
+
+def test_publish_interval():
+    journal = []
+    client = SlowClient('vakio', 0, journal)
+    started_at = time.monotonic()
+    asyncio.run(dispatch_and_join(Dispatcher(intervals={'slow': 0.1}), {client: [('state', 'on'), ('speed', 3), ('workmode', 'inflow')]}))
+    assert time.monotonic() - started_at >= 0.3
+    assert len(journal) == 3
@@ -0,0 +1,60 @@
+import asyncio
+
+from mqtt_automator.ingest import Ingest
+
+
+def test_coalescing_and_batches():
+    handled, ticks = [], []
+
+    async def scenario():
+        ingest = Ingest(lambda topic, payload: handled.append((topic, payload)))
+        ingest.batch_size = 2
+        coalesced = ingest.coalesced.value
+        for topic, payload in (('a/speed', b'1'), ('b/speed', b'1'), ('a/speed', b'2'), ('c/speed', b'1')):
+            ingest.put(topic, payload)
+        assert ingest.coalesced.value == coalesced + 1
+
+        async def ticker():
+            while True:
+                ticks.append(len(handled))
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.create_task(ingest.run()), asyncio.create_task(ticker())]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(scenario())
+    assert handled == [('a/speed', b'2'), ('b/speed', b'1'), ('c/speed', b'1')]
+    assert 2 in ticks, 'event loop got control between batches'
+
+
+def test_buffer_limit():
+    ingest = Ingest(lambda topic, payload: None)
+    ingest.max_pending = 2
+    dropped = ingest.dropped.value
+    for topic in ('a', 'b', 'c', 'a'):
+        ingest.put(topic, b'1')
+    assert len(ingest) == 2
+    assert ingest.dropped.value == dropped + 1
+
+
+def test_failing_handler_does_not_stop_ingest(caplog):
+    handled = []
+
+    def handler(topic, payload):
+        if topic == 'bad':
+            raise RuntimeError('broken client')
+        handled.append(topic)
+
+    async def scenario():
+        ingest = Ingest(handler)
+        task = asyncio.create_task(ingest.run())
+        for topic in ('bad', 'good'):
+            ingest.put(topic, b'1')
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert handled == ['good'] and 'Failed to handle bad' in caplog.text
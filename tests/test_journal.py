@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+from pathlib import Path
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.bench.runner import replay
+from mqtt_automator.journal import Entry, Journal, files, read, read_all, shard_paths
+from mqtt_automator.simulator import compare
+
+
+def test_rotate_filter_and_truncated_tail(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal = Journal(path, max_size=300, keep=2)
+    for speed in range(20):
+        journal.received('cabinet', 'cabinet/speed', str(speed).encode())
+        journal.published('floor', 'temperature', 20 + speed)
+        journal.flush()
+    journal.changed(1, 'block', 'cabinet', 'speed', None)
+    journal.flush()
+    assert files(path) == [f'{path}.2', f'{path}.1', path], 'older files are dropped'
+
+    entries = list(read(path))
+    assert [entry.kind for entry in entries][-3:] == ['received', 'publish', 'block']
+    assert entries[-1] == Entry(entries[-1].at, 'block', 'cabinet', 'speed', b'null')
+    speeds = [entry.decoded() for entry in read(path, devices=['cabinet'], kinds=['received'])]
+    assert len(speeds) < 20 and speeds == [str(speed) for speed in range(20 - len(speeds), 20)]
+    assert not list(read(path, since=entries[-1].at + 1))
+
+    with open(path, 'ab') as file:
+        file.write(b'\x00' * 20)  # a crash in the middle of a record
+    assert list(read(path)) == entries
+
+
+def test_automator_journal_and_replay(tmp_path, capsys):
+    config = tmp_path / 'config.yml'
+    config.write_text(Path('examples/config_example.yml').read_text('utf-8').replace(
+        'app:\n', f'app:\n  journal_file: {tmp_path / "journal"}\n  journal_flush_interval: 0.1\n', 1), 'utf-8')
+    automator = Automator(str(config))
+    try:
+        automator.handle('cabinet/speed', b'3')
+        automator.handle('cabinet/speed', b'5')
+    finally:
+        automator.journal.close()
+    assert automator.journal.changed not in automator.devices['cabinet'].table.listeners
+    entries = [entry[1:] for entry in read(automator.journal.path, devices=['cabinet'])]
+    assert entries == [
+        ('received', 'cabinet', 'cabinet/speed', b'3'),
+        ('state', 'cabinet', 'speed', b'3'),
+        ('received', 'cabinet', 'cabinet/speed', b'5'),
+        ('block', 'cabinet', 'speed', json.dumps(automator.devices['cabinet'].block['speed'], default=str).encode()),
+        ('state', 'cabinet', 'speed', b'5'),
+    ]
+
+    report = replay(str(config), read(automator.journal.path))
+    assert report['messages'] == 2 and report['devices_with_state'] == 1
+    assert len(list(read(automator.journal.path))) == len(entries), 'replay is not journaled'
+
+    monday = datetime(2024, 5, 13)
+    compare(str(config), [
+        Entry(monday.replace(hour=11, minute=56).timestamp(), 'publish', 'cabinet', 'speed', b'7'),
+        Entry(monday.replace(hour=11, minute=58).timestamp(), 'publish', 'cabinet', 'speed', b'2'),
+    ], Automator.client_map)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('  Mon 2024-05-13 11:56:00 cabinet speed 7 <- at_work/before_meetings=7')
+    assert lines[1].startswith('! Mon 2024-05-13 11:58:00 cabinet speed 2 <- at_work/before_meetings=7')
+    assert lines[2] == '2 publishes, 1 not wanted by the schedule'
+
+
+def test_shard_journals_are_merged(tmp_path):
+    path = str(tmp_path / 'journal')
+    shards = [Journal(f'{path}.shard{shard}') for shard in range(2)]
+    for speed in range(4):
+        shards[speed % 2].received(f'fan{speed % 2}', f'fan{speed % 2}/speed', str(speed).encode())
+        shards[speed % 2].flush()
+    for journal in shards:
+        journal.close()
+    Journal(f'{path}.shard0.1').close()  # rotated file is read with its journal
+    assert shard_paths(path) == [path, f'{path}.shard0', f'{path}.shard1']
+    assert [entry.decoded() for entry in read_all(shard_paths(path))] == ['0', '1', '2', '3']
+    assert [entry.device for entry in read_all(shard_paths(path), devices=['fan1'])] == ['fan1', 'fan1']
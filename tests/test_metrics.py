@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.metrics import Metric, Registry
+from mqtt_automator.web import Request, Response, WebServer
+
+
+def test_histogram_rendering():
+    latency = Metric('latency_seconds', 'Latency', 'histogram', ('vendor',), buckets=(0.1, 1))
+    vakio = latency.labels('vakio')
+    assert latency.labels('vakio') is vakio
+    for value in (0.05, 0.1, 0.5, 3):
+        vakio.observe(value)
+    assert latency.render().splitlines()[2:] == [
+        'latency_seconds_bucket{vendor="vakio",le="0.1"} 2',
+        'latency_seconds_bucket{vendor="vakio",le="1"} 3',
+        'latency_seconds_bucket{vendor="vakio",le="+Inf"} 4',
+        'latency_seconds_sum{vendor="vakio"} 3.65',
+        'latency_seconds_count{vendor="vakio"} 4',
+    ]
+
+
+def test_scrape_over_http():
+    registry = Registry()
+    registry.add('reconnects_total', 'Reconnects', 'counter').inc(2)
+
+    async def serve_metrics(_: Request) -> Response:
+        return Response(body=registry.render().encode())
+
+    async def scrape(request: bytes) -> bytes:
+        server = await asyncio.start_server(WebServer({('GET', '/metrics'): serve_metrics}).handle, '127.0.0.1', 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(request)
+            response = await reader.read()
+            writer.close()
+            return response
+
+    response = asyncio.run(scrape(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n'))
+    assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert response.endswith(b'reconnects_total 2.0\n')
+    assert asyncio.run(scrape(b'GET /nope HTTP/1.1\r\n\r\n')).startswith(b'HTTP/1.1 404')
+    assert asyncio.run(scrape(b'POST /metrics HTTP/1.1\r\n\r\n')).startswith(b'HTTP/1.1 405')
+
+
+def test_rules_are_counted_only_for_handled_devices():
+    automator = Automator('examples/config_example.yml')
+    monday_noon = datetime(2024, 5, 13, 11, 57)
+    actions, evaluated, matched = automator.collect(monday_noon)
+    assert evaluated >= matched >= len(actions) > 1
+    per_device = [automator.collect(monday_noon, devices={client.device.name})[1:] for client in actions]
+    assert [sum(counts) for counts in zip(*per_device)] == [evaluated, matched]
+    assert automator.collect(monday_noon, devices=set()) == (dict(), 0, 0)
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.broker import Broker
+from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.overrides import Overrides, TimerWheel
+from mqtt_automator.devices.vakio import VakioClient
+
+
+def test_block_older_than_a_day_is_expired(mqtt_client):
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'), Broker(ip='127.0.0.1', protocol=5))
+    cabinet.broker.connection.client = mqtt_client
+    cabinet.overrides = Overrides()
+    cabinet.restore({'state': {'speed': 5}, 'block': {'speed': datetime.now() - timedelta(days=1, minutes=1)}})
+    assert not cabinet.overrides.blocked(cabinet, 'speed'), 'timedelta.seconds wrapped at one day'
+    assert asyncio.run(cabinet.publish('speed', 3))
+    assert cabinet.block == dict() and len(cabinet.overrides) == 0
+
+
+def test_override_durations():
+    overrides = Overrides(duration=100, vendor_durations={'vakio': 10})
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'))
+    cabinet.rule_overrides['speed'] = 1
+    assert overrides.duration_for(cabinet, 'speed') == 1
+    assert overrides.duration_for(cabinet, 'workmode') == 10
+    assert overrides.duration_for(VakioClient(Device(vendor='lytko', id='floor', name='floor')), 'speed') == 100
+
+    Automator.collect_actions([], cabinet, 'night', {'speed': 2})
+    assert cabinet.rule_overrides == dict(), 'rule without override keeps the vendor duration'
+    assert overrides.duration_for(cabinet, 'speed') == 10
+
+
+def test_client_without_automator_has_own_blocks():
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'))
+    assert cabinet.overrides is None
+    cabinet.set_block('speed', datetime.now() - timedelta(minutes=1))
+    assert cabinet.blocked('speed')
+    cabinet.set_block('speed', datetime.now() - timedelta(days=1))
+    assert not cabinet.blocked('speed')
+    cabinet.set_block('speed', None)
+    assert cabinet.block == dict()
+
+
+def test_desired_state_is_applied_when_block_expires(tmp_path, monkeypatch):
+    now = datetime.now()
+    path = tmp_path / 'config.yml'
+    path.write_text(
+        'broker: {ip: 127.0.0.1, protocol: 5}\n'
+        'app: {startup_timeout: 0, override_durations: {vakio: 60}}\n'
+        'vakio:\n'
+        '  cabinet:\n'
+        '    device: cabinet_mqtt\n'
+        f'    day: {{time: "{now - timedelta(hours=1):%H:%M}-{now + timedelta(hours=1):%H:%M}", '
+        'action: {speed: 3}, override: 0.05}\n',
+        'utf-8'
+    )
+
+    async def scenario():
+        automator = Automator(str(path))
+        automator.overrides.wheel = TimerWheel(resolution=0.01)
+        cabinet = automator.devices['cabinet']
+        dispatched = []
+
+        async def dispatch(actions):
+            dispatched.append({client.device.name: items for client, items in actions.items()})
+        monkeypatch.setattr(automator.dispatcher, 'dispatch', dispatch)
+
+        await automator.tick(datetime.now())
+        assert dispatched.pop() == {'cabinet': [('speed', 3)]}
+        cabinet.feed('cabinet_mqtt/speed', b'3')
+        cabinet.feed('cabinet_mqtt/speed', b'5')
+        assert 'speed' in cabinet.block and automator.overrides.duration_for(cabinet, 'speed') == 0.05
+
+        task = asyncio.create_task(automator.expire_overrides())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        assert cabinet.block == dict() and len(automator.overrides) == 0
+        assert dispatched == [{'cabinet': [('speed', 3)]}]
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import asyncio
+
+from mqtt_automator.readiness import Readiness
+
+
+def test_ready_when_all_topics_reported():
+    async def scenario():
+        readiness = Readiness()
+        readiness.expect('cabinet/state', 'cabinet')
+        readiness.expect('cabinet/speed', 'cabinet')
+        readiness.expect('climate/lytko/+/state', 'floor')
+        asyncio.get_running_loop().call_later(0.01, readiness.seen, 'cabinet/state')
+        asyncio.get_running_loop().call_later(0.02, readiness.seen, 'cabinet/speed')
+        return await readiness.wait(timeout=5)
+
+    assert asyncio.run(scenario())
+
+
+def test_timeout_reports_silent_devices(caplog):
+    async def scenario():
+        readiness = Readiness()
+        readiness.expect('cabinet/state', 'cabinet')
+        readiness.expect('restroom/state', 'restroom')
+        readiness.seen('cabinet/state')
+        return await readiness.wait(timeout=0.01)
+
+    assert not asyncio.run(scenario())
+    assert '1 devices never reported: restroom' in caplog.text
@@ -0,0 +1,69 @@
+import asyncio
+import os
+
+import pytest
+
+from mqtt_automator.automator import Automator
+
+
+def test_reload_diff(config_file, edit_config):
+    def change(config):
+        del config['vakio']['restroom']
+        config['vakio']['kitchen'] = {'day': {'time': '10:00-19:59', 'action': {'speed': 2}}}
+        config['yeelink']['light2']['parent'] = '192.168.1.1'
+        config['lytko']['floor']['day']['action']['temperature'] = 20
+
+    automator = Automator(str(config_file))
+    cabinet, floor, restroom = automator.devices['cabinet'], automator.devices['floor'], automator.devices['restroom']
+    cabinet.receive('cabinet/speed', '3')
+    restroom_row = restroom.row
+    compiled_cabinet, compiled_floor = automator.config.compiled['cabinet'][1], automator.config.compiled['floor'][1]
+
+    edit_config(change)
+    assert automator.config.is_modified()
+    asyncio.run(automator.reload())
+
+    assert not automator.config.is_modified()
+    assert set(automator.devices) == {'cabinet', 'kitchen', 'floor', 'light1', 'light2'}
+    assert automator.devices['cabinet'] is cabinet and cabinet.state == {'speed': 3}
+    assert restroom.row is None and automator.devices['kitchen'].row == restroom_row, 'row of removed device is reused'
+    assert automator.devices['floor'] is floor
+    assert automator.devices['light2'].device.parent == '192.168.1.1'
+    assert automator.config.compiled['cabinet'][1] is compiled_cabinet
+    assert automator.config.compiled['floor'][1] is not compiled_floor
+
+    subscriptions = automator.config.broker.connection.subscriptions
+    assert 'kitchen/+' in subscriptions and 'restroom/+' not in subscriptions
+    assert automator.routes['default'].match('kitchen/speed') == (automator.devices['kitchen'],)
+    assert automator.routes['default'].match('restroom/speed') == ()
+
+
+def test_broken_config_keeps_running_one(config_file):
+    automator = Automator(str(config_file))
+    config = automator.config
+    config_file.write_text('vakio: [', 'utf-8')
+    os.utime(config_file, (0, 0))
+    asyncio.run(automator.reload())
+    assert automator.config is config
+    assert not automator.config.is_modified()
+
+
+def test_reload_applies_settings(config_file, edit_config, caplog):
+    def change(config):
+        config['app'].update(concurrency=4, publish_timeout=1, publish_interval={'vakio': 2}, api_port=8080)
+
+    automator = Automator(str(config_file))
+    cabinet, semaphore = automator.devices['cabinet'], automator.dispatcher.semaphore
+    assert automator.dispatcher.intervals == dict() and cabinet.publish_interval == 0.5, 'class default'
+    edit_config(change)
+    asyncio.run(automator.reload())
+    assert automator.dispatcher.intervals == {'vakio': 2}
+    assert automator.dispatcher.timeout == 1 and automator.dispatcher.semaphore is not semaphore
+    assert automator.devices['light1'].transport.timeout == 1, 'lamp retries follow publish_timeout'
+    assert 'Changes of app settings api_port require restart' in caplog.text
+
+
+def test_parsed_config_is_not_parsed_again(config, monkeypatch):
+    monkeypatch.setattr('yaml.load', lambda *args, **kwargs: pytest.fail('config is parsed again'))
+    automator = Automator(config)
+    assert automator.config is config and set(automator.devices) == {device.name for device in config.get_devices()}
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+from mqtt_automator.config.parser import Rule
+from mqtt_automator.config.time_parser import match_time_range
+
+
+def brute_force_active_rules(config, now):
+    """Straightforward evaluation of the raw config, the way it was done before compilation"""
+    is_workday = now.isoweekday() <= 5
+    for vendor, devices in config.config.items():
+        if vendor in config.system_keys:
+            continue
+        common = devices.get('common', dict())
+        for device, rules in devices.items():
+            if device == 'common':
+                continue
+            for name, rule_ in (rules | common).items():
+                if name in config.device_keys:
+                    continue
+                rule = Rule(**rule_)
+                schedule = (rule.workday if is_workday else rule.weekend) or rule.time
+                if schedule and match_time_range(schedule, now.time()):
+                    yield device, name, rule.model_dump(exclude_unset=True)
+
+
+def test_schedule_matches_brute_force_for_whole_week(config):
+    monday = datetime(2024, 5, 13)
+    for minute in range(0, 7 * 24 * 60, 7):
+        now = monday + timedelta(minutes=minute)
+        assert list(config.get_active_rules(now)) == list(brute_force_active_rules(config, now)), now
+
+
+def test_schedule_segments_are_compact(config):
+    assert config.schedule.starts[0] == 0
+    assert config.schedule.starts == sorted(set(config.schedule.starts))
+    assert len(config.schedule.starts) < 200
+
+
+def test_last_minute_of_the_day_is_matched(config):
+    """match_time_range missed 23:59:01-23:59:59 for overnight ranges"""
+    rules = list(config.get_active_rules(datetime(2024, 5, 17, 23, 59, 30)))
+    assert ('light1', 'night', {'time': '23:00-18:59', 'action': {'set_power': False}}) in rules
+
+
+def test_sub_rules_with_explicit_time(config):
+    cabinet = next(config.get_active_rules(datetime(2024, 5, 17, 12, 5)))
+    assert list(config.get_active_sub_rules(cabinet[2]['sub_rules'], datetime(2024, 5, 17, 12, 5))) == [
+        ('meetings', {'hours': '12-15', 'minutes': '0-15', 'action': {'speed': 1}})
+    ]
+    assert list(config.get_active_sub_rules(cabinet[2]['sub_rules'], datetime(2024, 5, 17, 12, 30))) == [
+        ('fallback', {'action': {'speed': 3}})
+    ]
+
+
+@pytest.mark.parametrize('now, transition', (
+    ('2024-05-17 14:58:30', '2024-05-17 14:59'),  # before_meetings -> fallback
+    ('2024-05-17 14:59:00', '2024-05-17 18:00'),  # hours '12-15' excludes 15, next is cabinet day
+    ('2024-05-17 18:01:00', '2024-05-17 19:00'),  # yeelink evening
+    ('2024-05-17 23:30:00', '2024-05-18 06:00'),  # overnight rules continue through midnight
+    ('2024-05-19 23:30:00', '2024-05-20 00:00'),  # end of the week
+))
+def test_next_transition(config, now, transition):
+    assert config.schedule.next_transition(datetime.fromisoformat(now)) == datetime.fromisoformat(transition)
+
+
+def test_nothing_changes_between_transitions(config):
+    now = datetime(2024, 5, 13)
+    while now < datetime(2024, 5, 20):
+        transition = config.schedule.next_transition(now)
+        state = [(rule.name, rule.selection(now.hour * 60 + now.minute)) for rule in config.schedule.active(now)]
+        for minute in range(1, int((transition - now).total_seconds()) // 60):
+            moment = now + timedelta(minutes=minute)
+            assert state == [
+                (rule.name, rule.selection(moment.hour * 60 + moment.minute))
+                for rule in config.schedule.active(moment)
+            ], moment
+        now = transition
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+from mqtt_automator import metrics
+from mqtt_automator.bench.broker import FakeBroker
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.supervisor import Supervisor
+
+
+@pytest.mark.parametrize('shard_by', ['hash', 'vendor'])
+def test_devices_and_rules_are_split_between_shards(edit_config, shard_by):
+    path = edit_config(shards=3, shard_by=shard_by)
+    full = ConfigParser(path)
+    shards = [ConfigParser(path, shard=shard) for shard in range(3)]
+    names = [{device.name for device in config.get_devices()} for config in shards]
+    assert sorted(name for shard in names for name in shard) == sorted(device.name for device in full.get_devices())
+    assert sum(len(config.schedule) for config in shards) == len(full.schedule)
+    for config, devices in zip(shards, names):
+        assert {rule.device for rule in config.schedule.rules} <= devices
+    if shard_by == 'vendor':
+        for vendor in ('vakio', 'lytko', 'yeelink'):
+            assert sum(any(device.vendor == vendor for device in config.get_devices()) for config in shards) == 1
+
+
+def test_supervisor_merges_reports_and_restarts_workers(edit_config):
+    async def wait_for(condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.05)
+
+    async def scenario():
+        broker = FakeBroker()
+        port = await broker.start()
+
+        def change(config):
+            config['broker'] = {'ip': '127.0.0.1', 'port': port, 'protocol': 4}
+
+        path = edit_config(change, shards=2, shard_report_interval=0.1, log_level='WARNING')
+
+        supervisor = Supervisor(ConfigParser(path))
+        supervisor.min_restart_delay = 0.1
+        restarts = metrics.shard_restarts.labels('1')
+        restarts_before = restarts.value
+        task = asyncio.create_task(supervisor.run())
+        try:
+            await wait_for(lambda: len(supervisor.reports) == 2)
+            assert set(supervisor.snapshot()) == {'cabinet', 'restroom', 'floor', 'light1', 'light2'}
+            online = supervisor.registry().metrics['mqtt_automator_device_online']
+            assert online.children['lytko', 'floor'].value == 1 and online.children['vakio', 'cabinet'].value == 1
+
+            pid = supervisor.processes[1].pid
+            os.kill(pid, signal.SIGKILL)
+            await wait_for(lambda: restarts.value > restarts_before and supervisor.processes[1].pid != pid)
+            await wait_for(lambda: supervisor.processes[1].is_alive())
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await broker.stop()
+        assert not any(process.is_alive() for process in supervisor.processes.values())
+
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from mqtt_automator.automator import Automator
+from mqtt_automator.config.parser import ConfigParser
+from mqtt_automator.simulator import Publish, Simulator
+
+
+def minute_by_minute(config, clients, start, end):
+    """Every minute every active rule is applied, publishes are filtered by state-match"""
+    state = {device: dict() for device in clients}
+    now = start
+    while now < end:
+        actions = dict()
+        for device, _, rule in config.get_active_rules(now):
+            items = actions.setdefault(device, dict())
+            items.update(rule.get('action') or dict())
+            for _, sub_rule in config.get_active_sub_rules(rule.get('sub_rules') or dict(), now):
+                items.update(sub_rule['action'])
+        for device, items in actions.items():
+            for sub_topic, payload in items.items():
+                payload = clients[device].normalize(payload)
+                if payload == 'icmp':
+                    payload = True
+                if state[device].get(sub_topic) != payload:
+                    state[device][sub_topic] = payload
+                    yield Publish(now, device, sub_topic, payload)
+        now += timedelta(minutes=1)
+
+
+def test_simulator_matches_minute_by_minute_evaluation():
+    config = ConfigParser('examples/config_example.yml')
+    simulator = Simulator(config, Automator.client_map)
+    start = datetime(2024, 5, 15, 13, 7)
+    end = start + timedelta(days=8)
+    expected = list(minute_by_minute(config, simulator.clients, start, end))
+    assert list(simulator.run(start, end)) == expected
+    assert simulator.ticks < (end - start).total_seconds() / 60 / 20
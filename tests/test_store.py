@@ -0,0 +1,44 @@
+import asyncio
+from datetime import datetime
+
+from mqtt_automator.devices.base import Device
+from mqtt_automator.devices.vakio import VakioClient
+from mqtt_automator.store import SQLiteStore
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = SQLiteStore(path)
+    cabinet = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'), store=store)
+    cabinet.receive('cabinet/speed', '3')
+    cabinet.receive('cabinet/speed', '5')
+    cabinet.receive('cabinet/state', 'on')
+    assert 'speed' in cabinet.block
+    assert not SQLiteStore(path).load(), 'nothing is written before flush'
+
+    store.flush(store.dirty)
+    store.close()
+
+    restarted = VakioClient(Device(vendor='vakio', id='cabinet', name='cabinet'))
+    restarted.restore(SQLiteStore(path).load()['cabinet'])
+    assert restarted.state == {'speed': 5, 'state': 'on'}
+    assert restarted.block == cabinet.block
+
+
+def test_unblock_and_shutdown_flush(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = SQLiteStore(path, interval=60)
+    store.put_block('cabinet', 'speed', datetime(2024, 5, 17, 12, 0))
+    store.flush(store.dirty)
+    store.dirty.clear()
+    store.put_block('cabinet', 'speed', None)
+    store.put_state('cabinet', 'speed', 7)
+
+    async def shutdown():
+        task = asyncio.create_task(store.run())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(shutdown())
+    assert SQLiteStore(path).load() == {'cabinet': {'state': {'speed': 7}, 'block': dict()}}
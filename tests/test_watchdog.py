@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+
+from mqtt_automator import metrics
+from mqtt_automator.watchdog import Watchdog, loop_factory
+
+
+def blocking_receive():
+    time.sleep(0.2)
+
+
+def test_blocked_loop_is_logged_with_stack(caplog):
+    async def scenario():
+        watchdog = Watchdog(threshold=0.05, interval=0.01)
+        task = asyncio.create_task(watchdog.run())
+        await asyncio.sleep(0.05)
+        started_at = watchdog.start('receive', 'cabinet')
+        blocking_receive()
+        watchdog.finish(started_at)
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return watchdog
+
+    with caplog.at_level(logging.WARNING, 'mqtt_automator.watchdog'):
+        watchdog = asyncio.run(scenario())
+    assert watchdog.stalls == 1
+    stall, slow = [record.getMessage() for record in caplog.records]
+    assert 'blocked' in stall and ' in receive of cabinet, stack:' in stall and 'in blocking_receive' in stall
+    assert slow.startswith('Slow receive of cabinet blocked event loop for 0.2')
+    assert metrics.loop_lag.labels('asyncio').count > 0
+
+
+def test_timed_counts_only_blocking_steps(caplog):
+    async def publish():
+        await asyncio.sleep(0.1)
+        time.sleep(0.06)
+        return True
+
+    async def failing():
+        await asyncio.sleep(1)
+
+    async def scenario():
+        watchdog = Watchdog(threshold=0.05)
+        histogram = metrics.handler_duration.labels('publish')
+        count, total = histogram.count, histogram.sum
+        assert await watchdog.timed('publish', 'floor', publish())
+        assert histogram.count == count + 1 and 0.06 <= histogram.sum - total < 0.1
+        try:
+            async with asyncio.timeout(0.01):
+                await watchdog.timed('publish', 'floor', failing())
+        except TimeoutError:
+            pass
+        assert histogram.count == count + 2 and watchdog.handler is None
+
+    with caplog.at_level(logging.WARNING, 'mqtt_automator.watchdog'):
+        asyncio.run(scenario())
+    assert [record.getMessage()[:40] for record in caplog.records] == ['Slow publish of floor blocked event loop']
+
+
+def test_missing_uvloop_falls_back_to_asyncio(caplog, monkeypatch):
+    monkeypatch.setattr('importlib.import_module', lambda name: (_ for _ in ()).throw(ImportError(name)))
+    assert loop_factory('uvloop') is None
+    assert 'uvloop is not installed' in caplog.text